@@ -0,0 +1,127 @@
+import subprocess
+import signal
+import socket
+import struct
+import os
+import re
+
+from constants import *
+
+IFF_UP = 0x1
+
+def read_sysfs(dev, name):
+  try:
+    f = open('/sys/class/net/%s/%s' % (dev, name), 'r')
+    contents = f.read().strip()
+    f.close()
+  except OSError:
+    # reading carrier of a device that is down fails with EINVAL
+    return None
+  return contents
+
+def default_route(dev):
+  # (gateway, metric) of the IPv4 default route through dev, or None
+  try:
+    f = open('/proc/net/route', 'r')
+    lines = f.read().split('\n')[1:]
+    f.close()
+  except OSError:
+    return None
+  for line in lines:
+    fields = line.split()
+    if len(fields) < 7 or fields[0] != dev or fields[1] != '00000000':
+      continue
+    gateway = socket.inet_ntoa(struct.pack('<I', int(fields[2], 16)))
+    return gateway, int(fields[6])
+  return None
+
+def find_daemon(name, dev):
+  # pid of a running `name` whose command line mentions dev, or None
+  for entry in os.listdir('/proc'):
+    if not entry.isdigit():
+      continue
+    try:
+      f = open('/proc/%s/cmdline' % (entry), 'rb')
+      argv = f.read().decode('utf-8', 'replace').split('\0')
+      f.close()
+    except OSError:
+      continue
+    if os.path.basename(argv[0]) != name:
+      continue
+    if dev in argv or ('-i' + dev) in argv:
+      return int(entry)
+  return None
+
+def wifi_link(dev):
+  # (bssid, ssid, freq) the device is associated with, or None
+  try:
+    output = subprocess.check_output([IW, 'dev', dev, 'link'], timeout=2).decode('utf-8', 'replace')
+  except (OSError, subprocess.SubprocessError):
+    return None
+  m = re.search(r'^Connected to ([0-9a-fA-F:]{17})', output, re.M)
+  if m == None:
+    return None
+  ssid = re.search(r'^\s*SSID: (.*)$', output, re.M)
+  freq = re.search(r'^\s*freq: (\d+)', output, re.M)
+  if ssid == None:
+    return None
+  return m.group(1).lower(), ssid.group(1), int(freq.group(1)) if freq != None else 0
+
+class AdoptedProcess:
+  # a daemon a previous run (or someone else) started, with just enough of
+  # pexpect's interface for the supervisor and the kill paths
+  def __init__(self, pid, name):
+    self.pid = pid
+    self.name = name
+
+  def isalive(self):
+    try:
+      os.kill(self.pid, 0)
+    except ProcessLookupError:
+      return False
+    except PermissionError:
+      pass
+    return True
+
+  def kill(self, sig):
+    os.kill(self.pid, sig)
+
+  def close(self, force=True):
+    # not our child, so once it is gone there is nothing left to reap
+    if self.isalive():
+      self.kill(signal.SIGKILL if force else signal.SIGTERM)
+
+class LinkSnapshot:
+  __slots__ = ('dev', 'up', 'carrier', 'addrs', 'gateway', 'metric',
+               'dhcpcd', 'wpa_supplicant', 'link')
+
+  def __init__(self, dev):
+    self.dev = dev
+    self.up = False
+    self.carrier = False
+    self.addrs = []
+    self.gateway = None
+    self.metric = None
+    self.dhcpcd = None
+    self.wpa_supplicant = None
+    self.link = None
+
+  def connected(self):
+    # enough of a working configuration to keep instead of rebuilding it
+    return self.up and self.carrier and len(self.addrs) > 0 and self.gateway != None
+
+def inspect_link(link_backend, dev, wireless):
+  snapshot = LinkSnapshot(dev)
+  flags = read_sysfs(dev, 'flags')
+  snapshot.up = flags != None and int(flags, 16) & IFF_UP != 0
+  snapshot.carrier = read_sysfs(dev, 'carrier') == '1'
+  snapshot.addrs = [addr for addr in link_backend.list_addrs(dev) if ':' not in addr]
+  route = default_route(dev)
+  if route != None:
+    snapshot.gateway, snapshot.metric = route
+  snapshot.dhcpcd = find_daemon(os.path.basename(DHCPCD), dev)
+  if wireless:
+    snapshot.wpa_supplicant = find_daemon(os.path.basename(WPA_SUPPLICANT), dev)
+    if snapshot.wpa_supplicant != None and snapshot.carrier:
+      snapshot.link = wifi_link(dev)
+  return snapshot
@@ -0,0 +1,69 @@
+import resource
+import timeit
+import time
+import os
+
+# shared by the bench_*.py scripts, each runs standalone:
+#   python bench_<name>.py
+
+def best(fn, repeat=5):
+  # seconds per call, the best of `repeat` runs of ~0.2 seconds each
+  timer = timeit.Timer(fn)
+  number, elapsed = timer.autorange()
+  return min([elapsed] + timer.repeat(repeat - 1, number)) / number
+
+def cpu_seconds():
+  # this process and every child it has reaped, forks included
+  total = 0.0
+  for who in [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN]:
+    usage = resource.getrusage(who)
+    total += usage.ru_utime + usage.ru_stime
+  return total
+
+class Clock:
+  def __init__(self):
+    self.wall = 0.0
+    self.cpu = 0.0
+
+  def __enter__(self):
+    self.wall_start = time.perf_counter()
+    self.cpu_start = cpu_seconds()
+    return self
+
+  def __exit__(self, *exc):
+    self.wall += time.perf_counter() - self.wall_start
+    self.cpu += cpu_seconds() - self.cpu_start
+
+def report(name, value, unit):
+  if isinstance(value, float):
+    value = '%.2f' % (value)
+  print('%-52s %10s %s' % (name, value, unit))
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# 2.4 GHz channels 1-13 and the 5 GHz channels a full sweep visits
+CHANNELS = ([2412 + 5 * i for i in range(13)] +
+            [5180 + 20 * i for i in range(8)] +
+            [5500 + 20 * i for i in range(12)] +
+            [5745 + 20 * i for i in range(5)])
+
+def scan_dump(count):
+  # a dense `iw scan` dump grown from the recorded fixture: every BSS block
+  # is repeated with its own BSSID, channel, signal and SSID
+  with open(os.path.join(FIXTURES, 'iw_scan.txt'), 'r') as f:
+    data = f.read()
+  blocks = ['BSS ' + block for block in data.split('\nBSS ')]
+  blocks[0] = blocks[0][4:]
+  lines = []
+  for i in range(count):
+    block = blocks[i % len(blocks)].rstrip('\n').split('\n')
+    block[0] = 'BSS 02:%02x:%02x:00:%02x:%02x(on wlp3s0)' % (i >> 24 & 0xff, i >> 16 & 0xff, i >> 8 & 0xff, i & 0xff)
+    for j, line in enumerate(block):
+      if line.startswith('\tfreq: '):
+        block[j] = '\tfreq: %d' % (CHANNELS[(i * 7) % len(CHANNELS)])
+      elif line.startswith('\tsignal: '):
+        block[j] = '\tsignal: %.2f dBm' % (-40 - (i * 13) % 50)
+      elif line.startswith('\tSSID: ') and i >= len(blocks):
+        block[j] = '\tSSID: net-%d' % (i)
+    lines += [line + '\n' for line in block]
+  return lines
@@ -0,0 +1,78 @@
+import re
+
+from daemon_output import *
+from bench import *
+
+# one DHCP exchange and a renewal as `dhcpcd -d` prints them, most lines
+# match nothing
+SESSION = [
+  'dhcpcd-9.4.1 starting',
+  'enp0s1: waiting for carrier',
+  'enp0s1: carrier acquired',
+  'enp0s1: IAID 3c:22:fb:11',
+  'enp0s1: adding address fe80::3e22:fbff:fe11:2233',
+  'enp0s1: soliciting an IPv6 router',
+  'enp0s1: soliciting a DHCP lease',
+  'enp0s1: sending DISCOVER (xid 0x5c1f2a), next in 4.1 seconds',
+  'enp0s1: offered 192.168.1.23 from 192.168.1.1',
+  'enp0s1: sending REQUEST (xid 0x5c1f2a), next in 3.9 seconds',
+  'enp0s1: acknowledged 192.168.1.23 from 192.168.1.1',
+  'enp0s1: leased 192.168.1.23 for 86400 seconds',
+  'enp0s1: renew in 43200 seconds, rebind in 75600 seconds',
+  'enp0s1: writing lease `/var/lib/dhcpcd/enp0s1.lease\'',
+  'enp0s1: adding IP address 192.168.1.23/24',
+  'enp0s1: adding route to 192.168.1.0/24',
+  'enp0s1: adding default route via 192.168.1.1',
+  'enp0s1: ARP announcing 192.168.1.23 (1 of 2), next in 2.0 seconds',
+  'enp0s1: ARP announcing 192.168.1.23 (2 of 2)',
+  'enp0s1: renewing lease of 192.168.1.23',
+  'enp0s1: sending REQUEST (xid 0x7d02e1), next in 4.4 seconds',
+  'enp0s1: acknowledged 192.168.1.23 from 192.168.1.1',
+  'enp0s1: leased 192.168.1.23 for 86400 seconds',
+  'enp0s1: carrier lost',
+]
+
+REPEAT = 400
+
+def chain_parse(args):
+  # what each connection did before: split the line, then try every
+  # pattern in turn without compiling any of them
+  m = re.match(r'(.+?): (.+)', args)
+  if m == None:
+    return None
+  dev = m.group(1)
+  msg = m.group(2)
+
+  m = re.match(r'acknowledged ([\d\.]+) from ([\d\.]+)', msg)
+  if m != None:
+    return (dev, 'gateway', m.group(2))
+  m = re.match(r'adding IP address ([\d\.]+)/(\d+)', msg)
+  if m != None:
+    return (dev, 'address', m.group(1))
+  m = re.match(r'adding route to ([\d\.]+)/(\d+)', msg)
+  if m != None:
+    return (dev, 'route', m.group(1))
+  m = re.match(r'adding default route via ([\d\.]+)', msg)
+  if m != None:
+    return (dev, 'default route', m.group(1))
+  return None
+
+def run(parse, lines):
+  for line in lines:
+    parse(line)
+
+def main():
+  lines = SESSION * REPEAT
+  matched = [line for line in SESSION if parse_dhcpcd(line) != None]
+  ignored = [line for line in SESSION if parse_dhcpcd(line) == None]
+  # the old chain knew fewer messages, it must not find any the parser misses
+  assert all(parse_dhcpcd(line) != None for line in SESSION if chain_parse(line) != None)
+  print('%d lines, %d of every %d name a message' % (len(lines), len(matched), len(SESSION)))
+  for name, parse in [('re.match chain', chain_parse), ('combined regex', parse_dhcpcd)]:
+    seconds = best(lambda: run(parse, lines))
+    report('%s: throughput' % (name), len(lines) / seconds / 1e3, 'klines/s')
+    report('%s: per matching line' % (name), best(lambda: run(parse, matched)) / len(matched) * 1e6, 'us')
+    report('%s: per ignored line' % (name), best(lambda: run(parse, ignored)) / len(ignored) * 1e6, 'us')
+
+if __name__ == '__main__':
+  main()
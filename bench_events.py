@@ -0,0 +1,94 @@
+import threading
+import queue
+import time
+
+from reactor import *
+from events import *
+from bench import *
+
+# the typed priority queue against what it replaced: ['kind', args] lists in
+# one queue.Queue drained by a connection thread
+EVENTS = 100000
+BURST = 5000
+LINE = 'enp0s1: sending DHCP_REQUEST for 192.168.1.23 to 255.255.255.255'
+
+class Done(Event):
+  # queued last behind everything else
+  __slots__ = ()
+  priority = LOG
+
+def fifo_run(events, stop_kind):
+  # returns the seconds until the stop_kind event is dispatched, and how
+  # many events went before it
+  q = queue.Queue()
+  dispatched = [0]
+  done = threading.Event()
+  def on_line(args):
+    dispatched[0] += 1
+  def on_stop(args):
+    done.set()
+  dispatcher = {'dhcpcd' : on_line, 'wifi_stations' : on_line, stop_kind : on_stop}
+  def run():
+    while not done.is_set():
+      event = q.get()
+      dispatcher[event[0]](event[1])
+  thread = threading.Thread(target=run)
+  thread.start()
+  start = time.perf_counter()
+  for event in events:
+    q.put(event)
+  done.wait()
+  seconds = time.perf_counter() - start
+  thread.join()
+  return seconds, dispatched[0]
+
+def reactor_run(events, stop_class):
+  reactor = Reactor()
+  dispatched = [0]
+  finish = []
+  def dispatch(event):
+    if type(event) == stop_class and len(finish) == 0:
+      finish.append((time.perf_counter(), dispatched[0]))
+      reactor.loop.stop()
+      return
+    dispatched[0] += 1
+  event_queue = EventQueue(reactor, dispatch)
+  start = []
+  def produce():
+    start.append(time.perf_counter())
+    for event in events:
+      event_queue.put(event)
+  reactor.call_soon(produce)
+  reactor.run()
+  reactor.loop.close()
+  end, dispatched = finish[0]
+  return end - start[0], dispatched
+
+def main():
+  lines = [['dhcpcd', LINE] for i in range(EVENTS)] + [['cable_state_change', 'disconnected']]
+  seconds, dispatched = fifo_run(lines, 'cable_state_change')
+  report('queue.Queue thread: throughput', dispatched / seconds / 1e3, 'k events/s')
+  typed = [DhcpcdLine(LINE) for i in range(EVENTS)]
+  seconds, dispatched = reactor_run(typed + [Done()], Done)
+  report('EventQueue: throughput', dispatched / seconds / 1e3, 'k events/s')
+
+  # a cable pull behind a burst of dhcpcd -d output
+  burst = [['dhcpcd', LINE] for i in range(BURST)] + [['cable_state_change', 'disconnected']]
+  seconds, dispatched = fifo_run(burst, 'cable_state_change')
+  report('queue.Queue thread: cable event after %d lines' % (BURST), seconds * 1e3, 'ms')
+  report('queue.Queue thread: events dispatched before it', dispatched, '')
+  burst = [DhcpcdLine(LINE) for i in range(BURST)] + [CableStateChange('disconnected')]
+  seconds, dispatched = reactor_run(burst, CableStateChange)
+  report('EventQueue: cable event after %d lines' % (BURST), seconds * 1e3, 'ms')
+  report('EventQueue: events dispatched before it', dispatched, '')
+
+  # superseded scan results
+  scans = [['wifi_stations', []] for i in range(BURST)] + [['cable_state_change', 'disconnected']]
+  seconds, dispatched = fifo_run(scans, 'cable_state_change')
+  report('queue.Queue thread: %d scan results dispatched' % (BURST), dispatched, '')
+  scans = [WifiStations([]) for i in range(BURST)] + [Done()]
+  seconds, dispatched = reactor_run(scans, Done)
+  report('EventQueue: %d scan results dispatched' % (BURST), dispatched, '')
+
+if __name__ == '__main__':
+  main()
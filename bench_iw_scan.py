@@ -0,0 +1,65 @@
+import tracemalloc
+import operator
+import re
+
+from iw_scan import *
+from bench import *
+
+SIZES = [50, 200, 1000]
+
+def dict_parse(output):
+  # what the scanner did before: split the whole output, a regex per line
+  # and a dict per BSS with every element kept, then sort by re-parsing the
+  # signal
+  stations = []
+  station = None
+  for line in output.split('\n'):
+    if len(line) == 0:
+      continue
+    if line[0] != '\t':
+      station = {}
+      stations.append(station)
+      m = re.match(r'BSS (.+)\(on (.+)\)', line)
+      station['bssid'] = m.group(1)
+      station['dev'] = m.group(2)
+    else:
+      m = re.match(r'\t*(.+?):\s(.+)', line)
+      if m == None:
+        continue
+      station[m.group(1)] = m.group(2)
+  stations.sort(key=lambda station: float(station['signal'][:-4]), reverse=True)
+  return stations
+
+def stream_parse(lines):
+  # lines arrive one at a time from the subprocess pipe
+  parser = ScanParser()
+  for line in lines:
+    parser.feed(line)
+  stations = parser.stations
+  stations.sort(key=operator.attrgetter('signal'), reverse=True)
+  return stations
+
+def allocated(fn, *args):
+  # peak allocation while parsing, and what the result keeps alive
+  tracemalloc.start()
+  result = fn(*args)
+  kept, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return peak, kept
+
+def main():
+  for size in SIZES:
+    lines = scan_dump(size)
+    output = ''.join(lines)
+    assert len(dict_parse(output)) == len(stream_parse(lines)) == size
+    print('%d BSSes, %d lines, %d KiB of iw output' % (size, len(lines), len(output) // 1024))
+    for name, fn, data in [('dict per BSS', dict_parse, output), ('ScanParser', stream_parse, lines)]:
+      seconds = best(lambda: fn(data), repeat=3)
+      peak, kept = allocated(fn, data)
+      report('  %s: parse and sort' % (name), seconds * 1e3, 'ms')
+      report('  %s: per BSS' % (name), seconds / size * 1e6, 'us')
+      report('  %s: peak allocation' % (name), peak // 1024, 'KiB')
+      report('  %s: retained records' % (name), kept // 1024, 'KiB')
+
+if __name__ == '__main__':
+  main()
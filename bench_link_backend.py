@@ -0,0 +1,49 @@
+import subprocess
+import sys
+import os
+
+from constants import *
+from link_backend import *
+from bench import *
+
+# a veth pair stands in for the ethernet device, nothing real is touched
+DEV = 'ikbench0'
+PEER = 'ikbench1'
+ADDRS = ['10.211.0.1/24', '10.211.1.1/24', 'fd00:211::1/64']
+ROUNDS = 100
+
+def ip(*args):
+  subprocess.check_call([IP] + list(args))
+
+def failover(backend):
+  # what a cable pull costs on the critical path before WiFi takes over
+  backend.flush_addrs(DEV)
+  backend.set_link_down(DEV)
+  backend.set_link_up(DEV)
+
+def measure(backend):
+  clock = Clock()
+  for i in range(ROUNDS):
+    for addr in ADDRS:
+      ip('addr', 'add', addr, 'dev', DEV)
+    with clock:
+      failover(backend)
+  assert len(backend.list_addrs(DEV)) <= 1
+  report('%s: failover (flush, down, up)' % (backend.name), clock.wall / ROUNDS * 1e3, 'ms')
+  report('%s: failover CPU incl. children' % (backend.name), clock.cpu / ROUNDS * 1e3, 'ms')
+  report('%s: list_links' % (backend.name), best(backend.list_links) * 1e3, 'ms')
+  report('%s: list_addrs' % (backend.name), best(lambda: backend.list_addrs(DEV)) * 1e3, 'ms')
+
+def main():
+  if os.geteuid() != 0:
+    print('creating the veth pair needs root')
+    sys.exit(1)
+  ip('link', 'add', DEV, 'type', 'veth', 'peer', 'name', PEER)
+  try:
+    for backend in [IpCommandBackend(), NetlinkBackend()]:
+      measure(backend)
+  finally:
+    ip('link', 'del', DEV)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,147 @@
+import subprocess
+import threading
+import resource
+import queue
+import time
+import sys
+import os
+
+from constants import *
+from bench import *
+
+# threads, RSS, CPU and wakeups of an idle daemon, before and after the move
+# to a single reactor. With pids it samples running daemons instead, e.g. the
+# baseline from `git worktree add` next to the current tree:
+#   python bench_resources.py <pid> [<pid>...]
+WARMUP = 1.0
+SECONDS = 10.0
+
+def read_proc(pid, name):
+  f = open('/proc/%d/%s' % (pid, name), 'r')
+  contents = f.read()
+  f.close()
+  return contents
+
+def snapshot(pid):
+  status = dict(line.split(':', 1) for line in read_proc(pid, 'status').split('\n') if ':' in line)
+  fields = read_proc(pid, 'stat').rsplit(')', 1)[1].split()
+  # every context switch is a wakeup; threads that already exited are not
+  # counted here, so this undercounts a daemon that spawns timer threads
+  switches = 0
+  for tid in os.listdir('/proc/%d/task' % (pid)):
+    try:
+      task = read_proc(pid, 'task/%s/status' % (tid))
+    except OSError:
+      continue
+    for line in task.split('\n'):
+      if line.startswith('voluntary_ctxt_switches') or line.startswith('nonvoluntary_ctxt_switches'):
+        switches += int(line.split(':')[1])
+  return {
+    'threads' : int(status['Threads']),
+    'rss' : int(status['VmRSS'].split()[0]),
+    'cpu' : (int(fields[11]) + int(fields[12])) / float(os.sysconf('SC_CLK_TCK')),
+    'switches' : switches,
+  }
+
+def self_snapshot():
+  # the kernel keeps the totals of exited threads for the process itself
+  usage = resource.getrusage(resource.RUSAGE_SELF)
+  result = snapshot(os.getpid())
+  result['cpu'] = usage.ru_utime + usage.ru_stime
+  result['switches'] = usage.ru_nvcsw + usage.ru_nivcsw
+  return result
+
+def show(name, start, end, seconds):
+  report('%s: threads' % (name), end['threads'], '')
+  report('%s: RSS' % (name), end['rss'], 'KiB')
+  report('%s: CPU' % (name), (end['cpu'] - start['cpu']) / seconds * 1e3, 'ms/s')
+  report('%s: wakeups' % (name), (end['switches'] - start['switches']) / seconds, '/s')
+
+def sample(name, pid, seconds=SECONDS):
+  start = snapshot(pid)
+  time.sleep(seconds)
+  show(name, start, snapshot(pid), seconds)
+
+def idle_before():
+  # the threads and timers the threaded daemon kept running while connected
+  # and idle: three event loops blocked on queues, the scan and cable
+  # threads sleeping, and threading.Timer re-armed per poll of each child
+  queues = [queue.Queue() for i in range(3)]
+  for q in queues:
+    threading.Thread(target=q.get, daemon=True).start()
+
+  def scan_thread():
+    while True:
+      time.sleep(WIFI_SCAN_INTERVAL)
+  def cable_thread():
+    while True:
+      f = open('/proc/self/stat', 'r')
+      f.read()
+      f.close()
+      time.sleep(1)
+  threading.Thread(target=scan_thread, daemon=True).start()
+  threading.Thread(target=cable_thread, daemon=True).start()
+
+  def rearm(delay, fn, *args):
+    timer = threading.Timer(delay, fn, args)
+    timer.daemon = True
+    timer.start()
+  def poll(fd, q):
+    try:
+      os.read(fd, 4096)
+    except BlockingIOError:
+      pass
+    q.put(None)
+    rearm(0.25, poll, fd, q)
+  def watchdog(q):
+    q.put(None)
+    rearm(5.0, watchdog, q)
+  # wpa_supplicant and dhcpcd of the WiFi link, dhcpcd of the wired one
+  for q in [queues[1], queues[1], queues[2]]:
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(read_fd, False)
+    poll(read_fd, q)
+  watchdog(queues[1])
+
+  time.sleep(WARMUP)
+  start = self_snapshot()
+  time.sleep(SECONDS)
+  show('before', start, self_snapshot(), SECONDS)
+
+def idle_after():
+  # the same idle daemon on the reactor: child output and carrier changes
+  # wake it only when they arrive, one timer wheel runs the watchdog
+  from reactor import Reactor
+  import rtnetlink
+  reactor = Reactor()
+  for i in range(3):
+    read_fd, write_fd = os.pipe()
+    reactor.add_reader(read_fd, os.read, read_fd, 4096)
+  sock = rtnetlink.open_socket(rtnetlink.RTMGRP_LINK)
+  reactor.add_reader(sock.fileno(), sock.recv, 65536)
+  reactor.call_every(5.0, lambda: None)
+
+  start = []
+  def finish():
+    show('after', start[0], self_snapshot(), SECONDS)
+    reactor.stop()
+  reactor.loop.call_later(WARMUP, lambda: start.append(self_snapshot()))
+  reactor.loop.call_later(WARMUP + SECONDS, finish)
+  reactor.run()
+
+def main():
+  if len(sys.argv) > 2 and sys.argv[1] == '--model':
+    {'before' : idle_before, 'after' : idle_after}[sys.argv[2]]()
+    return
+  if len(sys.argv) > 1:
+    for pid in sys.argv[1:]:
+      sample('pid %s' % (pid), int(pid))
+    return
+
+  print('idle daemon models, each measured for %d seconds' % (SECONDS))
+  for model in ['before', 'after']:
+    sys.stdout.flush()
+    subprocess.check_call([sys.executable, os.path.abspath(__file__), '--model', model])
+
+if __name__ == '__main__':
+  main()
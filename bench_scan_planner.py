@@ -0,0 +1,74 @@
+import scan_planner
+import time
+
+from constants import *
+from scan_planner import *
+from iw_scan import *
+from bench import *
+
+# replays a dense recorded scan through the planner and compares the
+# channels it visits against sweeping every channel on every scan
+SCANS = 500
+BSS_COUNT = 300
+RECOGNIZED = ['home', 'cafe']
+
+# a probe on a DFS channel has to wait for a beacon, the rest are active
+DFS = set(range(5260, 5321, 20)) | set(range(5500, 5701, 20))
+ACTIVE_DWELL = 0.03
+PASSIVE_DWELL = 0.11
+
+class FakeClock:
+  # the planner's notion of time, advanced one scan interval per scan
+  def __init__(self):
+    self.now = 1000.0
+
+  def monotonic(self):
+    return self.now
+
+def channels(args):
+  if 'freq' not in args:
+    return CHANNELS
+  end = args.index('ssid') if 'ssid' in args else len(args)
+  return [int(freq) for freq in args[args.index('freq') + 1:end]]
+
+def dwell(freqs):
+  return sum([PASSIVE_DWELL if freq in DFS else ACTIVE_DWELL for freq in freqs])
+
+def replay(stations, planned):
+  clock = FakeClock()
+  scan_planner.time = clock
+  planner = ScanPlanner()
+  scan_seconds = 0.0
+  full_sweeps = 0
+  found = 0
+  for i in range(SCANS):
+    args = planner.plan(RECOGNIZED) if planned else []
+    freqs = channels(args)
+    if len(freqs) == len(CHANNELS):
+      full_sweeps += 1
+    scan_seconds += dwell(freqs)
+    heard = [station for station in stations if station.freq in freqs]
+    if planner.record(heard, RECOGNIZED, covered_freqs(args) == None):
+      found += 1
+    clock.now += WIFI_SCAN_INTERVAL
+  return scan_seconds / SCANS, full_sweeps, found
+
+def main():
+  stations = parse_scan(scan_dump(BSS_COUNT))
+  print('%d BSSes on %d channels, %d recognized SSIDs, %d scans' %
+        (len(stations), len(set(station.freq for station in stations)), len(RECOGNIZED), SCANS))
+
+  for name, planned in [('full sweep every scan', False), ('scan planner', True)]:
+    seconds, full_sweeps, found = replay(stations, planned)
+    report('%s: estimated scan time' % (name), seconds * 1e3, 'ms')
+    report('%s: full sweeps' % (name), full_sweeps, 'scans')
+    report('%s: scans that heard a known SSID' % (name), found, 'scans')
+
+  scan_planner.time = time
+  planner = ScanPlanner()
+  planner.record(stations, RECOGNIZED, True)
+  report('plan() on a warm planner', best(lambda: planner.plan(RECOGNIZED)) * 1e6, 'us')
+  report('record() of %d BSSes' % (len(stations)), best(lambda: planner.record(stations, RECOGNIZED, False)) * 1e6, 'us')
+
+if __name__ == '__main__':
+  main()
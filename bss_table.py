@@ -0,0 +1,118 @@
+import time
+
+from constants import *
+
+class BssEntry:
+  __slots__ = ('station', 'signal', 'reported_signal', 'freq', 'last_seen', 'failures', 'missing')
+
+  def __init__(self, station, now):
+    self.station = station
+    self.signal = station.signal
+    self.reported_signal = station.signal
+    self.freq = station.freq
+    self.last_seen = now
+    self.failures = 0
+    # absent from the latest scan of its channel, kept for its history
+    self.missing = False
+
+class BssTable:
+  def __init__(self):
+    self.entries = {}
+    # ssid -> {bssid -> entry}, so candidate lookups only touch one network
+    self.by_ssid = {}
+
+  def get(self, bssid):
+    return self.entries.get(bssid)
+
+  def candidates(self, ssid, now=None):
+    # only what the radio can still hear, an old smoothed signal is no
+    # reason to spend a connection attempt
+    if now == None:
+      now = time.monotonic()
+    cutoff = now - BSS_CANDIDATE_AGE
+    return [entry for entry in self.by_ssid.get(ssid, {}).values()
+            if not entry.missing and entry.last_seen >= cutoff]
+
+  def remove(self, bssid):
+    entry = self.entries.pop(bssid)
+    ssid = entry.station.ssid
+    bsses = self.by_ssid.get(ssid)
+    if bsses != None:
+      bsses.pop(bssid, None)
+      if len(bsses) == 0:
+        del self.by_ssid[ssid]
+    return entry
+
+  def merge(self, stations, freqs=None, now=None):
+    # returns the deltas against the previous state: entries that appeared,
+    # entries missing from this scan of their channel (freqs, None for every
+    # channel) or aged out, and entries whose smoothed signal or channel
+    # moved by at least BSS_CHANGE_THRESHOLD since they were last reported
+    if now == None:
+      now = time.monotonic()
+    appeared = []
+    changed = []
+    lost = []
+
+    for station in stations:
+      entry = self.entries.get(station.bssid)
+      if entry == None or entry.station.ssid != station.ssid:
+        if entry != None:
+          self.remove(station.bssid)
+        entry = BssEntry(station, now)
+        self.entries[station.bssid] = entry
+        self.by_ssid.setdefault(station.ssid, {})[station.bssid] = entry
+        appeared.append(entry)
+        continue
+
+      entry.signal += BSS_SIGNAL_ALPHA * (station.signal - entry.signal)
+      entry.station = station
+      entry.last_seen = now
+      if entry.missing:
+        entry.missing = False
+        appeared.append(entry)
+        continue
+      if station.freq != entry.freq or abs(entry.signal - entry.reported_signal) >= BSS_CHANGE_THRESHOLD:
+        entry.freq = station.freq
+        entry.reported_signal = entry.signal
+        changed.append(entry)
+
+    seen = set(station.bssid for station in stations)
+    for bssid, entry in self.entries.items():
+      if entry.missing or bssid in seen:
+        continue
+      if freqs == None or entry.freq in freqs:
+        entry.missing = True
+        lost.append(entry)
+
+    lost += self.expire(now)
+    return appeared, lost, changed
+
+  def expire(self, now):
+    lost = []
+    cutoff = now - BSS_MAX_AGE
+    for bssid, entry in list(self.entries.items()):
+      if entry.last_seen < cutoff:
+        self.remove(bssid)
+        # a missing entry was reported when it went missing
+        if not entry.missing:
+          lost.append(entry)
+
+    # keep memory bounded in dense environments, oldest sightings go first
+    if len(self.entries) > BSS_TABLE_SIZE:
+      entries = sorted(self.entries.values(), key=lambda entry: entry.last_seen)
+      for entry in entries[:len(self.entries) - BSS_TABLE_SIZE]:
+        self.remove(entry.station.bssid)
+        if not entry.missing:
+          lost.append(entry)
+    return lost
+
+  def record_failure(self, bssid):
+    entry = self.entries.get(bssid)
+    if entry != None:
+      entry.failures += 1
+
+  def record_success(self, bssid):
+    entry = self.entries.get(bssid)
+    if entry != None:
+      entry.failures = 0
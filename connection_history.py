@@ -0,0 +1,175 @@
+import sqlite3
+import time
+import os
+
+from constants import *
+
+class BssHistory:
+  __slots__ = ('attempts', 'failures', 'connect_secs')
+
+  def __init__(self):
+    self.attempts = 0
+    self.failures = 0
+    self.connect_secs = None
+
+class ConnectionHistory:
+  def __init__(self, reactor, path=HISTORY_PATH):
+    self.reactor = reactor
+    self.path = path
+    self.db = None
+    self.bsses = None
+    self.load_task = None
+    self.pending = []
+    self.flush_handle = None
+    self.flushing = False
+
+  def open(self):
+    os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+    # opened in one executor thread, written from another
+    db = sqlite3.connect(self.path, check_same_thread=False)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=NORMAL')
+    db.execute('CREATE TABLE IF NOT EXISTS attempts ('
+               'time REAL, ssid TEXT, bssid TEXT, outcome TEXT, '
+               'assoc_secs REAL, dhcp_secs REAL)')
+    db.execute('DELETE FROM attempts WHERE time < ?', (time.time() - HISTORY_MAX_AGE,))
+    db.commit()
+    return db
+
+  def read(self):
+    # runs in the executor, pruning and aggregating scan the whole table
+    db = self.open()
+    try:
+      rows = db.execute(
+          "SELECT bssid, COUNT(*), SUM(outcome != 'connected'), "
+          "AVG(CASE WHEN outcome = 'connected' THEN assoc_secs + dhcp_secs END) "
+          "FROM attempts GROUP BY bssid").fetchall()
+    except sqlite3.Error:
+      db.close()
+      raise
+    return db, rows
+
+  def load(self):
+    # nothing is read until the first candidate has to be ranked, and until
+    # the read finishes every BSS weighs the same
+    self.bsses = {}
+    self.load_task = self.reactor.spawn(self.read_history())
+
+  async def read_history(self):
+    try:
+      db, rows = await self.reactor.run_in_executor(self.read)
+    except (OSError, sqlite3.Error) as e:
+      print('failed to load connection history: %s' % (e))
+      # with nowhere to write them, records would only pile up
+      self.pending = []
+      return
+    finally:
+      self.load_task = None
+
+    self.db = db
+    self.bsses = {}
+    for bssid, attempts, failures, connect_secs in rows:
+      history = BssHistory()
+      history.attempts = attempts
+      history.failures = failures
+      history.connect_secs = connect_secs
+      self.bsses[bssid] = history
+    # attempts recorded during the read are not in the table yet
+    for row in self.pending:
+      self.add(*row[2:])
+
+  def get(self, bssid):
+    if self.bsses == None:
+      self.load()
+    return self.bsses.get(bssid)
+
+  def weight(self, bssid):
+    history = self.get(bssid)
+    if history == None:
+      return 1.0
+
+    # smoothed success rate, so one bad attempt is not a ban but a repeat
+    # offender sinks below every other candidate
+    successes = history.attempts - history.failures
+    weight = (successes + 1.0) / (history.attempts + 2.0) * 2.0
+    if history.connect_secs != None and history.connect_secs > 0:
+      speed = HISTORY_FAST_CONNECT_SECS / history.connect_secs
+      weight *= min(1.5, max(0.5, speed))
+    return weight
+
+  def add(self, bssid, outcome, assoc_secs, dhcp_secs):
+    history = self.bsses.setdefault(bssid, BssHistory())
+    history.attempts += 1
+    if outcome != 'connected':
+      history.failures += 1
+    elif assoc_secs != None and dhcp_secs != None:
+      secs = assoc_secs + dhcp_secs
+      if history.connect_secs == None:
+        history.connect_secs = secs
+      else:
+        history.connect_secs += 0.3 * (secs - history.connect_secs)
+
+  def record(self, ssid, bssid, outcome, assoc_secs=None, dhcp_secs=None):
+    if self.bsses == None:
+      self.load()
+    self.add(bssid, outcome, assoc_secs, dhcp_secs)
+
+    if self.db == None and self.load_task == None:
+      # the database could not be opened, keep the history in memory only
+      return
+    self.pending.append((time.time(), ssid, bssid, outcome, assoc_secs, dhcp_secs))
+    if self.flush_handle == None:
+      self.flush_handle = self.reactor.call_later(HISTORY_FLUSH_INTERVAL, self.flush)
+
+  def flush(self):
+    # writes are batched and deferred so they stay out of the connect path
+    self.flush_handle = None
+    if self.db == None:
+      if self.load_task != None:
+        # still opening, try again once it is
+        self.flush_handle = self.reactor.call_later(HISTORY_FLUSH_INTERVAL, self.flush)
+      else:
+        self.pending = []
+      return
+    if len(self.pending) == 0 or self.flushing:
+      return
+    rows = self.pending
+    self.pending = []
+    self.flushing = True
+    self.reactor.spawn(self.write(rows))
+
+  def insert(self, rows):
+    self.db.executemany('INSERT INTO attempts VALUES (?, ?, ?, ?, ?, ?)', rows)
+    self.db.commit()
+
+  async def write(self, rows):
+    try:
+      await self.reactor.run_in_executor(self.insert, rows)
+    except sqlite3.Error as e:
+      print('failed to write connection history: %s' % (e))
+    finally:
+      self.flushing = False
+    # recorded while this batch was being written
+    if len(self.pending) > 0 and self.flush_handle == None:
+      self.flush_handle = self.reactor.call_later(HISTORY_FLUSH_INTERVAL, self.flush)
+
+  def stop(self):
+    if self.flush_handle != None:
+      self.flush_handle.cancel()
+      self.flush_handle = None
+    if self.load_task != None:
+      self.load_task.cancel()
+      self.load_task = None
+
+  def close(self):
+    # runs in the executor after stop(), writes what is left
+    if self.db == None:
+      return
+    try:
+      if len(self.pending) > 0:
+        self.insert(self.pending)
+        self.pending = []
+    except sqlite3.Error as e:
+      print('failed to write connection history: %s' % (e))
+    self.db.close()
+    self.db = None
@@ -5,4 +5,119 @@ WPA_SUPPLICANT = '/usr/bin/wpa_supplicant'
 DHCPCD = '/usr/bin/dhcpcd'
 
 WIFI_SCAN_INTERVAL = 5
+WIFI_SCAN_MIN_INTERVAL = 1
+WIFI_SCAN_MAX_INTERVAL = 300
 CABLE_POLL_INTERVALL = 1
+
+# keep WiFi associated with a lease while ethernet is up, the higher metric
+# keeps it off the default path so failover is only a route change
+WIFI_STANDBY = False
+
+# while connected, sample the link and move to a better BSS of the same SSID
+# once the smoothed signal drops below the threshold and a candidate is at
+# least ROAM_HYSTERESIS dB stronger
+ROAM_SAMPLE_INTERVAL = 10
+ROAM_SIGNAL_ALPHA = 0.3
+ROAM_SIGNAL_THRESHOLD = -70
+ROAM_HYSTERESIS = 8
+ROAM_DWELL_TIME = 60
+ROAM_SCAN_INTERVAL = 30
+ROAM_TIMEOUT = 10
+# how long a connect request waits for its network to show up in a scan
+CONNECT_REQUEST_TIMEOUT = 30
+
+# 'netlink' talks rtnetlink in-process, 'ip' shells out to IP
+LINK_BACKEND = 'netlink'
+
+# drive one long-lived wpa_supplicant over its control socket instead of
+# spawning a new one for every connection attempt
+WPA_CTRL_MODE = False
+WPA_CTRL_DIR = '/run/interkonnect/wpa_supplicant'
+
+# last address per network, requested first on reconnect (INIT-REBOOT)
+LEASE_CACHE_PATH = '/var/lib/interkonnect/leases.json'
+
+# derived PSKs and pre-rendered wpa_supplicant configs, both root-only
+PSK_CACHE_PATH = '/var/lib/interkonnect/psk.json'
+NETWORK_CONFIG_DIR = '/run/interkonnect/networks'
+
+# the credentials file is watched with inotify, polled without it
+CREDENTIALS_POLL_INTERVAL = 5
+CREDENTIALS_DEBOUNCE = 0.2
+
+# data path probing of connected links, targets are literal "tcp:<ip>:<port>"
+# or "udp:<ip>:<port>" (a DNS server), e.g. ['tcp:1.1.1.1:443', 'udp:9.9.9.9:53'];
+# without targets only a ping of the gateway decides, which fails on networks
+# that firewall it, so this is opt-in
+PROBE_ENABLED = False
+PROBE_TARGETS = []
+PROBE_INTERVAL = 5
+PROBE_TIMEOUT = 1.0
+PROBE_WINDOW = 10
+PROBE_MIN_SAMPLES = 3
+PROBE_MAX_LOSS = 0.5
+# metric of an unhealthy ethernet default route, above WiFi's
+PROBE_DEMOTED_METRIC = 20000
+
+# deadlines of each startup/shutdown step and of daemons asked to exit
+LIFECYCLE_STEP_DEADLINE = 5.0
+LIFECYCLE_TERM_TIMEOUT = 1.0
+
+# threads for blocking calls made on behalf of the reactor
+EXECUTOR_WORKERS = 4
+
+# on start, keep links that are already up with an address, a default route
+# and their daemons instead of tearing them down, and leave ethernet
+# configured on exit so a restart costs no connectivity
+FAST_START = False
+
+# scans between full sweeps only probe channels where recognized SSIDs were seen
+FULL_SCAN_INTERVAL = 60
+SCAN_SIGHTING_TTL = 3600
+# SSIDs per scan until the driver's "max # scan SSIDs" has been read
+SCAN_MAX_SSIDS = 4
+
+# how candidate stations are ranked, see station_scoring.SCORERS
+STATION_SCORER = 'throughput'
+SCORE_SIGNAL_FLOOR = -90
+SCORE_SIGNAL_CEILING = -50
+SCORE_STATION_PENALTY = 0.05
+
+# per-BSSID sighting history fed by every scan
+BSS_SIGNAL_ALPHA = 0.4
+BSS_CHANGE_THRESHOLD = 5
+BSS_MAX_AGE = 300
+# only BSSes heard this recently are connection candidates, longer than
+# FULL_SCAN_INTERVAL so channels targeted scans skip get swept in between
+BSS_CANDIDATE_AGE = 90
+BSS_TABLE_SIZE = 512
+# every failed attempt halves a BSS's preference weight
+BSS_FAILURE_PENALTY = 0.5
+
+# per-BSSID outcomes and phase timings of past connection attempts
+HISTORY_PATH = '/var/lib/interkonnect/history.sqlite'
+HISTORY_MAX_AGE = 30 * 24 * 3600
+HISTORY_FLUSH_INTERVAL = 30
+HISTORY_FAST_CONNECT_SECS = 3.0
+
+# per-phase connection latency histograms, Prometheus text format
+METRICS_SOCKET = '/run/interkonnect/metrics.sock'
+
+# newline-delimited JSON control and status API
+CONTROL_SOCKET = '/run/interkonnect/control.sock'
+
+# restart backoff for supervised daemons
+CHILD_RESTART_DELAY = 0.5
+CHILD_RESTART_MAX_DELAY = 30
+CHILD_STABLE_SECS = 60
+# a daemon asked to exit gets SIGKILL after this long
+CHILD_KILL_TIMEOUT = 0.5
+
+# timers landing in the same window share one wakeup
+TIMER_GRANULARITY = 0.05
+
+# events dispatched per loop iteration before yielding to readers
+EVENT_BATCH = 64
+
+# echo every raw dhcpcd/wpa_supplicant line, for debugging
+LOG_DAEMON_OUTPUT = False
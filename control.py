@@ -0,0 +1,177 @@
+import asyncio
+import json
+import time
+import os
+
+from constants import *
+from events import *
+from wifi_connection import State
+
+STATE_NAMES = {
+  State.DISCONNECTED : 'DISCONNECTED',
+  State.CONNECTING : 'CONNECTING',
+  State.CONNECTED : 'CONNECTED',
+}
+
+class ControlError(Exception):
+  pass
+
+class ControlServer:
+  # newline-delimited JSON over a UNIX socket, one request object per line
+  # and one reply object per line, e.g. {"cmd": "status"}
+  def __init__(self, parent, path=CONTROL_SOCKET):
+    self.parent = parent
+    self.path = path
+    self.server = None
+
+    self.commands = {}
+    self.commands['status'] = self.on_status
+    self.commands['bss'] = self.on_bss
+    self.commands['scan'] = self.on_scan
+    self.commands['connect'] = self.on_connect
+    self.commands['pin'] = self.on_pin
+    self.commands['suppress'] = self.on_suppress
+    self.commands['unsuppress'] = self.on_unsuppress
+    self.commands['reload'] = self.on_reload
+
+  async def start(self):
+    try:
+      os.makedirs(os.path.dirname(self.path), mode=0o755, exist_ok=True)
+      if os.path.exists(self.path):
+        os.remove(self.path)
+      self.server = await asyncio.start_unix_server(self.on_client, self.path)
+      os.chmod(self.path, 0o600)
+    except OSError as e:
+      print('failed to start control server on %s: %s' % (self.path, e))
+
+  def stop(self):
+    if self.server != None:
+      self.server.close()
+      self.server = None
+    try:
+      os.remove(self.path)
+    except OSError:
+      pass
+
+  async def on_client(self, reader, writer):
+    try:
+      while True:
+        line = await reader.readline()
+        if len(line) == 0:
+          break
+        if len(line.strip()) == 0:
+          continue
+        reply = self.handle(line)
+        writer.write(bytes(json.dumps(reply) + '\n', 'utf-8'))
+        await writer.drain()
+    except (ConnectionError, ValueError):
+      # ValueError is a line over the stream limit
+      pass
+    finally:
+      writer.close()
+
+  def handle(self, line):
+    try:
+      request = json.loads(line)
+      if not isinstance(request, dict):
+        raise ControlError('request must be an object')
+      cmd = request.get('cmd')
+      if cmd not in self.commands:
+        raise ControlError('unknown command: %s' % (cmd))
+      result = self.commands[cmd](request)
+    except ValueError as e:
+      return {'ok' : False, 'error' : 'invalid JSON: %s' % (e)}
+    except ControlError as e:
+      return {'ok' : False, 'error' : str(e)}
+
+    reply = {'ok' : True}
+    if result != None:
+      reply.update(result)
+    return reply
+
+  def wifi(self):
+    if self.parent.wifi_connection == None:
+      raise ControlError('WiFi connection is not running')
+    return self.parent.wifi_connection
+
+  def recognized_ssid(self, request):
+    ssid = request.get('ssid')
+    if ssid not in self.wifi().recognized_connections:
+      raise ControlError('not a recognized SSID: %s' % (ssid))
+    return ssid
+
+  # queries run on the reactor, so they see a consistent snapshot without
+  # going through the event queues
+
+  def on_status(self, request):
+    status = {}
+    wifi = self.parent.wifi_connection
+    if wifi != None:
+      station = None
+      if wifi.station != None and wifi.state != State.DISCONNECTED:
+        station = {'ssid' : wifi.station.ssid, 'bssid' : wifi.station.bssid}
+      status['wifi'] = {
+        'dev' : wifi.dev,
+        'state' : STATE_NAMES[wifi.state],
+        'suppressed' : wifi.suppressed,
+        'station' : station,
+        'pinned_ssid' : wifi.pinned_ssid,
+        'scan_interval' : wifi.scanner.interval,
+        'scan_count' : wifi.scanner.scan_count,
+        'healthy' : wifi.prober.healthy,
+        'probes' : wifi.prober.summary(),
+      }
+    ethernet = self.parent.ethernet_connection
+    if ethernet != None:
+      status['ethernet'] = {
+        'dev' : ethernet.dev,
+        'state' : STATE_NAMES[ethernet.state],
+        'healthy' : ethernet.prober.healthy,
+        'probes' : ethernet.prober.summary(),
+      }
+    timers = self.parent.reactor.timers
+    status['timers'] = {
+      'wakeups' : timers.wakeups,
+      'wakeups_per_second' : round(timers.wakeups_per_second(), 3),
+    }
+    return status
+
+  def on_bss(self, request):
+    now = time.monotonic()
+    bsses = []
+    for entry in self.wifi().bss_table.entries.values():
+      bsses.append({
+        'bssid' : entry.station.bssid,
+        'ssid' : entry.station.ssid,
+        'freq' : entry.freq,
+        'signal' : round(entry.signal, 1),
+        'age' : round(now - entry.last_seen, 1),
+        'failures' : entry.failures,
+      })
+    return {'bss' : bsses}
+
+  # commands only enqueue events and return immediately
+
+  def on_scan(self, request):
+    self.wifi().event_queue.put(ScanRequest())
+
+  def on_connect(self, request):
+    ssid = self.recognized_ssid(request)
+    self.wifi().event_queue.put(ConnectRequest(ssid))
+
+  def on_pin(self, request):
+    ssid = None
+    if request.get('ssid') != None:
+      ssid = self.recognized_ssid(request)
+    self.wifi().event_queue.put(PinRequest(ssid))
+
+  def on_suppress(self, request):
+    self.wifi()
+    self.parent.suppress_wifi()
+
+  def on_unsuppress(self, request):
+    self.wifi()
+    self.parent.unsuppress_wifi()
+
+  def on_reload(self, request):
+    self.wifi().event_queue.put(ReloadCredentials())
@@ -0,0 +1,296 @@
+import subprocess
+import hashlib
+import json
+import os
+import re
+
+from constants import *
+from events import *
+import inotify
+
+def derive_psk(ssid, passphrase):
+  # a 64 digit hex passphrase already is the PSK
+  if re.fullmatch(r'[0-9a-fA-F]{64}', passphrase) != None:
+    return passphrase.lower()
+  try:
+    return hashlib.pbkdf2_hmac('sha1', passphrase.encode('utf-8'), ssid.encode('utf-8'), 4096, 32).hex()
+  except ValueError:
+    # sha1 is disabled in FIPS builds of OpenSSL
+    output = subprocess.check_output([WPA_PASSPHRASE, ssid, passphrase]).decode('utf-8')
+    return re.search(r'^\s*psk=([0-9a-f]{64})$', output, re.M).group(1)
+
+def quote(value):
+  return '"%s"' % (value)
+
+class Credential:
+  __slots__ = ('ssid', 'passphrase', 'weight', 'priority', 'hidden', 'bssid')
+
+  def __init__(self, ssid, passphrase):
+    self.ssid = ssid
+    self.passphrase = passphrase
+    self.weight = 1.0
+    self.priority = 0
+    self.hidden = False
+    self.bssid = None
+
+  def key(self):
+    # what the supplicant is configured with, the other options only affect
+    # scanning and ranking
+    return (self.passphrase, self.bssid)
+
+def parse_credentials(text):
+  # one "ssid,passphrase" per line, passphrases are printable ASCII so
+  # options can follow after tabs, e.g.
+  # "ssid,passphrase<TAB>weight=1.5<TAB>priority=2<TAB>hidden<TAB>bssid=..."
+  credentials = {}
+  for line in text.split('\n'):
+    if len(line) == 0:
+      continue
+    if line.startswith("#"):
+      continue
+    index = line.find(',')
+    if index == -1:
+      raise ValueError('missing passphrase: %s' % (line))
+    tokens = line[index+1:].split('\t')
+    credential = Credential(line[0:index], tokens[0])
+    for option in tokens[1:]:
+      key, _, value = option.partition('=')
+      if key == 'weight':
+        credential.weight = float(value)
+      elif key == 'priority':
+        credential.priority = int(value)
+      elif key == 'hidden':
+        credential.hidden = value in ('', '1', 'yes', 'true')
+      elif key == 'bssid':
+        credential.bssid = value.lower()
+    credentials[credential.ssid] = credential
+  return credentials
+
+class CredentialStore:
+  def __init__(self, path):
+    self.path = path
+    # ssid -> Credential, the index every lookup goes through
+    self.by_ssid = {}
+    self.hidden = []
+
+  def read(self):
+    f = open(self.path)
+    credentials = parse_credentials(f.read())
+    f.close()
+    return credentials
+
+  def load(self):
+    return self.swap(self.read())
+
+  def swap(self, credentials):
+    # credentials are parsed (and compiled) completely before being swapped
+    # in, a broken file leaves the previous ones in place; returns
+    # (added, removed, changed)
+    old = self.by_ssid
+    added = [ssid for ssid in credentials if ssid not in old]
+    removed = [ssid for ssid in old if ssid not in credentials]
+    changed = [ssid for ssid in credentials if ssid in old and credentials[ssid].key() != old[ssid].key()]
+    self.by_ssid = credentials
+    self.hidden = sorted(ssid for ssid, credential in credentials.items() if credential.hidden)
+    return added, removed, changed
+
+class CredentialWatcher:
+  # posts ReloadCredentials whenever the credentials file is replaced or
+  # written, falls back to polling its stat when inotify is unavailable
+  def __init__(self, parent, path):
+    self.parent = parent
+    self.path = path
+    self.reactor = parent.parent.reactor
+    self.event_queue = parent.event_queue
+
+    self.inotify = None
+    self.poll_handle = None
+    self.debounce_handle = None
+    self.stamp = None
+
+  def start(self):
+    self.stamp = self.read_stamp()
+    try:
+      self.inotify = inotify.Inotify()
+      # editors and atomic writers replace the file, so watch its directory
+      self.inotify.add_watch(os.path.dirname(self.path),
+                             inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO | inotify.IN_CREATE |
+                             inotify.IN_DELETE | inotify.IN_MOVED_FROM)
+      self.reactor.add_reader(self.inotify.fileno(), self.on_inotify)
+    except (OSError, AttributeError) as e:
+      self.parent.print('inotify unavailable (%s), polling %s' % (e, self.path))
+      if self.inotify != None:
+        self.inotify.close()
+        self.inotify = None
+      self.poll_handle = self.reactor.call_every(CREDENTIALS_POLL_INTERVAL, self.poll)
+
+  def stop(self):
+    if self.inotify != None:
+      self.reactor.remove_reader(self.inotify.fileno())
+      self.inotify.close()
+      self.inotify = None
+    if self.poll_handle != None:
+      self.poll_handle.cancel()
+      self.poll_handle = None
+    if self.debounce_handle != None:
+      self.debounce_handle.cancel()
+      self.debounce_handle = None
+
+  def read_stamp(self):
+    try:
+      st = os.stat(self.path)
+    except OSError:
+      return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+  def on_inotify(self):
+    name = os.path.basename(self.path)
+    for wd, mask, event_name in self.inotify.read():
+      if event_name == name:
+        self.schedule()
+
+  def poll(self):
+    stamp = self.read_stamp()
+    if stamp != self.stamp:
+      self.stamp = stamp
+      self.schedule()
+
+  def schedule(self):
+    # a write is usually several events, reload once they settle
+    if self.debounce_handle != None:
+      self.debounce_handle.cancel()
+    self.debounce_handle = self.reactor.call_later(CREDENTIALS_DEBOUNCE, self.changed)
+
+  def changed(self):
+    self.debounce_handle = None
+    if os.path.exists(self.path):
+      self.event_queue.put(ReloadCredentials())
+
+class CompiledNetwork:
+  __slots__ = ('ssid', 'psk', 'params', 'config_path')
+
+  def __init__(self, ssid, psk, params, config_path):
+    self.ssid = ssid
+    self.psk = psk
+    self.params = params
+    self.config_path = config_path
+
+class CredentialCompiler:
+  # derives every PSK once, keeps them in a root-only cache that is thrown
+  # away whenever the credentials file changes, and renders one
+  # wpa_supplicant config per network up front
+  def __init__(self, source_path, cache_path=PSK_CACHE_PATH, config_dir=NETWORK_CONFIG_DIR):
+    self.source_path = source_path
+    self.cache_path = cache_path
+    self.config_dir = config_dir
+    # ssid -> (passphrase, psk) of the last compile, so a hot reload only
+    # derives the PSKs of new or changed networks
+    self.derived = {}
+
+  def source_stamp(self):
+    st = os.stat(self.source_path)
+    return [st.st_ino, st.st_size, st.st_mtime_ns]
+
+  def load_cache(self, stamp):
+    try:
+      f = open(self.cache_path, 'r')
+      cache = json.load(f)
+      f.close()
+    except (OSError, ValueError):
+      return {}
+    if cache.get('source') != stamp:
+      return {}
+    return cache.get('psks', {})
+
+  def save_cache(self, stamp, psks):
+    os.makedirs(os.path.dirname(self.cache_path), mode=0o700, exist_ok=True)
+    tmp_path = self.cache_path + '.tmp'
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    f = os.fdopen(fd, 'w')
+    json.dump({'source' : stamp, 'psks' : psks}, f)
+    f.close()
+    os.replace(tmp_path, self.cache_path)
+
+  def network_params(self, ssid, psk, bssid=None):
+    if psk != None:
+      params = [
+        ('ssid', quote(ssid)),
+        ('scan_ssid', '1'),
+        ('psk', psk),
+      ]
+    else:
+      params = [
+        ('ssid', quote(ssid)),
+        ('proto', 'RSN'),
+        ('key_mgmt', 'NONE'),
+      ]
+    if bssid != None:
+      params.append(('bssid', bssid))
+    return params
+
+  def config_path(self, ssid):
+    name = hashlib.sha1(ssid.encode('utf-8')).hexdigest()
+    return os.path.join(self.config_dir, name + '.conf')
+
+  def render(self, path, params):
+    lines = ['network={']
+    for key, value in params:
+      lines.append('\t%s=%s' % (key, value))
+    lines.append('}\n')
+    tmp_path = path + '.tmp'
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.write(fd, '\n'.join(lines).encode('utf-8'))
+    os.close(fd)
+    os.replace(tmp_path, path)
+
+  def compile(self, credentials):
+    # ssid -> Credential, an empty passphrase is an open network
+    try:
+      stamp = self.source_stamp()
+    except OSError:
+      stamp = None
+    cached = self.load_cache(stamp)
+
+    psks = {}
+    derived = {}
+    for ssid, credential in credentials.items():
+      if len(credential.passphrase) == 0:
+        continue
+      psk = cached.get(ssid)
+      if psk == None:
+        previous = self.derived.get(ssid)
+        if previous != None and previous[0] == credential.passphrase:
+          psk = previous[1]
+        else:
+          psk = derive_psk(ssid, credential.passphrase)
+      psks[ssid] = psk
+      derived[ssid] = (credential.passphrase, psk)
+    self.derived = derived
+    if psks != cached and stamp != None:
+      try:
+        self.save_cache(stamp, psks)
+      except OSError:
+        pass
+
+    os.makedirs(self.config_dir, mode=0o700, exist_ok=True)
+    networks = {}
+    for ssid, credential in credentials.items():
+      psk = psks.get(ssid)
+      params = self.network_params(ssid, psk, credential.bssid)
+      path = self.config_path(ssid)
+      self.render(path, params)
+      networks[ssid] = CompiledNetwork(ssid, psk, params, path)
+
+    # configs of networks that were removed from the credentials file
+    paths = set(network.config_path for network in networks.values())
+    for name in os.listdir(self.config_dir):
+      path = os.path.join(self.config_dir, name)
+      if name.endswith('.conf') and path not in paths and not name.startswith('pinned.'):
+        os.remove(path)
+    return networks
+
+  def render_pinned(self, network, bssid, dev):
+    # roaming pins a BSSID, one reusable file per device is enough
+    path = os.path.join(self.config_dir, 'pinned.%s.conf' % (dev))
+    self.render(path, self.network_params(network.ssid, network.psk, bssid))
+    return path
@@ -0,0 +1,92 @@
+import re
+
+class DaemonMessage:
+  __slots__ = ('dev',)
+  fields = ()
+
+  def __init__(self, dev, *values):
+    self.dev = dev
+    for name, value in zip(self.fields, values):
+      setattr(self, name, value)
+
+# dhcpcd
+
+class LeaseAcquired(DaemonMessage):
+  __slots__ = fields = ('address', 'server')
+
+class LeaseRejected(DaemonMessage):
+  __slots__ = ()
+
+class LeaseExpired(DaemonMessage):
+  __slots__ = ()
+
+class AddressAdded(DaemonMessage):
+  __slots__ = fields = ('address', 'prefixlen')
+
+class RouteAdded(DaemonMessage):
+  __slots__ = fields = ('network', 'prefixlen')
+
+class DefaultRouteAdded(DaemonMessage):
+  __slots__ = fields = ('gateway',)
+
+class CarrierLost(DaemonMessage):
+  __slots__ = ()
+
+# wpa_supplicant
+
+class Associated(DaemonMessage):
+  __slots__ = fields = ('bssid',)
+
+class Disassociated(DaemonMessage):
+  __slots__ = fields = ('bssid',)
+
+DHCPCD_MESSAGES = [
+  (LeaseAcquired, r'acknowledged ([\d\.]+) from ([\d\.]+)'),
+  (LeaseRejected, r'NAK: '),
+  (LeaseExpired, r'(?:DHCP )?lease expired'),
+  (AddressAdded, r'adding IP address ([\d\.]+)/(\d+)'),
+  (RouteAdded, r'adding route to ([\d\.]+)/(\d+)'),
+  (DefaultRouteAdded, r'adding default route via ([\d\.]+)'),
+  (CarrierLost, r'carrier lost'),
+]
+
+WPA_MESSAGES = [
+  (Associated, r'CTRL-EVENT-CONNECTED(?: - Connection to ([0-9a-fA-F:]{17}))?'),
+  (Disassociated, r'CTRL-EVENT-DISCONNECTED(?: bssid=([0-9a-fA-F:]{17}))?'),
+]
+
+def compile_messages(messages):
+  # one alternation with a named outer group per message type, so a single
+  # match both classifies the line and captures its fields
+  alternatives = []
+  classes = {}
+  for cls, pattern in messages:
+    alternatives.append('(?P<%s>%s)' % (cls.__name__, pattern))
+    classes[cls.__name__] = cls
+  return re.compile('|'.join(alternatives)), classes
+
+DHCPCD_RE, DHCPCD_CLASSES = compile_messages(DHCPCD_MESSAGES)
+WPA_RE, WPA_CLASSES = compile_messages(WPA_MESSAGES)
+
+def build(m, classes, dev):
+  # the outer group closes last, its inner groups follow it
+  cls = classes[m.lastgroup]
+  index = m.lastindex
+  return cls(dev, *m.groups()[index:index + len(cls.fields)])
+
+def parse_dhcpcd(line):
+  # "<dev>: <message>"
+  dev, sep, msg = line.partition(': ')
+  if len(sep) == 0:
+    return None
+  m = DHCPCD_RE.match(msg)
+  if m == None:
+    return None
+  return build(m, DHCPCD_CLASSES, dev)
+
+def parse_wpa(msg, dev=None):
+  # msg has its interface or priority prefix stripped already
+  m = WPA_RE.match(msg)
+  if m == None:
+    return None
+  return build(m, WPA_CLASSES, dev)
@@ -1,38 +1,85 @@
-import threading
-import subprocess
-import re
-import time
+import socket
 
 from constants import *
+import rtnetlink
+from events import *
 
-class EthernetCableMonitor(threading.Thread):
+class EthernetCableMonitor:
   def __init__(self, parent):
-    threading.Thread.__init__(self)
-
     self.parent = parent
     self.dev = parent.dev
+    self.reactor = parent.parent.reactor
     self.event_queue = parent.event_queue
     self.last_state = -1
 
     self.exiting = False
+    self.sock = None
+    self.poll_handle = None
 
-  def run(self):
-    path = '/sys/class/net/' + self.dev + '/carrier'
-    m = {0 : 'disconnected', 1 : 'connected'}
+  def start(self):
+    try:
+      self.index = socket.if_nametoindex(self.dev)
+      self.sock = rtnetlink.open_socket(rtnetlink.RTMGRP_LINK)
+      self.sock.setblocking(False)
+    except OSError as e:
+      self.parent.print('netlink unavailable (%s), polling sysfs for carrier' % (e))
+      self.sample_sysfs()
+      self.poll_handle = self.reactor.call_every(CABLE_POLL_INTERVALL, self.sample_sysfs)
+      return
 
-    while True:
-      if self.exiting:
-        break
+    # subscribed before sampling the initial state so no transition is lost
+    self.sample_sysfs()
+    self.reactor.add_reader(self.sock.fileno(), self.on_netlink)
 
+  def stop(self):
+    self.exiting = True
+    if self.poll_handle != None:
+      self.poll_handle.cancel()
+      self.poll_handle = None
+    if self.sock != None:
+      self.reactor.remove_reader(self.sock.fileno())
+      self.sock.close()
+      self.sock = None
+
+  def set_state(self, state):
+    m = {0 : 'disconnected', 1 : 'connected'}
+    if state != self.last_state:
+      self.last_state = state
+      self.event_queue.put(CableStateChange(m[state]))
+
+  def read_sysfs_carrier(self):
+    path = '/sys/class/net/' + self.dev + '/carrier'
+    try:
       f = open(path, 'r')
       contents = f.read().strip()
-      if len(contents) > 0:
-        state = int(contents)
+      f.close()
+    except OSError:
+      # reading carrier of a device that is down fails with EINVAL
+      return 0
+    if len(contents) == 0:
+      return None
+    return int(contents)
 
-        if state != self.last_state:
-          self.last_state = state
-          self.event_queue.put(['cable_state_change', m[state]])
+  def sample_sysfs(self):
+    state = self.read_sysfs_carrier()
+    if state != None:
+      self.set_state(state)
 
-      f.close()
+  def on_netlink(self):
+    try:
+      data = self.sock.recv(65536)
+    except OSError:
+      # ENOBUFS, we missed notifications so resample the carrier
+      self.sample_sysfs()
+      return
 
-      time.sleep(CABLE_POLL_INTERVALL)
+    for msg_type, flags, seq, payload in rtnetlink.parse_messages(data):
+      if msg_type != rtnetlink.RTM_NEWLINK:
+        continue
+      link_index, name, link_flags = rtnetlink.parse_link(payload)
+      if link_index != self.index:
+        continue
+      if link_flags & rtnetlink.IFF_LOWER_UP:
+        self.set_state(1)
+      else:
+        self.set_state(0)
@@ -1,16 +1,17 @@
-import threading
-import subprocess
-import re
 import time
-import queue
-import os
-import tempfile
 import pexpect
 import sys
 import datetime
 
 from constants import *
 from eth_cable_monitor import *
+from reactor import *
+from events import *
+from daemon_output import *
+from probing import *
+from metrics import *
+from supervisor import *
+from adopt import *
 
 METRIC = 100
 
@@ -19,24 +20,40 @@ class State:
   CONNECTING = 0
   CONNECTED = 1
 
-class EthernetConnection(threading.Thread):
+class EthernetConnection:
   def __init__(self, parent, dev):
-    threading.Thread.__init__(self)
-
     self.parent = parent
     self.dev = dev
-    self.event_queue = queue.Queue()
+    self.exiting = False
+    self.timeline = Timeline(parent.metrics, dev)
+    self.event_queue = EventQueue(parent.reactor, self.dispatch)
 
     self.print('entering DISCONNECTED state')
     self.state = State.DISCONNECTED
 
     self.dhcpcd = None
-    self.prev_data = ''
+    self.dhcpcd_backoff = RestartBackoff()
+    self.restart_handle = None
+    self.spawn_handle = None
+
+    self.cable_monitor = EthernetCableMonitor(self)
+    self.gateway = None
+    self.demoted = False
+    self.prober = ProbeEngine(self)
 
-    self.cable_mon_thread = EthernetCableMonitor(self)
-    self.cable_mon_thread.start()
+    self.dispatcher = {}
+    self.dispatcher[CableStateChange] = self.on_cable_state_change
+    self.dispatcher[DhcpcdLine] = self.on_dhcpcd
+    self.dispatcher[ChildExit] = self.on_child_exit
+    self.dispatcher[ProbeHealth] = self.on_probe_health
 
-    self.queue_listen_to_dhcpcd_request()
+    self.dhcpcd_handlers = {}
+    self.dhcpcd_handlers[LeaseAcquired] = self.on_lease_acquired
+    self.dhcpcd_handlers[LeaseRejected] = self.on_lease_rejected
+    self.dhcpcd_handlers[LeaseExpired] = self.on_lease_expired
+    self.dhcpcd_handlers[AddressAdded] = self.on_address_added
+    self.dhcpcd_handlers[RouteAdded] = self.on_route_added
+    self.dhcpcd_handlers[DefaultRouteAdded] = self.on_default_route_added
 
   def print(self, msg):
     sys.stdout.write(str(datetime.datetime.now()))
@@ -47,32 +64,83 @@ class EthernetConnection(threading.Thread):
     sys.stdout.write('\n')
 
   def kill_dhcpcd(self):
-    try:
-      if self.dhcpcd != None:
-        self.dhcpcd.close(force=True)
-        self.dhcpcd = None
-    except:
-      pass
+    self.prober.stop()
+    self.gateway = None
+    self.demoted = False
+    if self.restart_handle != None:
+      self.restart_handle.cancel()
+      self.restart_handle = None
+    if self.spawn_handle != None:
+      self.spawn_handle.cancel()
+      self.spawn_handle = None
+    if self.dhcpcd != None:
+      self.parent.output_reader.unregister(self.dhcpcd)
+      self.parent.supervisor.terminate(self.dhcpcd, self.dhcpcd_key())
+      self.dhcpcd = None
+
+  def dhcpcd_key(self):
+    return 'dhcpcd:%s' % (self.dev)
+
+  def start(self):
+    self.cable_monitor.start()
+
+  def adopt(self, snapshot):
+    if not snapshot.connected():
+      return
+    self.print('adopting existing connection via %s (%s)' % (snapshot.gateway, ', '.join(snapshot.addrs)))
+    # the carrier is already up, the first sample must not flush the address
+    self.cable_monitor.last_state = 1
+    self.gateway = snapshot.gateway
+    self.print('entering CONNECTED state')
+    self.state = State.CONNECTED
+    if snapshot.dhcpcd != None:
+      self.print('supervising running dhcpcd (pid %d)' % (snapshot.dhcpcd))
+      self.dhcpcd = AdoptedProcess(snapshot.dhcpcd, 'dhcpcd')
+      self.parent.supervisor.watch(self.dhcpcd, self.event_queue, 'dhcpcd')
+      self.dhcpcd_backoff.started()
+    else:
+      # renews the lease in place, the address stays configured meanwhile
+      self.start_dhcpcd(snapshot.addrs[0].split('/')[0])
+      self.gateway = snapshot.gateway
+    if not PROBE_ENABLED:
+      self.parent.suppress_wifi()
+      return
+    self.prober.start(self.gateway)
+
+  def children(self):
+    if self.dhcpcd == None:
+      return []
+    return [self.dhcpcd]
 
   def cleanup(self):
-    self.event_queue.put(['exiting', ''])
-    self.cable_mon_thread.exiting = True
+    self.exiting = True
+    self.cable_monitor.stop()
     self.kill_dhcpcd()
 
   def on_cable_state_change(self, args):
     if args == 'disconnected':
+      carrier_lost_time = None
+      if self.state == State.CONNECTED:
+        carrier_lost_time = time.monotonic()
       self.print('cable disconnected, killing dhcpcd')
       self.kill_dhcpcd()
       self.parent.flush_device_ip_addr(self.dev)
-      self.parent.unsuppress_wifi()
+      self.print('entering DISCONNECTED state')
+      self.state = State.DISCONNECTED
+      self.parent.unsuppress_wifi(carrier_lost_time)
     elif args == 'connected':
       self.print('cable connected, starting dhcpcd')
+      self.timeline.reset()
+      self.timeline.mark('carrier_up')
       self.print('entering CONNECTING state')
       self.state = State.CONNECTING
       self.parent.flush_device_ip_addr(self.dev)
       self.start_dhcpcd()
 
-  def start_dhcpcd(self):
+  def lease_keys(self):
+    return ['ethernet:%s' % (self.dev)]
+
+  def start_dhcpcd(self, address=None):
     self.kill_dhcpcd()
 
     cmd = '%s '
@@ -88,91 +156,124 @@ class EthernetConnection(threading.Thread):
     cmd += '--noarp '
     # speed hack, no ARP check
     cmd += '--ipv4only '
+    if FAST_START:
+      # leave the address in place on exit for the next run to adopt
+      cmd += '--persistent '
+    # speed hack, ask for the previous address on this network first
+    if address == None:
+      address = self.parent.lease_cache.get(*self.lease_keys())
+    if address != None:
+      cmd += '--request %s ' % (address)
     # debug
     cmd += '-d '
     cmd += '%s'
     cmd = cmd % (DHCPCD, self.dev)
 
+    self.spawn_handle = self.parent.supervisor.when_gone(self.dhcpcd_key(), self.spawn_dhcpcd, cmd)
+
+  def spawn_dhcpcd(self, cmd):
+    self.spawn_handle = None
+    if self.exiting:
+      return
     self.dhcpcd = pexpect.spawn(cmd, timeout=5)
+    self.parent.output_reader.register(self.dhcpcd, self.event_queue, DhcpcdLine)
+    self.parent.supervisor.watch(self.dhcpcd, self.event_queue, 'dhcpcd')
+    self.dhcpcd_backoff.started()
 
   def on_dhcpcd(self, args):
-    print('******** ' + args)
-    #m = re.match(r'dhcpcd\[(\d+)\]: (.+): (.+)', args)
-    #if m == None:
-      #return
-    #pid = m.group(1)
-    #dev = m.group(2)
-    #msg = m.group(3)
-    m = re.match(r'(.+?): (.+)', args)
-    if m == None:
+    if LOG_DAEMON_OUTPUT:
+      self.print('dhcpcd: ' + args)
+    message = parse_dhcpcd(args)
+    if message == None:
       return
-    dev = m.group(1)
-    msg = m.group(2)
-
-    m = re.match(r'acknowledged ([\d\.]+) from ([\d\.]+)', msg)
-    if m != None:
-      myip = m.group(1)
-      gateway = m.group(2)
-      self.print('gateway: ' + gateway)
+    handler = self.dhcpcd_handlers.get(type(message))
+    if handler != None:
+      handler(message)
+
+  def on_lease_acquired(self, message):
+    self.print('gateway: ' + message.server)
+    self.timeline.mark('dhcp')
+    self.timeline.observe('interkonnect_dhcp_seconds', 'carrier_up', 'dhcp')
+    self.parent.lease_cache.put(self.lease_keys(), message.address, message.server)
+
+  def on_lease_rejected(self, message):
+    self.print('previous lease rejected, forgetting it')
+    self.parent.lease_cache.forget(self.lease_keys())
+
+  def on_lease_expired(self, message):
+    self.print('lease expired, waiting for dhcpcd to rebind')
+    if self.state == State.CONNECTED:
+      self.prober.stop()
+      self.timeline.reset()
+      self.print('entering CONNECTING state')
+      self.state = State.CONNECTING
+      self.parent.unsuppress_wifi(time.monotonic())
+
+  def on_address_added(self, message):
+    self.print('my ip address: ' + message.address)
+
+  def on_route_added(self, message):
+    self.print('adding route to: ' + message.network + '/' + message.prefixlen)
+    if self.state == State.CONNECTING:
+      self.timeline.mark('route')
+      self.timeline.observe('interkonnect_route_seconds', 'dhcp', 'route')
+      self.timeline.observe('interkonnect_time_to_connectivity_seconds', 'carrier_up', 'route')
+    self.state = State.CONNECTED
+    self.print('entering CONNECTED state')
+    if not PROBE_ENABLED:
+      self.parent.suppress_wifi()
       return
+    # WiFi is only suppressed once traffic is known to flow
+    self.prober.start(self.gateway)
 
-    m = re.match(r'adding IP address ([\d\.]+)/(\d+)', msg)
-    if m != None:
-      myip = m.group(1)
-      subnetmask = m.group(2)
-      self.print('my ip address: ' + myip)
+  def on_default_route_added(self, message):
+    self.print('adding default route via: ' + message.gateway)
+    if message.gateway == self.gateway:
       return
+    self.gateway = message.gateway
+    if PROBE_ENABLED and self.state == State.CONNECTED:
+      self.prober.stop()
+      self.prober.start(self.gateway)
 
-    m = re.match(r'adding route to ([\d\.]+)/(\d+)', msg)
-    if m != None:
-      routeip = m.group(1)
-      subnetmask = m.group(2)
-      self.print('adding route to: ' + routeip + '/' + subnetmask)
-      self.state = State.CONNECTED
-      self.print('entering CONNECTED state')
+  def on_probe_health(self, healthy):
+    if self.state != State.CONNECTED:
+      return
+    if healthy:
+      self.print('data path healthy')
+      if self.demoted and self.gateway != None:
+        self.parent.set_default_route_metric(self.dev, self.gateway, PROBE_DEMOTED_METRIC, METRIC)
+      self.demoted = False
       self.parent.suppress_wifi()
+    else:
+      self.print('data path unhealthy, failing over to WiFi')
+      if not self.demoted and self.gateway != None:
+        self.parent.set_default_route_metric(self.dev, self.gateway, METRIC, PROBE_DEMOTED_METRIC)
+        self.demoted = True
+      self.parent.unsuppress_wifi(time.monotonic())
+
+  def on_child_exit(self, name):
+    self.kill_dhcpcd()
+    if self.state == State.DISCONNECTED:
+      return
+    # the cable is still plugged in, keep the lease alive
+    delay = self.dhcpcd_backoff.next_delay()
+    self.print('dhcpcd exited, restarting it in %.1f seconds' % (delay))
+    if self.state == State.CONNECTED:
+      self.print('entering CONNECTING state')
+      self.state = State.CONNECTING
+      self.parent.unsuppress_wifi(time.monotonic())
+    self.restart_handle = self.parent.reactor.call_later(delay, self.restart_dhcpcd)
+
+  def restart_dhcpcd(self):
+    self.restart_handle = None
+    if self.exiting or self.state == State.DISCONNECTED:
       return
+    self.start_dhcpcd()
 
-    m = re.match(r'adding default route via ([\d\.]+)', msg)
-    if m != None:
-      gateway = m.group(1)
-      self.print('adding default route via: ' + gateway)
+  def dispatch(self, event):
+    if self.exiting:
       return
 
-  def queue_listen_to_dhcpcd_request(self):
-    self.event_queue.put(['listen_to_dhcpcd', ''])
-
-  def on_listen_to_dhcpcd(self, args):
-    if self.dhcpcd is not None:
-      try:
-        data = self.dhcpcd.read_nonblocking(9001, 0)
-        data = data.decode('utf-8')
-        data = self.prev_data + data
-        tokens = data.split('\n')
-        if not tokens[-1].endswith('\n'):
-          self.prev_data = tokens[-1]
-          tokens.pop()
-        else:
-          self.prev_data = ''
-        for token in tokens:
-          self.event_queue.put(['dhcpcd', token.strip()])
-      except:
-        pass
-    threading.Timer(0.25, self.queue_listen_to_dhcpcd_request).start()
-
-  def run(self):
-    dispatcher = {}
-    dispatcher['cable_state_change'] = self.on_cable_state_change
-    dispatcher['dhcpcd'] = self.on_dhcpcd
-    dispatcher['listen_to_dhcpcd'] = self.on_listen_to_dhcpcd
-
-    while True:
-      event = self.event_queue.get()
-      event_type = event[0]
-      args = event[1]
-
-      if event_type == 'exiting':
-        break
-
-      if event_type in dispatcher:
-        dispatcher[event_type](args)
+    handler = self.dispatcher.get(type(event))
+    if handler != None:
+      handler(event.args)
@@ -0,0 +1,97 @@
+from constants import *
+
+# lower values are dispatched first
+CONTROL = 0
+NORMAL = 1
+LOG = 2
+
+class Event:
+  __slots__ = ('args', 'source')
+  priority = NORMAL
+  # a coalescing event replaces the args of one of its kind that is still
+  # queued instead of being queued again
+  coalesce = False
+
+  def __init__(self, args=None, source=None):
+    self.args = args
+    self.source = source
+
+# control events, these preempt everything else
+
+class CableStateChange(Event):
+  __slots__ = ()
+  priority = CONTROL
+  coalesce = True
+
+class Suppress(Event):
+  __slots__ = ()
+  priority = CONTROL
+
+class Unsuppress(Event):
+  __slots__ = ()
+  priority = CONTROL
+
+class ChildExit(Event):
+  __slots__ = ()
+  priority = CONTROL
+
+class RoamTimeout(Event):
+  __slots__ = ()
+  priority = CONTROL
+
+class Watchdog(Event):
+  __slots__ = ()
+  priority = CONTROL
+  coalesce = True
+
+class ProbeHealth(Event):
+  __slots__ = ()
+  priority = CONTROL
+  coalesce = True
+
+# state machine input
+
+class WifiStations(Event):
+  __slots__ = ()
+  # only the latest scan result matters
+  coalesce = True
+
+class WpaEvent(Event):
+  __slots__ = ()
+
+class Roam(Event):
+  __slots__ = ()
+  coalesce = True
+
+class ScanRequest(Event):
+  __slots__ = ()
+  coalesce = True
+
+class ConnectRequest(Event):
+  __slots__ = ()
+  coalesce = True
+
+class PinRequest(Event):
+  __slots__ = ()
+  coalesce = True
+
+class ReloadCredentials(Event):
+  __slots__ = ()
+  coalesce = True
+
+class CredentialsChanged(Event):
+  __slots__ = ()
+
+# daemon output, one event per line
+
+class DhcpcdLine(Event):
+  __slots__ = ()
+  priority = LOG
+
+class WpaSupplicantLine(Event):
+  __slots__ = ()
+  priority = LOG
+
+class WpaSupplicantLog(Event):
+  __slots__ = ()
+  priority = LOG
@@ -0,0 +1,57 @@
+import ctypes.util
+import ctypes
+import struct
+import os
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+# struct inotify_event, followed by a NUL padded name of `len` bytes
+EVENT = struct.Struct('iIII')
+
+libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+class Inotify:
+  def __init__(self):
+    self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if self.fd < 0:
+      errno = ctypes.get_errno()
+      raise OSError(errno, os.strerror(errno))
+
+  def fileno(self):
+    return self.fd
+
+  def close(self):
+    if self.fd != -1:
+      os.close(self.fd)
+      self.fd = -1
+
+  def add_watch(self, path, mask):
+    wd = libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+    if wd < 0:
+      errno = ctypes.get_errno()
+      raise OSError(errno, os.strerror(errno), path)
+    return wd
+
+  def read(self):
+    # list of (wd, mask, name)
+    try:
+      data = os.read(self.fd, 65536)
+    except BlockingIOError:
+      return []
+    events = []
+    offset = 0
+    while offset + EVENT.size <= len(data):
+      wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+      offset += EVENT.size
+      name = data[offset:offset + length].rstrip(b'\0')
+      offset += length
+      events.append((wd, mask, os.fsdecode(name)))
+    return events
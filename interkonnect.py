@@ -3,15 +3,21 @@
 import os
 import sys
 import subprocess
-import re
-import threading
-import time
-import queue
 import signal
+import traceback
 
 from constants import *
 from wifi_connection import *
 from ethernet_connection import *
+from output_reader import *
+from link_backend import *
+from lease_cache import *
+from reactor import *
+from connection_history import *
+from metrics import *
+from control import *
+from supervisor import *
+from lifecycle import *
 
 class InterKonnect:
   def __init__(self):
@@ -20,20 +26,23 @@ class InterKonnect:
 
     self.ethernet_connection = None
     self.wifi_connection = None
-
-    self.event_queue = queue.Queue()
+    self.exit_code = 0
+
+    self.reactor = Reactor()
+    self.output_reader = OutputReader(self.reactor)
+    self.supervisor = ChildSupervisor(self.reactor)
+    self.link_backend = make_link_backend()
+    self.lease_cache = LeaseCache(self.reactor)
+    self.connection_history = ConnectionHistory(self.reactor)
+    self.metrics = Metrics()
+    self.metrics.sample('interkonnect_timer_wakeups_total', 'counter', lambda: self.reactor.timers.wakeups)
+    self.metrics_server = MetricsServer(self.metrics)
+    self.control_server = ControlServer(self)
+    self.lifecycle = Lifecycle(self)
+    self.metrics.sample('interkonnect_startup_seconds', 'gauge', lambda: self.lifecycle.startup_seconds)
 
   def discover_devices(self):
-    cmd = '%s link list' % (IP)
-    output = subprocess.check_output(cmd, shell=True).decode('utf-8')
-    lines = output.split('\n')
-    for i in range(0, len(lines), 2):
-      line = lines[i]
-      if len(line) == 0:
-        continue
-      m = re.match(r'\d+:\s(.+): <', lines[i])
-      dev = m.group(1)
-
+    for dev in self.link_backend.list_links():
       if dev.startswith('enp'):
         if self.eth_dev != None:
           assert False, 'multiple ethernet devices detected, this program will not work!'
@@ -51,76 +60,76 @@ class InterKonnect:
     print('using ethernet device %s and wireless device %s' % (self.eth_dev, self.wifi_dev))
 
   def bring_device_up(self, dev):
-    cmd = '%s link set %s up' % (IP, dev)
-    print('bringing device up (%s)' % (cmd))
-    subprocess.check_call(cmd, shell=True)
+    print('bringing device up (%s, %s)' % (dev, self.link_backend.name))
+    self.link_backend.set_link_up(dev)
 
   def bring_device_down(self, dev):
-    cmd = '%s link set %s down' % (IP, dev)
-    print('bringing device down (%s)' % (cmd))
-    subprocess.check_call(cmd, shell=True)
+    print('bringing device down (%s, %s)' % (dev, self.link_backend.name))
+    self.link_backend.set_link_down(dev)
+
+  def set_default_route_metric(self, dev, gateway, old_metric, new_metric):
+    # on the failover path, so it must not block the reactor
+    self.reactor.spawn(self.change_default_route_metric(dev, gateway, old_metric, new_metric))
+
+  async def change_default_route_metric(self, dev, gateway, old_metric, new_metric):
+    print('setting default route metric of %s to %d (%s)' % (dev, new_metric, self.link_backend.name))
+    try:
+      await self.reactor.run_in_executor(self.link_backend.set_default_route_metric,
+                                         dev, gateway, old_metric, new_metric)
+    except (OSError, subprocess.CalledProcessError) as e:
+      print('failed to set default route metric of %s: %s' % (dev, e))
 
   def flush_device_ip_addr(self, dev):
-    cmd = '%s addr flush %s' % (IP, dev)
-    print('flushing IP addr of device (%s)' % (cmd))
-    subprocess.check_call(cmd, shell=True)
+    print('flushing IP addr of device (%s, %s)' % (dev, self.link_backend.name))
+    self.link_backend.flush_addrs(dev)
 
   def install_ctrl_c_handler(self):
     self.num_interrupts = 0
 
-    def signal_handler(signal, frame):
+    def signal_handler(signum):
       self.num_interrupts += 1
       if self.num_interrupts > 1:
-        return
-
-      self.event_queue.put(['exiting', ''])
-
-      if self.wifi_connection != None:
-        self.wifi_connection.cleanup()
-      if self.ethernet_connection != None:
-        self.ethernet_connection.cleanup()
+        print('interrupted again, exiting without cleanup')
+        os._exit(1)
 
-      self.flush_device_ip_addr(self.eth_dev)
-      self.bring_device_down(self.eth_dev)
+      self.reactor.spawn(self.lifecycle.shutdown())
 
-      self.flush_device_ip_addr(self.wifi_dev)
-      self.bring_device_down(self.wifi_dev)
-
-      import hanging_threads
-      sys.exit(0)
-
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
-    signal.signal(signal.SIGHUP, signal_handler)
+    # handled on the reactor so cleanup never interrupts an event handler
+    for signum in [signal.SIGINT, signal.SIGTERM, signal.SIGHUP]:
+      self.reactor.add_signal_handler(signum, signal_handler, signum)
 
   def suppress_wifi(self):
     print('suppressing WiFi')
-    self.wifi_connection.event_queue.put(['suppress', ''])
+    self.wifi_connection.event_queue.put(Suppress())
 
-  def unsuppress_wifi(self):
+  def unsuppress_wifi(self, carrier_lost_time=None):
     print('unsuppressing WiFi')
-    self.wifi_connection.event_queue.put(['unsuppress', ''])
+    self.wifi_connection.event_queue.put(Unsuppress(carrier_lost_time))
+
+  async def start(self):
+    # nothing awaits the startup task, a failure would otherwise leave the
+    # reactor running with no connections
+    try:
+      await self.lifecycle.startup()
+    except Exception:
+      traceback.print_exc()
+      print('startup failed, shutting down')
+      self.exit_code = 1
+      await self.lifecycle.shutdown()
 
   def run(self):
     self.install_ctrl_c_handler()
 
     self.discover_devices()
-    self.bring_device_up(self.eth_dev)
-    self.bring_device_up(self.wifi_dev)
-
-    self.wifi_connection = WifiConnection(self, self.wifi_dev)
-    self.wifi_connection.start()
-
-    self.ethernet_connection = EthernetConnection(self, self.eth_dev)
-    self.ethernet_connection.start()
-
-    while True:
-      event = self.event_queue.get()
-      type = event[0]
-      args = event[1]
+    self.reactor.spawn(self.start())
+    self.reactor.run()
 
-      if type == 'exiting':
-        break
+    # the interpreter joins executor threads on exit, one stuck in a hung
+    # `ip` or netlink call would hold it forever
+    if self.lifecycle.abandoned > 0:
+      print('%d abandoned steps still running, exiting without them' % (self.lifecycle.abandoned))
+      sys.stdout.flush()
+      os._exit(self.exit_code)
 
 if __name__ == '__main__':
   if os.geteuid() != 0:
@@ -136,3 +145,4 @@ if __name__ == '__main__':
 
   interkonnect = InterKonnect()
   interkonnect.run()
+  sys.exit(interkonnect.exit_code)
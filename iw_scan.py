@@ -0,0 +1,86 @@
+import re
+
+BSS_RE = re.compile(r'BSS ([0-9a-fA-F:]{17})')
+
+VHT_WIDTHS = {'1' : 80, '2' : 160, '3' : 160}
+
+class Station:
+  __slots__ = ('bssid', 'ssid', 'freq', 'signal', 'security', 'capability',
+               'ht', 'vht', 'he', 'width', 'station_count', 'utilization')
+
+  def __init__(self, bssid):
+    self.bssid = bssid
+    self.ssid = None
+    self.freq = 0
+    self.signal = -100.0
+    self.security = ''
+    self.capability = ''
+    self.ht = False
+    self.vht = False
+    self.he = False
+    self.width = 20
+    # from the BSS Load element, None if the AP does not advertise it
+    self.station_count = None
+    self.utilization = None
+
+  def __repr__(self):
+    return 'Station(%s, %r, %d MHz, %.2f dBm)' % (self.bssid, self.ssid, self.freq, self.signal)
+
+class ScanParser:
+  # consumes `iw dev <dev> scan` output line by line as it arrives from the
+  # subprocess pipe, and only keeps the fields we use
+  def __init__(self):
+    self.stations = []
+    self.station = None
+
+  def feed(self, line):
+    if line.startswith('BSS '):
+      m = BSS_RE.match(line)
+      self.station = None
+      if m != None:
+        self.station = Station(m.group(1))
+        self.stations.append(self.station)
+      return
+    station = self.station
+    if station == None:
+      return
+
+    line = line.strip()
+    if line.startswith('SSID: '):
+      if station.ssid == None:
+        station.ssid = line[6:]
+    elif line.startswith('freq: '):
+      station.freq = int(float(line[6:]))
+    elif line.startswith('signal: '):
+      station.signal = float(line[8:].split(' ', 1)[0])
+    elif line.startswith('capability: '):
+      station.capability = line[12:]
+    elif line == 'RSN:' or line.startswith('RSN:\t'):
+      station.security = 'RSN'
+    elif line.startswith('WPA:') and station.security == '':
+      station.security = 'WPA'
+    elif line.startswith('HT capabilities:'):
+      station.ht = True
+    elif line.startswith('VHT capabilities:'):
+      station.vht = True
+    elif line.startswith('HE capabilities:'):
+      station.he = True
+    elif line.startswith('* secondary channel offset: '):
+      if line[28:] in ('above', 'below'):
+        station.width = max(station.width, 40)
+    elif line.startswith('* channel width: '):
+      # VHT operation, 0 means the HT width applies
+      width = VHT_WIDTHS.get(line[17:18])
+      if width != None:
+        station.width = max(station.width, width)
+    elif line.startswith('* station count: '):
+      station.station_count = int(line[17:])
+    elif line.startswith('* channel utilisation: '):
+      used, total = line[23:].split('/')
+      station.utilization = float(used) / float(total)
+
+def parse_scan(lines):
+  parser = ScanParser()
+  for line in lines:
+    parser.feed(line)
+  return parser.stations
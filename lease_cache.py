@@ -0,0 +1,63 @@
+import json
+import os
+
+from constants import *
+
+class LeaseCache:
+  def __init__(self, reactor, path=LEASE_CACHE_PATH):
+    self.reactor = reactor
+    self.path = path
+    self.leases = {}
+    # a write is in flight, and whether the leases changed since it started
+    self.saving = False
+    self.dirty = False
+    try:
+      f = open(self.path, 'r')
+      self.leases = json.load(f)
+      f.close()
+    except (OSError, ValueError):
+      pass
+
+  def save(self, contents):
+    os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+    tmp_path = self.path + '.tmp'
+    f = open(tmp_path, 'w')
+    f.write(contents)
+    f.close()
+    os.replace(tmp_path, self.path)
+
+  def schedule_save(self):
+    # written from the executor, one write at a time so they never share the
+    # temporary file; changes made meanwhile go out in the next one
+    self.dirty = True
+    if not self.saving:
+      self.saving = True
+      self.reactor.spawn(self.write())
+
+  async def write(self):
+    try:
+      while self.dirty:
+        self.dirty = False
+        try:
+          await self.reactor.run_in_executor(self.save, json.dumps(self.leases))
+        except OSError:
+          pass
+    finally:
+      self.saving = False
+
+  def get(self, *keys):
+    # first key that has a lease wins, so pass the most specific key first
+    for key in keys:
+      if key in self.leases:
+        return self.leases[key]['address']
+    return None
+
+  def put(self, keys, address, server):
+    for key in keys:
+      self.leases[key] = {'address' : address, 'server' : server}
+    self.schedule_save()
+
+  def forget(self, keys):
+    for key in keys:
+      self.leases.pop(key, None)
+    self.schedule_save()
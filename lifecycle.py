@@ -0,0 +1,166 @@
+import asyncio
+import signal
+import time
+
+from constants import *
+from wifi_connection import *
+from ethernet_connection import *
+from adopt import *
+
+class Lifecycle:
+  # brings both interfaces up and down concurrently, every blocking step runs
+  # off the reactor and is bounded by a deadline so a stuck `ip` or daemon
+  # cannot hold up a restart
+  def __init__(self, parent):
+    self.parent = parent
+    self.reactor = parent.reactor
+
+    self.startup_seconds = None
+    self.shutdown_seconds = None
+    # steps given up on at their deadline, their threads may never return
+    self.abandoned = 0
+
+  async def step(self, name, fn, *args):
+    future = self.reactor.run_in_executor(fn, *args)
+    try:
+      await asyncio.wait_for(future, LIFECYCLE_STEP_DEADLINE)
+      return True
+    except asyncio.TimeoutError:
+      self.abandoned += 1
+      print('%s did not finish within %.1f seconds, moving on' % (name, LIFECYCLE_STEP_DEADLINE))
+    except Exception as e:
+      print('%s failed: %s' % (name, e))
+    return False
+
+  async def inspect(self, dev, wireless):
+    future = self.reactor.run_in_executor(inspect_link, self.parent.link_backend, dev, wireless)
+    try:
+      snapshot = await asyncio.wait_for(future, LIFECYCLE_STEP_DEADLINE)
+    except asyncio.TimeoutError:
+      self.abandoned += 1
+      print('inspecting %s did not finish within %.1f seconds, starting it from scratch' % (dev, LIFECYCLE_STEP_DEADLINE))
+      return None
+    except Exception as e:
+      print('inspecting %s failed, starting it from scratch: %s' % (dev, e))
+      return None
+    return snapshot
+
+  async def bring_up(self, dev, snapshot=None):
+    if snapshot != None and snapshot.up:
+      return
+    await self.step('bringing up %s' % (dev), self.parent.bring_device_up, dev)
+
+  async def bring_down(self, dev):
+    await self.step('flushing %s' % (dev), self.parent.flush_device_ip_addr, dev)
+    await self.step('bringing down %s' % (dev), self.parent.bring_device_down, dev)
+
+  async def startup(self):
+    start = time.monotonic()
+    parent = self.parent
+
+    eth_snapshot = None
+    wifi_snapshot = None
+    if FAST_START:
+      eth_snapshot, wifi_snapshot = await asyncio.gather(
+          self.inspect(parent.eth_dev, False), self.inspect(parent.wifi_dev, True))
+
+    await asyncio.gather(self.bring_up(parent.eth_dev, eth_snapshot),
+                         self.bring_up(parent.wifi_dev, wifi_snapshot))
+
+    # adopting happens before start() so the first carrier sample and scan
+    # already see the connected state
+    parent.wifi_connection = WifiConnection(parent, parent.wifi_dev)
+    if wifi_snapshot != None:
+      parent.wifi_connection.adopt(wifi_snapshot)
+    parent.wifi_connection.start()
+
+    parent.ethernet_connection = EthernetConnection(parent, parent.eth_dev)
+    if eth_snapshot != None:
+      parent.ethernet_connection.adopt(eth_snapshot)
+    parent.ethernet_connection.start()
+
+    await asyncio.gather(parent.metrics_server.start(), parent.control_server.start())
+
+    self.startup_seconds = time.monotonic() - start
+    print('startup took %.3f seconds' % (self.startup_seconds))
+
+  def children(self):
+    children = []
+    for connection in [self.parent.wifi_connection, self.parent.ethernet_connection]:
+      if connection != None:
+        children += connection.children()
+    # killed earlier but not reaped yet
+    return children + self.parent.supervisor.dying_children()
+
+  async def wait_for_exit(self, children, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+      children = [child for child in children if child.isalive()]
+      if len(children) == 0:
+        break
+      await self.reactor.sleep(0.05)
+    return [child for child in children if child.isalive()]
+
+  async def terminate(self):
+    # every daemon gets SIGTERM at once, whatever is left at the deadline
+    # gets SIGKILL
+    children = self.children()
+    for child in children:
+      self.parent.supervisor.unwatch(child)
+      try:
+        child.kill(signal.SIGTERM)
+      except OSError:
+        pass
+
+    stuck = await self.wait_for_exit(children, LIFECYCLE_TERM_TIMEOUT)
+    for child in stuck:
+      print('%s ignored SIGTERM, killing it' % (child.name))
+      try:
+        child.kill(signal.SIGKILL)
+      except OSError:
+        pass
+    await self.wait_for_exit(stuck, LIFECYCLE_TERM_TIMEOUT)
+
+  async def join(self):
+    # waits for every scanner, prober and server task to unwind
+    current = asyncio.current_task()
+    tasks = [task for task in asyncio.all_tasks() if task is not current]
+    for task in tasks:
+      task.cancel()
+    if len(tasks) > 0:
+      await asyncio.wait(tasks, timeout=LIFECYCLE_STEP_DEADLINE)
+
+  async def shutdown(self):
+    start = time.monotonic()
+    parent = self.parent
+
+    parent.metrics_server.stop()
+    parent.control_server.stop()
+    # events still in flight must not respawn anything
+    for connection in [parent.wifi_connection, parent.ethernet_connection]:
+      if connection != None:
+        connection.exiting = True
+
+    await self.terminate()
+
+    # the children are gone, so this only releases fds and handles
+    parent.output_reader.stop()
+    if parent.wifi_connection != None:
+      parent.wifi_connection.cleanup()
+    if parent.ethernet_connection != None:
+      parent.ethernet_connection.cleanup()
+    parent.connection_history.stop()
+
+    steps = [self.step('saving connection history', parent.connection_history.close),
+             self.bring_down(parent.wifi_dev)]
+    # dhcpcd ran with --persistent, the next run adopts the wired link as is;
+    # the WiFi association went away with wpa_supplicant
+    if not FAST_START:
+      steps.append(self.bring_down(parent.eth_dev))
+    await asyncio.gather(*steps)
+    await self.join()
+    self.reactor.shutdown_executor()
+
+    self.shutdown_seconds = time.monotonic() - start
+    print('shutdown took %.3f seconds' % (self.shutdown_seconds))
+    self.reactor.stop()
@@ -0,0 +1,99 @@
+import threading
+import subprocess
+import socket
+import re
+
+from constants import *
+import rtnetlink
+
+class IpCommandBackend:
+  name = 'ip'
+
+  def list_links(self):
+    cmd = '%s -o link list' % (IP)
+    output = subprocess.check_output(cmd, shell=True).decode('utf-8')
+    devs = []
+    for line in output.split('\n'):
+      m = re.match(r'\d+:\s(.+?)(@\S+)?: <', line)
+      if m == None:
+        continue
+      devs.append(m.group(1))
+    return devs
+
+  def list_addrs(self, dev):
+    cmd = '%s -o addr show dev %s' % (IP, dev)
+    output = subprocess.check_output(cmd, shell=True).decode('utf-8')
+    return re.findall(r'inet6? (\S+)', output)
+
+  def set_link_up(self, dev):
+    subprocess.check_call('%s link set %s up' % (IP, dev), shell=True)
+
+  def set_link_down(self, dev):
+    subprocess.check_call('%s link set %s down' % (IP, dev), shell=True)
+
+  def flush_addrs(self, dev):
+    subprocess.check_call('%s addr flush %s' % (IP, dev), shell=True)
+
+  def set_default_route_metric(self, dev, gateway, old_metric, new_metric):
+    # the metric is part of the route's key, so it is re-added
+    subprocess.check_call('%s route add default via %s dev %s metric %d' % (IP, gateway, dev, new_metric), shell=True)
+    subprocess.check_call('%s route del default via %s dev %s metric %d' % (IP, gateway, dev, old_metric), shell=True)
+
+class NetlinkBackend:
+  name = 'netlink'
+
+  def __init__(self):
+    self.nl = rtnetlink.RtNetlink()
+    # both connection threads flush addresses, requests must not interleave
+    self.lock = threading.Lock()
+
+  def list_links(self):
+    with self.lock:
+      links = self.nl.get_links()
+    return [name for index, name, flags in links]
+
+  def list_addrs(self, dev):
+    index = socket.if_nametoindex(dev)
+    with self.lock:
+      addrs = self.nl.get_addrs(index)
+    result = []
+    for payload in addrs:
+      index, family, address, prefixlen = rtnetlink.parse_addr(payload)
+      result.append('%s/%d' % (address, prefixlen))
+    return result
+
+  def set_link_up(self, dev):
+    index = socket.if_nametoindex(dev)
+    with self.lock:
+      self.nl.set_link_flags(index, rtnetlink.IFF_UP, rtnetlink.IFF_UP)
+
+  def set_link_down(self, dev):
+    index = socket.if_nametoindex(dev)
+    with self.lock:
+      self.nl.set_link_flags(index, 0, rtnetlink.IFF_UP)
+
+  def flush_addrs(self, dev):
+    index = socket.if_nametoindex(dev)
+    with self.lock:
+      for payload in self.nl.get_addrs(index):
+        try:
+          self.nl.del_addr(payload)
+        except OSError:
+          # deleting a primary address also removes its secondaries
+          pass
+
+  def set_default_route_metric(self, dev, gateway, old_metric, new_metric):
+    # the metric is part of the route's key, so it is re-added
+    index = socket.if_nametoindex(dev)
+    with self.lock:
+      self.nl.add_default_route(index, gateway, new_metric)
+      self.nl.del_default_route(index, gateway, old_metric)
+
+def make_link_backend():
+  if LINK_BACKEND == 'ip':
+    return IpCommandBackend()
+  try:
+    return NetlinkBackend()
+  except OSError as e:
+    print('netlink unavailable (%s), falling back to %s' % (e, IP))
+    return IpCommandBackend()
@@ -0,0 +1,135 @@
+import asyncio
+import bisect
+import time
+import os
+
+from constants import *
+
+BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+
+HELP = {
+  'interkonnect_scan_seconds' : 'Duration of iw scans.',
+  'interkonnect_supplicant_spawn_seconds' : 'Time to spawn or configure wpa_supplicant.',
+  'interkonnect_association_seconds' : 'Connect decision to CTRL-EVENT-CONNECTED.',
+  'interkonnect_dhcp_seconds' : 'Association or carrier up to DHCP acknowledged.',
+  'interkonnect_route_seconds' : 'DHCP acknowledged to route added.',
+  'interkonnect_time_to_connectivity_seconds' : 'Connect decision or carrier up to route added.',
+  'interkonnect_failover_seconds' : 'Ethernet carrier loss to WiFi holding a route.',
+  'interkonnect_timer_wakeups_total' : 'Event loop wakeups caused by timers.',
+  'interkonnect_startup_seconds' : 'Time from start to both connections running.',
+}
+
+class Histogram:
+  __slots__ = ('counts', 'sum', 'count')
+
+  def __init__(self):
+    self.counts = [0] * (len(BUCKETS) + 1)
+    self.sum = 0.0
+    self.count = 0
+
+  def observe(self, value):
+    self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+    self.sum += value
+    self.count += 1
+
+class Metrics:
+  def __init__(self):
+    # name -> {dev -> Histogram}
+    self.histograms = {}
+    # name -> (type, callable returning the current value)
+    self.samples = {}
+
+  def sample(self, name, metric_type, fn):
+    self.samples[name] = (metric_type, fn)
+
+  def observe(self, name, dev, value):
+    per_dev = self.histograms.setdefault(name, {})
+    histogram = per_dev.get(dev)
+    if histogram == None:
+      histogram = Histogram()
+      per_dev[dev] = histogram
+    histogram.observe(value)
+
+  def render(self):
+    # Prometheus text exposition format
+    lines = []
+    for name in sorted(self.histograms.keys()):
+      if name in HELP:
+        lines.append('# HELP %s %s' % (name, HELP[name]))
+      lines.append('# TYPE %s histogram' % (name))
+      for dev, histogram in sorted(self.histograms[name].items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS, histogram.counts):
+          cumulative += count
+          lines.append('%s_bucket{dev="%s",le="%g"} %d' % (name, dev, bound, cumulative))
+        lines.append('%s_bucket{dev="%s",le="+Inf"} %d' % (name, dev, histogram.count))
+        lines.append('%s_sum{dev="%s"} %f' % (name, dev, histogram.sum))
+        lines.append('%s_count{dev="%s"} %d' % (name, dev, histogram.count))
+    for name in sorted(self.samples.keys()):
+      metric_type, fn = self.samples[name]
+      if name in HELP:
+        lines.append('# HELP %s %s' % (name, HELP[name]))
+      lines.append('# TYPE %s %s' % (name, metric_type))
+      lines.append('%s %s' % (name, fn()))
+    return '\n'.join(lines) + '\n'
+
+class Timeline:
+  # monotonic timestamps of the phases of one connection attempt
+  def __init__(self, metrics, dev):
+    self.metrics = metrics
+    self.dev = dev
+    self.marks = {}
+
+  def reset(self):
+    self.marks.clear()
+
+  def mark(self, phase):
+    now = time.monotonic()
+    self.marks[phase] = now
+    return now
+
+  def get(self, phase):
+    return self.marks.get(phase)
+
+  def observe(self, name, start_phase, end_phase):
+    start = self.marks.get(start_phase)
+    end = self.marks.get(end_phase)
+    if start == None or end == None:
+      return None
+    self.metrics.observe(name, self.dev, end - start)
+    return end - start
+
+class MetricsServer:
+  def __init__(self, metrics, path=METRICS_SOCKET):
+    self.metrics = metrics
+    self.path = path
+    self.server = None
+
+  async def start(self):
+    try:
+      os.makedirs(os.path.dirname(self.path), mode=0o755, exist_ok=True)
+      if os.path.exists(self.path):
+        os.remove(self.path)
+      self.server = await asyncio.start_unix_server(self.on_client, self.path)
+      os.chmod(self.path, 0o660)
+    except OSError as e:
+      print('failed to start metrics server on %s: %s' % (self.path, e))
+
+  async def on_client(self, reader, writer):
+    # every connection gets one scrape, e.g. `socat - UNIX:<path>`
+    try:
+      writer.write(bytes(self.metrics.render(), 'utf-8'))
+      await writer.drain()
+    except ConnectionError:
+      pass
+    finally:
+      writer.close()
+
+  def stop(self):
+    if self.server != None:
+      self.server.close()
+      self.server = None
+    try:
+      os.remove(self.path)
+    except OSError:
+      pass
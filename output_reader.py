@@ -0,0 +1,73 @@
+import os
+
+from events import *
+
+class Watch:
+  def __init__(self, child, event_queue, event_class, datagram=False):
+    self.child = child
+    self.event_queue = event_queue
+    self.event_class = event_class
+    self.datagram = datagram
+    self.prev_data = ''
+    self.active = True
+
+class OutputReader:
+  def __init__(self, reactor):
+    self.reactor = reactor
+    self.watches = {}
+
+  def add_watch(self, fd, watch):
+    self.watches[watch.child] = (fd, watch)
+    self.reactor.add_reader(fd, self.read, fd, watch)
+
+  def register(self, child, event_queue, event_class):
+    self.add_watch(child.child_fd, Watch(child, event_queue, event_class))
+
+  def register_socket(self, sock, event_queue, event_class):
+    # every datagram is delivered as one event
+    self.add_watch(sock.fileno(), Watch(sock, event_queue, event_class, True))
+
+  def unregister(self, child):
+    # must be called before the child's fd is closed, output that was read
+    # but not dispatched yet is dropped as well
+    entry = self.watches.get(child)
+    if entry != None:
+      entry[1].event_queue.discard(child)
+    self.remove(child)
+
+  def remove(self, child):
+    entry = self.watches.pop(child, None)
+    if entry == None:
+      return
+    fd, watch = entry
+    watch.active = False
+    self.reactor.remove_reader(fd)
+
+  def stop(self):
+    for child in list(self.watches.keys()):
+      self.remove(child)
+
+  def read(self, fd, watch):
+    if not watch.active:
+      return
+    try:
+      data = os.read(fd, 9001)
+    except OSError:
+      data = b''
+    if watch.datagram and len(data) > 0:
+      watch.event_queue.put(watch.event_class(data.decode('utf-8', errors='replace'), watch.child))
+      return
+
+    if len(data) == 0:
+      # EOF, the child has exited or closed its terminal
+      self.remove(watch.child)
+      if len(watch.prev_data) > 0:
+        watch.event_queue.put(watch.event_class(watch.prev_data.strip(), watch.child))
+        watch.prev_data = ''
+      return
+
+    data = watch.prev_data + data.decode('utf-8', errors='replace')
+    tokens = data.split('\n')
+    watch.prev_data = tokens.pop()
+    for token in tokens:
+      watch.event_queue.put(watch.event_class(token.strip(), watch.child))
@@ -0,0 +1,222 @@
+import collections
+import asyncio
+import socket
+import struct
+import time
+import os
+
+from constants import *
+from events import *
+
+SO_BINDTODEVICE = getattr(socket, 'SO_BINDTODEVICE', 25)
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+# query for the root NS records, any resolver answers it from cache
+DNS_QUERY = struct.pack('!HHHHHH', 0x494b, 0x0100, 1, 0, 0, 0) + b'\x00' + struct.pack('!HH', 2, 1)
+
+def bind_to_device(sock, dev):
+  sock.setsockopt(socket.SOL_SOCKET, SO_BINDTODEVICE, dev.encode('utf-8'))
+
+def checksum(data):
+  if len(data) % 2 == 1:
+    data += b'\x00'
+  total = sum(struct.unpack('!%dH' % (len(data) // 2), data))
+  total = (total >> 16) + (total & 0xffff)
+  total += total >> 16
+  return ~total & 0xffff
+
+def icmp_socket():
+  # raw sockets need root, datagram ICMP sockets need ping_group_range
+  try:
+    return socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP), True
+  except PermissionError:
+    return socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP), False
+
+async def icmp_probe(dev, address, seq):
+  loop = asyncio.get_running_loop()
+  sock, raw = icmp_socket()
+  try:
+    bind_to_device(sock, dev)
+    sock.setblocking(False)
+    ident = os.getpid() & 0xffff
+    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    payload = b'interkonnect'
+    packet = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, checksum(header + payload), ident, seq) + payload
+    await loop.sock_sendto(sock, packet, (address, 0))
+    while True:
+      data, peer = await loop.sock_recvfrom(sock, 1024)
+      if raw:
+        # raw sockets see the IP header and every ICMP packet on the host
+        data = data[(data[0] & 0x0f) * 4:]
+      if len(data) < 8 or peer[0] != address:
+        continue
+      icmp_type, code, _, reply_ident, reply_seq = struct.unpack('!BBHHH', data[:8])
+      # datagram sockets rewrite the identifier
+      if icmp_type == ICMP_ECHO_REPLY and reply_seq == seq and (reply_ident == ident or not raw):
+        return
+  finally:
+    sock.close()
+
+async def tcp_probe(dev, address, port, seq):
+  loop = asyncio.get_running_loop()
+  sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  try:
+    bind_to_device(sock, dev)
+    sock.setblocking(False)
+    try:
+      await loop.sock_connect(sock, (address, port))
+    except ConnectionRefusedError:
+      # a reset made the round trip as well
+      pass
+  finally:
+    sock.close()
+
+async def udp_probe(dev, address, port, seq):
+  loop = asyncio.get_running_loop()
+  sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  try:
+    bind_to_device(sock, dev)
+    sock.setblocking(False)
+    await loop.sock_sendto(sock, DNS_QUERY, (address, port))
+    while True:
+      data, peer = await loop.sock_recvfrom(sock, 4096)
+      if peer[0] == address and data[:2] == DNS_QUERY[:2]:
+        return
+  finally:
+    sock.close()
+
+class ProbeStats:
+  __slots__ = ('results',)
+
+  def __init__(self):
+    # round trip times of the last PROBE_WINDOW probes, None for a loss
+    self.results = collections.deque(maxlen=PROBE_WINDOW)
+
+  def record(self, rtt):
+    self.results.append(rtt)
+
+  def loss(self):
+    if len(self.results) == 0:
+      return None
+    lost = sum(1 for rtt in self.results if rtt == None)
+    return lost / len(self.results)
+
+  def rtt(self):
+    rtts = [rtt for rtt in self.results if rtt != None]
+    if len(rtts) == 0:
+      return None
+    return sum(rtts) / len(rtts)
+
+  def healthy(self):
+    # True, False or None while there are too few samples to tell
+    loss = self.loss()
+    if loss == None:
+      return None
+    if loss < PROBE_MAX_LOSS:
+      return True
+    if len(self.results) < PROBE_MIN_SAMPLES:
+      return None
+    return False
+
+class ProbeTarget:
+  __slots__ = ('name', 'kind', 'address', 'port', 'stats')
+
+  def __init__(self, name, kind, address, port):
+    self.name = name
+    self.kind = kind
+    self.address = address
+    self.port = port
+    self.stats = ProbeStats()
+
+def parse_target(spec):
+  # "tcp:1.1.1.1:443" or "udp:9.9.9.9:53", literal addresses only so probing
+  # never depends on name resolution over the link being probed
+  kind, address, port = spec.split(':')
+  return ProbeTarget(spec, kind, address, int(port))
+
+class ProbeEngine:
+  # probes the gateway and PROBE_TARGETS through one interface while it is
+  # connected and posts ProbeHealth(healthy) whenever the verdict changes
+  def __init__(self, parent):
+    self.parent = parent
+    self.dev = parent.dev
+    self.reactor = parent.parent.reactor
+    self.event_queue = parent.event_queue
+
+    self.task = None
+    self.gateway = None
+    self.targets = []
+    self.healthy = None
+    self.seq = 0
+
+  def start(self, gateway):
+    # "adding route to" comes before the default route, probing waits for
+    # the gateway so an empty target list is never taken as healthy
+    if self.task != None or gateway == None:
+      return
+    self.gateway = ProbeTarget('gateway', 'icmp', gateway, 0)
+    self.targets = [parse_target(spec) for spec in PROBE_TARGETS]
+    self.healthy = None
+    self.task = self.reactor.spawn(self.run())
+
+  def stop(self):
+    if self.task != None:
+      self.task.cancel()
+      self.task = None
+    self.healthy = None
+
+  def all_targets(self):
+    if self.gateway == None:
+      return self.targets
+    return [self.gateway] + self.targets
+
+  async def probe(self, target):
+    self.seq = (self.seq + 1) & 0xffff
+    start = time.monotonic()
+    try:
+      if target.kind == 'icmp':
+        coro = icmp_probe(self.dev, target.address, self.seq)
+      elif target.kind == 'tcp':
+        coro = tcp_probe(self.dev, target.address, target.port, self.seq)
+      else:
+        coro = udp_probe(self.dev, target.address, target.port, self.seq)
+      await asyncio.wait_for(coro, PROBE_TIMEOUT)
+      target.stats.record(time.monotonic() - start)
+    except asyncio.CancelledError:
+      raise
+    except (OSError, asyncio.TimeoutError):
+      target.stats.record(None)
+
+  def evaluate(self):
+    # at least one of the targets has to answer; the gateway only decides
+    # when there are none, many routers drop pings addressed to themselves
+    if len(self.targets) == 0:
+      if self.gateway == None:
+        return None
+      return self.gateway.stats.healthy()
+    beyond = [target.stats.healthy() for target in self.targets]
+    if True in beyond:
+      return True
+    if None in beyond:
+      return None
+    return False
+
+  def summary(self):
+    result = {}
+    for target in self.all_targets():
+      rtt = target.stats.rtt()
+      if rtt != None:
+        rtt = round(rtt * 1000, 1)
+      result[target.name] = {'rtt_ms' : rtt, 'loss' : target.stats.loss()}
+    return result
+
+  async def run(self):
+    while True:
+      await asyncio.gather(*[self.probe(target) for target in self.all_targets()])
+      healthy = self.evaluate()
+      if healthy != None and healthy != self.healthy:
+        self.healthy = healthy
+        self.event_queue.put(ProbeHealth(healthy))
+      await self.reactor.sleep(PROBE_INTERVAL)
@@ -0,0 +1,134 @@
+import asyncio
+import concurrent.futures
+import threading
+import collections
+import traceback
+import sys
+
+from constants import *
+from timers import *
+from events import *
+
+class Reactor:
+  def __init__(self):
+    self.loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(self.loop)
+    # the default child watcher starts a thread per subprocess, a pidfd
+    # watcher waits for exits on the loop itself
+    if sys.version_info < (3, 12) and hasattr(asyncio, 'PidfdChildWatcher'):
+      try:
+        watcher = asyncio.PidfdChildWatcher()
+        watcher.attach_loop(self.loop)
+        asyncio.set_child_watcher(watcher)
+      except OSError:
+        pass
+    self.thread_id = threading.get_ident()
+    self.timers = TimerWheel(self.loop)
+    # blocking work (link changes, sqlite) runs here instead of on the loop
+    self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS)
+
+  def in_loop_thread(self):
+    return threading.get_ident() == self.thread_id
+
+  def call_soon(self, callback, *args):
+    if self.in_loop_thread():
+      return self.loop.call_soon(callback, *args)
+    return self.loop.call_soon_threadsafe(callback, *args)
+
+  def call_later(self, delay, callback, *args):
+    return self.timers.call_later(delay, callback, *args)
+
+  def call_every(self, interval, callback, *args):
+    return self.timers.call_every(interval, callback, *args)
+
+  async def sleep(self, delay):
+    await self.timers.sleep(delay)
+
+  def add_reader(self, fd, callback, *args):
+    self.loop.add_reader(fd, callback, *args)
+
+  def remove_reader(self, fd):
+    self.loop.remove_reader(fd)
+
+  def add_signal_handler(self, signum, callback, *args):
+    self.loop.add_signal_handler(signum, callback, *args)
+
+  def spawn(self, coro):
+    return self.loop.create_task(coro)
+
+  def run_in_executor(self, fn, *args):
+    return self.loop.run_in_executor(self.executor, fn, *args)
+
+  def shutdown_executor(self):
+    # never waits, a call that is stuck past its deadline stays abandoned
+    self.executor.shutdown(wait=False, cancel_futures=True)
+
+  def run(self):
+    self.thread_id = threading.get_ident()
+    self.loop.run_forever()
+
+  def stop(self):
+    self.call_soon(self.loop.stop)
+
+class EventQueue:
+  # one FIFO per priority, the highest priority non-empty FIFO is drained
+  # first and at most EVENT_BATCH events are dispatched per loop iteration,
+  # so a control event never waits behind a burst of log lines
+  def __init__(self, reactor, dispatch):
+    self.reactor = reactor
+    self.dispatch = dispatch
+    self.queues = [collections.deque() for priority in range(LOG + 1)]
+    # event class -> queued coalescing event
+    self.pending = {}
+    self.scheduled = False
+
+  def put(self, event):
+    if not self.reactor.in_loop_thread():
+      self.reactor.call_soon(self.put, event)
+      return
+
+    cls = type(event)
+    if cls.coalesce:
+      queued = self.pending.get(cls)
+      if queued != None:
+        queued.args = event.args
+        queued.source = event.source
+        return
+      self.pending[cls] = event
+
+    self.queues[cls.priority].append(event)
+    if not self.scheduled:
+      self.scheduled = True
+      self.reactor.call_soon(self.drain)
+
+  def discard(self, source):
+    # drop queued output of a child that has been killed
+    for queue in self.queues:
+      stale = [event for event in queue if event.source is source]
+      for event in stale:
+        queue.remove(event)
+        if self.pending.get(type(event)) is event:
+          del self.pending[type(event)]
+
+  def drain(self):
+    self.scheduled = False
+    for i in range(EVENT_BATCH):
+      event = self.pop()
+      if event == None:
+        return
+      try:
+        self.dispatch(event)
+      except Exception:
+        traceback.print_exc()
+    if not self.scheduled:
+      self.scheduled = True
+      self.reactor.call_soon(self.drain)
+
+  def pop(self):
+    for queue in self.queues:
+      if len(queue) > 0:
+        event = queue.popleft()
+        if type(event).coalesce:
+          del self.pending[type(event)]
+        return event
+    return None
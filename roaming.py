@@ -0,0 +1,112 @@
+import asyncio
+import subprocess
+import time
+import re
+
+from constants import *
+from events import *
+
+class RoamingEngine:
+  def __init__(self, parent):
+    self.parent = parent
+    self.dev = parent.dev
+    self.reactor = parent.parent.reactor
+    self.event_queue = parent.event_queue
+    self.scanner = parent.scanner
+
+    self.task = None
+    self.signal = None
+    self.last_roam_time = None
+    self.last_scan_time = None
+
+  def start(self):
+    if self.task != None:
+      return
+    self.signal = None
+    # dwell on the BSS we just connected to, not since the daemon started
+    self.last_roam_time = time.monotonic()
+    self.task = self.reactor.spawn(self.run())
+
+  def stop(self):
+    if self.task != None:
+      self.task.cancel()
+      self.task = None
+
+  async def sample_link(self):
+    cmd = [IW, 'dev', self.dev, 'link']
+    proc = await asyncio.create_subprocess_exec(*cmd, stdout=subprocess.PIPE,
+                                                stderr=subprocess.DEVNULL)
+    output, _ = await proc.communicate()
+    output = output.decode('utf-8', errors='replace')
+
+    m = re.match(r'Connected to ([0-9a-fA-F:]{17})', output)
+    if m == None:
+      return None, None
+    bssid = m.group(1)
+    m = re.search(r'signal: (-?\d+)', output)
+    if m == None:
+      return bssid, None
+    return bssid, float(m.group(1))
+
+  async def find_better_bss(self, ssid, bssid, signal):
+    freqs = self.scanner.planner.likely_freqs([ssid])
+    args = []
+    if len(freqs) > 0:
+      args += ['freq'] + [str(freq) for freq in freqs]
+    args += ['ssid', ssid]
+    stations = await self.scanner.iw_scan(args)
+
+    # stations are sorted by signal, the first other BSS of our SSID is the
+    # best roaming candidate
+    for station in stations:
+      if station.ssid != ssid or station.bssid.lower() == bssid.lower():
+        continue
+      if station.signal >= signal + ROAM_HYSTERESIS:
+        return station
+      break
+    return None
+
+  async def check(self):
+    station = self.parent.station
+    if station == None:
+      return
+
+    bssid, signal = await self.sample_link()
+    if bssid == None or signal == None:
+      return
+
+    # smooth the samples so a single dip does not trigger a roam
+    if self.signal == None:
+      self.signal = signal
+    else:
+      self.signal += ROAM_SIGNAL_ALPHA * (signal - self.signal)
+
+    if self.signal >= ROAM_SIGNAL_THRESHOLD:
+      return
+
+    now = time.monotonic()
+    if now - self.last_roam_time < ROAM_DWELL_TIME:
+      return
+    if self.last_scan_time != None and now - self.last_scan_time < ROAM_SCAN_INTERVAL:
+      return
+    self.last_scan_time = now
+
+    candidate = await self.find_better_bss(station.ssid, bssid, self.signal)
+    if candidate == None:
+      return
+
+    self.parent.print('roaming candidate %s at %.0f dBm, current %s at %.0f dBm' %
+                      (candidate.bssid, candidate.signal, bssid, self.signal))
+    self.last_roam_time = now
+    self.signal = None
+    self.event_queue.put(Roam(candidate))
+
+  async def run(self):
+    while True:
+      await self.reactor.sleep(ROAM_SAMPLE_INTERVAL)
+      try:
+        await self.check()
+      except asyncio.CancelledError:
+        raise
+      except Exception as e:
+        self.parent.print('roaming check failed: %s' % (e))
@@ -0,0 +1,172 @@
+import os
+import socket
+import struct
+
+NETLINK_ROUTE = 0
+RTMGRP_LINK = 0x1
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+RTM_NEWROUTE = 24
+RTM_DELROUTE = 25
+
+NLM_F_REQUEST = 0x1
+NLM_F_ACK = 0x4
+NLM_F_DUMP = 0x300
+NLM_F_CREATE = 0x400
+
+IFLA_IFNAME = 3
+
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_PRIORITY = 6
+
+RT_TABLE_MAIN = 254
+RTPROT_BOOT = 3
+RT_SCOPE_UNIVERSE = 0
+RT_SCOPE_NOWHERE = 255
+RTN_UNICAST = 1
+
+IFF_UP = 0x1
+IFF_LOWER_UP = 0x10000
+
+NLMSGHDR = struct.Struct('=IHHII')
+IFINFOMSG = struct.Struct('=BxHiII')
+IFADDRMSG = struct.Struct('=BBBBI')
+RTMSG = struct.Struct('=BBBBBBBBI')
+RTATTR = struct.Struct('=HH')
+NLMSGERR = struct.Struct('=i')
+
+def align(length):
+  return (length + 3) & ~3
+
+def pack_attr(attr_type, data):
+  attr = RTATTR.pack(RTATTR.size + len(data), attr_type) + data
+  return attr + b'\0' * (align(len(attr)) - len(attr))
+
+def open_socket(groups=0):
+  sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+  sock.bind((0, groups))
+  return sock
+
+def parse_messages(data):
+  offset = 0
+  while offset + NLMSGHDR.size <= len(data):
+    length, msg_type, flags, seq, pid = NLMSGHDR.unpack_from(data, offset)
+    if length < NLMSGHDR.size:
+      break
+    yield msg_type, flags, seq, data[offset + NLMSGHDR.size : offset + length]
+    offset += align(length)
+
+def parse_attrs(data, offset=0):
+  attrs = {}
+  while offset + RTATTR.size <= len(data):
+    length, attr_type = RTATTR.unpack_from(data, offset)
+    if length < RTATTR.size:
+      break
+    attrs[attr_type] = data[offset + RTATTR.size : offset + length]
+    offset += align(length)
+  return attrs
+
+def parse_link(payload):
+  family, dev_type, index, flags, change = IFINFOMSG.unpack_from(payload)
+  attrs = parse_attrs(payload, IFINFOMSG.size)
+  name = None
+  if IFLA_IFNAME in attrs:
+    name = attrs[IFLA_IFNAME].rstrip(b'\0').decode('utf-8')
+  return index, name, flags
+
+def parse_addr(payload):
+  family, prefixlen, flags, scope, index = IFADDRMSG.unpack_from(payload)
+  attrs = parse_attrs(payload, IFADDRMSG.size)
+  raw = attrs.get(IFA_LOCAL, attrs.get(IFA_ADDRESS))
+  address = None
+  if raw != None:
+    address = socket.inet_ntop(family, raw)
+  return index, family, address, prefixlen
+
+class RtNetlink:
+  def __init__(self):
+    self.sock = open_socket()
+    self.seq = 0
+
+  def close(self):
+    self.sock.close()
+
+  def request(self, msg_type, flags, payload):
+    self.seq += 1
+    seq = self.seq
+    header = NLMSGHDR.pack(NLMSGHDR.size + len(payload), msg_type,
+                           NLM_F_REQUEST | flags, seq, 0)
+    self.sock.send(header + payload)
+
+    replies = []
+    while True:
+      data = self.sock.recv(65536)
+      for reply_type, reply_flags, reply_seq, reply in parse_messages(data):
+        if reply_seq != seq:
+          continue
+        if reply_type == NLMSG_DONE:
+          return replies
+        if reply_type == NLMSG_ERROR:
+          error = NLMSGERR.unpack_from(reply)[0]
+          if error != 0:
+            raise OSError(-error, os.strerror(-error))
+          return replies
+        replies.append((reply_type, reply))
+
+  def get_links(self):
+    payload = IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0)
+    links = []
+    for msg_type, reply in self.request(RTM_GETLINK, NLM_F_DUMP, payload):
+      if msg_type == RTM_NEWLINK:
+        links.append(parse_link(reply))
+    return links
+
+  def set_link_flags(self, index, flags, change):
+    payload = IFINFOMSG.pack(socket.AF_UNSPEC, 0, index, flags, change)
+    self.request(RTM_NEWLINK, NLM_F_ACK, payload)
+
+  def get_addrs(self, index=None):
+    payload = IFADDRMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0)
+    addrs = []
+    for msg_type, reply in self.request(RTM_GETADDR, NLM_F_DUMP, payload):
+      if msg_type != RTM_NEWADDR:
+        continue
+      if index != None and IFADDRMSG.unpack_from(reply)[4] != index:
+        continue
+      addrs.append(reply)
+    return addrs
+
+  def del_addr(self, addr_payload):
+    # the kernel identifies the address to delete by the same ifaddrmsg and
+    # attributes it reported in the dump, just like `ip addr flush` does
+    self.request(RTM_DELADDR, NLM_F_ACK, addr_payload)
+
+  def default_route(self, index, gateway, metric, add):
+    # the same message `ip route add|del default via <gateway> dev <dev>
+    # metric <metric>` sends
+    if add:
+      header = RTMSG.pack(socket.AF_INET, 0, 0, 0, RT_TABLE_MAIN, RTPROT_BOOT, RT_SCOPE_UNIVERSE, RTN_UNICAST, 0)
+    else:
+      header = RTMSG.pack(socket.AF_INET, 0, 0, 0, RT_TABLE_MAIN, 0, RT_SCOPE_NOWHERE, 0, 0)
+    return (header +
+            pack_attr(RTA_GATEWAY, socket.inet_aton(gateway)) +
+            pack_attr(RTA_OIF, struct.pack('=i', index)) +
+            pack_attr(RTA_PRIORITY, struct.pack('=I', metric)))
+
+  def add_default_route(self, index, gateway, metric):
+    self.request(RTM_NEWROUTE, NLM_F_ACK | NLM_F_CREATE, self.default_route(index, gateway, metric, True))
+
+  def del_default_route(self, index, gateway, metric):
+    self.request(RTM_DELROUTE, NLM_F_ACK, self.default_route(index, gateway, metric, False))
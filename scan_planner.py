@@ -0,0 +1,98 @@
+import time
+
+from constants import *
+
+class ScanPlanner:
+  def __init__(self):
+    # ssid -> {freq -> last time it was seen there}
+    self.sightings = {}
+    self.last_full_scan_time = None
+    self.force_full_scan = True
+    # cfg80211 rejects scans with more SSIDs than the driver takes
+    self.max_ssids = SCAN_MAX_SSIDS
+    # hidden networks beyond max_ssids take turns in full sweeps
+    self.hidden_offset = 0
+
+  def record(self, stations, recognized, full):
+    now = time.monotonic()
+    if full:
+      self.last_full_scan_time = now
+
+    found = False
+    for station in stations:
+      if station.ssid not in recognized or station.freq == 0:
+        continue
+      found = True
+      self.sightings.setdefault(station.ssid, {})[station.freq] = now
+
+    # a targeted scan that misses every known network means they have moved
+    # channel or we have moved, so sweep everything next time
+    self.force_full_scan = not found and not full
+    return found
+
+  def likely_freqs(self, ssids):
+    cutoff = time.monotonic() - SCAN_SIGHTING_TTL
+    freqs = set()
+    for ssid in ssids:
+      for freq, last_seen in self.sightings.get(ssid, {}).items():
+        if last_seen >= cutoff:
+          freqs.add(freq)
+    return sorted(freqs)
+
+  def named_slots(self):
+    # the wildcard probe takes one of the driver's SSIDs
+    return max(self.max_ssids - 1, 1)
+
+  def probes(self, ssids):
+    # naming any SSID makes iw drop its wildcard probe, so ask for it
+    # explicitly to keep hearing every other network on the channel
+    if self.max_ssids < 2:
+      return ['ssid'] + ssids[:1]
+    return ['ssid', ''] + ssids[:self.named_slots()]
+
+  def pick_ssids(self, ssids, freqs):
+    # SSIDs last seen on the channels being scanned go first, the most
+    # recently seen of them first
+    def last_seen(ssid):
+      sightings = self.sightings.get(ssid, {})
+      return max([sightings[freq] for freq in freqs if freq in sightings] + [0])
+    ranked = sorted(sorted(ssids), key=last_seen, reverse=True)
+    return ranked[:self.named_slots()]
+
+  def full_scan(self, hidden):
+    # hidden networks only answer probes that carry their SSID
+    if len(hidden) == 0:
+      return []
+    slots = self.named_slots()
+    if len(hidden) <= slots:
+      return self.probes(hidden)
+    start = self.hidden_offset % len(hidden)
+    self.hidden_offset = start + slots
+    return self.probes((hidden[start:] + hidden[:start])[:slots])
+
+  def plan(self, ssids, hidden=[]):
+    # returns the extra arguments for `iw dev <dev> scan`, without 'freq' it
+    # is a sweep on every channel
+    now = time.monotonic()
+    if self.force_full_scan or self.last_full_scan_time == None:
+      return self.full_scan(hidden)
+    if now - self.last_full_scan_time >= FULL_SCAN_INTERVAL:
+      return self.full_scan(hidden)
+
+    freqs = self.likely_freqs(ssids)
+    if len(freqs) == 0:
+      return self.full_scan(hidden)
+
+    args = ['freq'] + [str(freq) for freq in freqs]
+    args += self.probes(self.pick_ssids(ssids, freqs))
+    return args
+
+def covered_freqs(args):
+  # the channels where every BSS was asked to answer: None for all of them,
+  # none at all when only named SSIDs were probed
+  if 'ssid' in args and '' not in args[args.index('ssid') + 1:]:
+    return set()
+  if 'freq' not in args:
+    return None
+  end = args.index('ssid') if 'ssid' in args else len(args)
+  return set(int(freq) for freq in args[args.index('freq') + 1:end])
@@ -0,0 +1,55 @@
+import math
+
+from constants import *
+
+# rough 2 spatial stream PHY rates in Mbps by standard and channel width
+HT_RATES = {20 : 144, 40 : 300}
+VHT_RATES = {20 : 173, 40 : 400, 80 : 867, 160 : 1733}
+HE_RATES = {20 : 287, 40 : 574, 80 : 1201, 160 : 2402}
+LEGACY_RATE = 54
+
+class SignalScorer:
+  # the original heuristic, strongest signal wins, the weight is applied as
+  # a power ratio so 2.0 is worth 3 dB
+  def score(self, station, signal, weight):
+    return signal + 10.0 * math.log10(weight)
+
+class ThroughputScorer:
+  def phy_rate(self, station):
+    if station.he:
+      return HE_RATES.get(station.width, HE_RATES[20])
+    if station.vht:
+      return VHT_RATES.get(station.width, VHT_RATES[20])
+    if station.ht:
+      return HT_RATES.get(min(station.width, 40), HT_RATES[20])
+    return LEGACY_RATE
+
+  def signal_factor(self, signal):
+    # linear stand-in for the MCS the link can sustain, from nothing at
+    # SCORE_SIGNAL_FLOOR up to the full rate at SCORE_SIGNAL_CEILING
+    span = SCORE_SIGNAL_CEILING - SCORE_SIGNAL_FLOOR
+    factor = (signal - SCORE_SIGNAL_FLOOR) / span
+    return min(1.0, max(0.01, factor))
+
+  def load_factor(self, station):
+    factor = 1.0
+    if station.utilization != None:
+      factor *= max(0.1, 1.0 - station.utilization)
+    if station.station_count != None:
+      factor /= 1.0 + SCORE_STATION_PENALTY * station.station_count
+    return factor
+
+  def score(self, station, signal, weight):
+    # estimated achievable throughput in Mbps, scaled by user preference
+    throughput = self.phy_rate(station)
+    throughput *= self.signal_factor(signal)
+    throughput *= self.load_factor(station)
+    return throughput * weight
+
+SCORERS = {
+  'signal' : SignalScorer,
+  'throughput' : ThroughputScorer,
+}
+
+def make_scorer():
+  return SCORERS[STATION_SCORER]()
@@ -0,0 +1,192 @@
+import signal
+import time
+import os
+
+from constants import *
+from events import *
+
+class Supervised:
+  def __init__(self, pid, event_queue, name):
+    self.pid = pid
+    self.event_queue = event_queue
+    self.name = name
+    self.pidfd = None
+    # only set while the child is being terminated
+    self.child = None
+    self.kill_handle = None
+
+class PendingSpawn:
+  __slots__ = ('callback', 'args', 'cancelled')
+
+  def __init__(self, callback, args):
+    self.callback = callback
+    self.args = args
+    self.cancelled = False
+
+  def cancel(self):
+    self.cancelled = True
+
+class RestartBackoff:
+  def __init__(self):
+    self.delay = CHILD_RESTART_DELAY
+    self.start_time = None
+
+  def started(self):
+    self.start_time = time.monotonic()
+
+  def next_delay(self):
+    # a child that stayed up for a while gets a fresh budget
+    if self.start_time != None and time.monotonic() - self.start_time >= CHILD_STABLE_SECS:
+      self.delay = CHILD_RESTART_DELAY
+    delay = self.delay
+    self.delay = min(self.delay * 2, CHILD_RESTART_MAX_DELAY)
+    return delay
+
+def reap(child):
+  # the child is known to be gone, so skip pexpect's settle delay in close()
+  ptyproc = getattr(child, 'ptyproc', None)
+  if ptyproc != None:
+    ptyproc.delayafterclose = 0
+  child.close(force=True)
+
+def exited(pid):
+  try:
+    # WNOWAIT leaves the zombie for pexpect to reap
+    return os.waitid(os.P_PID, pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) != None
+  except ChildProcessError:
+    pass
+  # adopted daemons are not our children, only check they still exist;
+  # without pidfd their exit is noticed on the next SIGCHLD
+  try:
+    os.kill(pid, 0)
+  except ProcessLookupError:
+    return True
+  except PermissionError:
+    pass
+  return False
+
+class ChildSupervisor:
+  # posts ChildExit(name) to the owner's event queue the moment a watched
+  # child exits, and terminates children without ever waiting on the reactor
+  def __init__(self, reactor):
+    self.reactor = reactor
+    self.children = {}
+    # pid -> Supervised of children asked to exit that are not gone yet
+    self.dying = {}
+    # key -> [PendingSpawn], run once no child of that key is dying
+    self.pending = {}
+    self.use_pidfd = hasattr(os, 'pidfd_open')
+    self.sigchld_installed = False
+
+  def attach(self, supervised, callback):
+    if self.use_pidfd:
+      try:
+        supervised.pidfd = os.pidfd_open(supervised.pid)
+        self.reactor.add_reader(supervised.pidfd, callback, supervised.pid)
+        return
+      except ProcessLookupError:
+        # already gone and reaped
+        self.reactor.call_soon(callback, supervised.pid)
+        return
+      except OSError:
+        # kernel older than 5.3
+        self.use_pidfd = False
+
+    if not self.sigchld_installed:
+      self.reactor.add_signal_handler(signal.SIGCHLD, self.on_sigchld)
+      self.sigchld_installed = True
+    # it may already be gone before the handler was installed
+    self.on_sigchld()
+
+  def detach(self, supervised):
+    if supervised.pidfd != None:
+      self.reactor.remove_reader(supervised.pidfd)
+      os.close(supervised.pidfd)
+      supervised.pidfd = None
+
+  def watch(self, child, event_queue, name):
+    supervised = Supervised(child.pid, event_queue, name)
+    self.children[child.pid] = supervised
+    self.attach(supervised, self.on_exit)
+
+  def unwatch(self, child):
+    supervised = self.children.pop(child.pid, None)
+    if supervised != None:
+      self.detach(supervised)
+
+  def on_exit(self, pid):
+    supervised = self.children.pop(pid, None)
+    if supervised == None:
+      return
+    self.detach(supervised)
+    supervised.event_queue.put(ChildExit(supervised.name))
+
+  def terminate(self, child, key):
+    # SIGTERM now, SIGKILL after CHILD_KILL_TIMEOUT, reaped once its exit is
+    # seen; spawns queued with when_gone(key) run after that
+    self.unwatch(child)
+    try:
+      child.kill(signal.SIGTERM)
+    except OSError:
+      pass
+    supervised = Supervised(child.pid, None, key)
+    supervised.child = child
+    supervised.kill_handle = self.reactor.call_later(CHILD_KILL_TIMEOUT, self.force_kill, child.pid)
+    self.dying[child.pid] = supervised
+    self.attach(supervised, self.on_dead)
+
+  def force_kill(self, pid):
+    supervised = self.dying.get(pid)
+    if supervised == None:
+      return
+    supervised.kill_handle = None
+    print('%s ignored SIGTERM, killing it' % (supervised.name))
+    try:
+      supervised.child.kill(signal.SIGKILL)
+    except OSError:
+      pass
+
+  def on_dead(self, pid):
+    supervised = self.dying.pop(pid, None)
+    if supervised == None:
+      return
+    self.detach(supervised)
+    if supervised.kill_handle != None:
+      supervised.kill_handle.cancel()
+    try:
+      reap(supervised.child)
+    except Exception:
+      pass
+
+    if self.is_dying(supervised.name):
+      return
+    for spawn in self.pending.pop(supervised.name, []):
+      if not spawn.cancelled:
+        spawn.callback(*spawn.args)
+
+  def is_dying(self, key):
+    for supervised in self.dying.values():
+      if supervised.name == key:
+        return True
+    return False
+
+  def when_gone(self, key, callback, *args):
+    # a daemon refuses to start while its previous instance still holds its
+    # pidfile or control socket, so the replacement waits for that exit
+    if not self.is_dying(key):
+      callback(*args)
+      return None
+    spawn = PendingSpawn(callback, args)
+    self.pending.setdefault(key, []).append(spawn)
+    return spawn
+
+  def dying_children(self):
+    return [supervised.child for supervised in self.dying.values()]
+
+  def on_sigchld(self):
+    for pid in list(self.children.keys()):
+      if exited(pid):
+        self.on_exit(pid)
+    for pid in list(self.dying.keys()):
+      if exited(pid):
+        self.on_dead(pid)
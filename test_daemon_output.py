@@ -0,0 +1,81 @@
+import pytest
+
+from daemon_output import *
+
+# captured from `dhcpcd -d` and wpa_supplicant, one per message type
+
+DHCPCD_LINES = [
+  ('enp0s1: acknowledged 192.168.1.23 from 192.168.1.1',
+   LeaseAcquired, {'address': '192.168.1.23', 'server': '192.168.1.1'}),
+  ('enp0s1: NAK: address in use from 192.168.1.1',
+   LeaseRejected, {}),
+  ('enp0s1: DHCP lease expired',
+   LeaseExpired, {}),
+  ('enp0s1: lease expired',
+   LeaseExpired, {}),
+  ('enp0s1: adding IP address 192.168.1.23/24',
+   AddressAdded, {'address': '192.168.1.23', 'prefixlen': '24'}),
+  ('enp0s1: adding route to 192.168.1.0/24',
+   RouteAdded, {'network': '192.168.1.0', 'prefixlen': '24'}),
+  ('enp0s1: adding default route via 192.168.1.1',
+   DefaultRouteAdded, {'gateway': '192.168.1.1'}),
+  ('enp0s1: carrier lost',
+   CarrierLost, {}),
+]
+
+DHCPCD_IGNORED = [
+  'dhcpcd-9.4.1 starting',
+  'enp0s1: soliciting a DHCP lease',
+  'enp0s1: offered 192.168.1.23 from 192.168.1.1',
+  'enp0s1: leased 192.168.1.23 for 86400 seconds',
+  '',
+]
+
+WPA_LINES = [
+  ('CTRL-EVENT-CONNECTED - Connection to 00:11:22:aa:bb:cc completed [id=0 id_str=]',
+   Associated, {'bssid': '00:11:22:aa:bb:cc'}),
+  ('CTRL-EVENT-CONNECTED',
+   Associated, {'bssid': None}),
+  ('CTRL-EVENT-DISCONNECTED bssid=00:11:22:aa:bb:cc reason=3 locally_generated=1',
+   Disassociated, {'bssid': '00:11:22:aa:bb:cc'}),
+  ('CTRL-EVENT-DISCONNECTED',
+   Disassociated, {'bssid': None}),
+]
+
+WPA_IGNORED = [
+  'Successfully initialized wpa_supplicant',
+  'CTRL-EVENT-SCAN-RESULTS ',
+  'wlp3s0: Trying to associate with 00:11:22:aa:bb:cc (SSID=\'home\' freq=2412 MHz)',
+  'CTRL-EVENT-REGDOM-CHANGE init=CORE type=WORLD',
+]
+
+def check(message, cls, fields, dev):
+  assert type(message) == cls
+  assert message.dev == dev
+  for name, value in fields.items():
+    assert getattr(message, name) == value
+
+@pytest.mark.parametrize('line,cls,fields', DHCPCD_LINES)
+def test_parse_dhcpcd(line, cls, fields):
+  check(parse_dhcpcd(line), cls, fields, 'enp0s1')
+
+@pytest.mark.parametrize('line', DHCPCD_IGNORED)
+def test_parse_dhcpcd_ignored(line):
+  assert parse_dhcpcd(line) == None
+
+@pytest.mark.parametrize('line,cls,fields', WPA_LINES)
+def test_parse_wpa(line, cls, fields):
+  check(parse_wpa(line, 'wlp3s0'), cls, fields, 'wlp3s0')
+
+@pytest.mark.parametrize('line', WPA_IGNORED)
+def test_parse_wpa_ignored(line):
+  assert parse_wpa(line) == None
+
+def test_fields_follow_their_own_group():
+  # a later alternative's groups must not be shifted onto an earlier one's
+  # fields, every message type after the first checks the lastindex slicing
+  message = parse_dhcpcd('wlp3s0: adding route to 10.0.0.0/8')
+  assert (message.network, message.prefixlen) == ('10.0.0.0', '8')
+  message = parse_wpa('CTRL-EVENT-DISCONNECTED bssid=00:11:22:aa:bb:cc reason=3')
+  assert message.bssid == '00:11:22:aa:bb:cc'
+  assert message.dev == None
@@ -0,0 +1,105 @@
+import os
+
+from iw_scan import *
+from station_scoring import *
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'iw_scan.txt')
+
+def scan_fixture():
+  with open(FIXTURE, 'r') as f:
+    stations = parse_scan(f)
+  return dict((station.bssid, station) for station in stations)
+
+def test_parse_basic_fields():
+  stations = scan_fixture()
+  assert len(stations) == 6
+  home = stations['a0:63:91:2e:01:10']
+  assert home.ssid == 'home'
+  assert home.freq == 2437
+  assert home.signal == -48.0
+  assert home.security == 'RSN'
+  assert home.capability == 'ESS Privacy ShortSlotTime (0x0411)'
+  # newer iw prints the frequency with a fraction
+  assert stations['3c:37:86:5a:9b:c0'].freq == 5500
+  assert stations['00:1d:7e:41:22:33'].security == 'WPA'
+  assert stations['f4:f2:6d:10:20:30'].security == ''
+
+def test_parse_standards_and_width():
+  stations = scan_fixture()
+  crowded = stations['a0:63:91:2e:01:10']
+  assert (crowded.ht, crowded.vht, crowded.he, crowded.width) == (True, False, False, 20)
+  fast = stations['a0:63:91:2e:01:14']
+  assert (fast.ht, fast.vht, fast.he, fast.width) == (True, True, False, 80)
+  wide = stations['3c:37:86:5a:9b:c0']
+  assert (wide.ht, wide.vht, wide.he, wide.width) == (True, True, True, 160)
+  # an HT40 secondary below the primary still counts as 40 MHz
+  assert stations['c8:d7:19:00:aa:02'].width == 40
+  legacy = stations['00:1d:7e:41:22:33']
+  assert (legacy.ht, legacy.vht, legacy.he, legacy.width) == (False, False, False, 20)
+  # VHT width 0 defers to the HT operation element
+  assert stations['f4:f2:6d:10:20:30'].width == 20
+
+def test_parse_bss_load():
+  stations = scan_fixture()
+  crowded = stations['a0:63:91:2e:01:10']
+  assert crowded.station_count == 38
+  assert crowded.utilization == 204 / 255.0
+  fast = stations['a0:63:91:2e:01:14']
+  assert fast.station_count == 2
+  assert fast.utilization == 18 / 255.0
+  # no BSS Load element at all
+  wide = stations['3c:37:86:5a:9b:c0']
+  assert wide.station_count == None
+  assert wide.utilization == None
+
+def test_parse_streamed_lines():
+  # the scanner feeds lines as they arrive, with their newlines
+  with open(FIXTURE, 'r') as f:
+    data = f.read()
+  parser = ScanParser()
+  for line in data.splitlines(True):
+    parser.feed(line)
+  assert [station.bssid for station in parser.stations] == list(scan_fixture().keys())
+
+def rank(scorer, stations, weights={}):
+  def score(station):
+    return scorer.score(station, station.signal, weights.get(station.ssid, 1.0))
+  return [station.bssid for station in sorted(stations.values(), key=score, reverse=True)]
+
+def test_weaker_5ghz_beats_crowded_24ghz():
+  stations = scan_fixture()
+  crowded = stations['a0:63:91:2e:01:10']
+  fast = stations['a0:63:91:2e:01:14']
+  assert crowded.signal > fast.signal
+
+  scorer = ThroughputScorer()
+  assert scorer.score(fast, fast.signal, 1.0) > scorer.score(crowded, crowded.signal, 1.0)
+  # the raw signal sort makes the opposite choice
+  signal = SignalScorer()
+  assert signal.score(crowded, crowded.signal, 1.0) > signal.score(fast, fast.signal, 1.0)
+
+def test_throughput_ordering():
+  stations = scan_fixture()
+  assert rank(ThroughputScorer(), stations) == [
+    '3c:37:86:5a:9b:c0', # HE 160 MHz, weak but the widest channel
+    'a0:63:91:2e:01:14', # VHT 80 MHz, nearly idle
+    'f4:f2:6d:10:20:30', # VHT at 20 MHz
+    'c8:d7:19:00:aa:02', # HT40 on a busy 2.4 GHz channel
+    'a0:63:91:2e:01:10', # HT20, strongest but saturated
+    '00:1d:7e:41:22:33', # legacy and far away
+  ]
+  assert rank(SignalScorer(), stations)[0] == 'a0:63:91:2e:01:10'
+
+def test_throughput_preference_weight():
+  stations = scan_fixture()
+  scorer = ThroughputScorer()
+  cafe = stations['c8:d7:19:00:aa:02']
+  fast = stations['a0:63:91:2e:01:14']
+  assert scorer.score(fast, fast.signal, 1.0) > scorer.score(cafe, cafe.signal, 1.0)
+  # a large enough per-SSID preference overrides the estimate
+  assert rank(scorer, stations, {'cafe' : 100.0})[0] == 'c8:d7:19:00:aa:02'
+
+def test_signal_factor_is_clamped():
+  scorer = ThroughputScorer()
+  assert scorer.signal_factor(-30) == 1.0
+  assert scorer.signal_factor(-120) == 0.01
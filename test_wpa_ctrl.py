@@ -0,0 +1,168 @@
+import asyncio
+import threading
+import tempfile
+import socket
+import types
+import time
+import os
+
+import pytest
+
+from wpa_ctrl import *
+from iw_scan import Station
+from wifi_connection import WifiConnection, State
+
+class FakeSupplicant:
+  # answers like wpa_supplicant's ctrl_interface, one datagram per reply
+  def __init__(self, path):
+    self.path = path
+    self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    self.sock.bind(path)
+    self.sock.settimeout(0.1)
+    self.received = []
+    self.delays = {}
+    self.events = []
+    self.networks = 0
+    self.running = True
+    self.thread = threading.Thread(target=self.run, daemon=True)
+    self.thread.start()
+
+  def answer(self, cmd):
+    if cmd == 'PING':
+      return 'PONG\n'
+    if cmd == 'ADD_NETWORK':
+      self.networks += 1
+      return '%d\n' % (self.networks - 1)
+    if cmd.split(' ')[0] in ('ATTACH', 'REMOVE_NETWORK', 'SET_NETWORK', 'SELECT_NETWORK'):
+      return 'OK\n'
+    return 'FAIL\n'
+
+  def run(self):
+    while self.running:
+      try:
+        data, addr = self.sock.recvfrom(4096)
+      except socket.timeout:
+        continue
+      except OSError:
+        return
+      cmd = data.decode('utf-8')
+      self.received.append(cmd)
+      for event in self.events:
+        self.sock.sendto(bytes(event, 'utf-8'), addr)
+      self.events = []
+      delay = self.delays.get(cmd)
+      if delay != None:
+        time.sleep(delay)
+      self.sock.sendto(bytes(self.answer(cmd), 'utf-8'), addr)
+
+  def stop(self):
+    self.running = False
+    self.thread.join()
+    self.sock.close()
+
+@pytest.fixture
+def supplicant():
+  directory = tempfile.mkdtemp()
+  supplicant = FakeSupplicant(os.path.join(directory, 'wlp3s0'))
+  yield supplicant
+  supplicant.stop()
+  os.remove(supplicant.path)
+  os.rmdir(directory)
+
+def run(coro):
+  return asyncio.run(coro)
+
+def test_request_and_command(supplicant):
+  async def exchange():
+    ctrl = WpaCtrl(supplicant.path)
+    try:
+      assert await ctrl.request('PING') == 'PONG\n'
+      await ctrl.command('SELECT_NETWORK 0')
+      with pytest.raises(OSError):
+        await ctrl.command('BOGUS')
+    finally:
+      ctrl.close()
+    assert not os.path.exists(ctrl.local_path)
+  run(exchange())
+  assert supplicant.received == ['PING', 'SELECT_NETWORK 0', 'BOGUS']
+
+def test_unsolicited_messages_are_skipped(supplicant):
+  async def exchange():
+    ctrl = WpaCtrl(supplicant.path)
+    try:
+      await ctrl.attach()
+      supplicant.events = ['<3>CTRL-EVENT-SCAN-STARTED ', '<3>CTRL-EVENT-SCAN-RESULTS ']
+      return await ctrl.request('PING')
+    finally:
+      ctrl.close()
+  assert run(exchange()) == 'PONG\n'
+
+def test_timeout(supplicant):
+  supplicant.delays['PING'] = 0.3
+  async def exchange():
+    ctrl = WpaCtrl(supplicant.path)
+    try:
+      with pytest.raises(TimeoutError):
+        await ctrl.request('PING', timeout=0.05)
+      # the late PONG must not be taken as the answer to the next command
+      return await ctrl.request('ADD_NETWORK')
+    finally:
+      ctrl.close()
+  assert run(exchange()) == '0\n'
+
+def test_connect_without_server():
+  with pytest.raises(OSError):
+    WpaCtrl(os.path.join(tempfile.gettempdir(), 'interkonnect-no-such-socket'))
+
+def test_select_network_sequence(supplicant):
+  station = Station('a0:63:91:2e:01:14')
+  station.ssid = 'home'
+  # just the state select_network reads and writes
+  connection = types.SimpleNamespace(exiting=False, station=station, state=State.CONNECTING,
+                                     ready=[], states=[])
+  connection.print = lambda msg: None
+  connection.set_state = connection.states.append
+  connection.supplicant_ready = lambda: connection.ready.append(True)
+  params = [('ssid', '"home"'), ('psk', '0123456789abcdef'), ('scan_ssid', '1')]
+
+  async def exchange():
+    ctrl = WpaCtrl(supplicant.path)
+    try:
+      await WifiConnection.select_network(connection, ctrl, station, params)
+    finally:
+      ctrl.close()
+  run(exchange())
+  assert supplicant.received == [
+    'REMOVE_NETWORK all',
+    'ADD_NETWORK',
+    'SET_NETWORK 0 ssid "home"',
+    'SET_NETWORK 0 psk 0123456789abcdef',
+    'SET_NETWORK 0 scan_ssid 1',
+    'SELECT_NETWORK 0',
+  ]
+  assert connection.ready == [True]
+  assert connection.states == []
+
+def test_select_network_rejected(supplicant):
+  station = Station('a0:63:91:2e:01:14')
+  connection = types.SimpleNamespace(exiting=False, station=station, state=State.CONNECTING,
+                                     ready=[], states=[])
+  connection.print = lambda msg: None
+  connection.set_state = connection.states.append
+  connection.supplicant_ready = lambda: connection.ready.append(True)
+
+  async def exchange():
+    ctrl = WpaCtrl(supplicant.path)
+    try:
+      await WifiConnection.select_network(connection, ctrl, station, [('bogus_key', '1')])
+    finally:
+      ctrl.close()
+  supplicant.answer = lambda cmd: 'FAIL\n' if cmd.startswith('SET_NETWORK') else FakeSupplicant.answer(supplicant, cmd)
+  run(exchange())
+  assert supplicant.received[-1] == 'SET_NETWORK 0 bogus_key 1'
+  assert connection.ready == []
+  assert connection.states == [State.DISCONNECTED]
+
+def test_strip_priority():
+  assert strip_priority('<3>CTRL-EVENT-CONNECTED') == 'CTRL-EVENT-CONNECTED'
+  assert strip_priority('CTRL-EVENT-CONNECTED') == 'CTRL-EVENT-CONNECTED'
@@ -0,0 +1,135 @@
+import traceback
+import heapq
+import math
+
+from constants import *
+
+class Timer:
+  __slots__ = ('wheel', 'slot', 'callback', 'args', 'interval', 'cancelled')
+
+  def __init__(self, wheel, callback, args, interval):
+    self.wheel = wheel
+    self.slot = None
+    self.callback = callback
+    self.args = args
+    self.interval = interval
+    self.cancelled = False
+
+  def cancel(self):
+    if not self.cancelled:
+      self.cancelled = True
+      self.wheel.remove(self)
+
+class TimerWheel:
+  # every deadline is rounded up to the next slot of TIMER_GRANULARITY
+  # seconds, timers landing in the same slot share one loop wakeup
+  def __init__(self, loop, granularity=TIMER_GRANULARITY):
+    self.loop = loop
+    self.granularity = granularity
+    # slot -> [Timer]
+    self.slots = {}
+    self.heap = []
+    self.handle = None
+    self.armed_slot = None
+
+    self.wakeups = 0
+    self.start_time = loop.time()
+
+  def call_later(self, delay, callback, *args):
+    timer = Timer(self, callback, args, None)
+    self.add(timer, self.loop.time() + delay)
+    return timer
+
+  def call_every(self, interval, callback, *args):
+    timer = Timer(self, callback, args, interval)
+    self.add(timer, self.loop.time() + interval)
+    return timer
+
+  async def sleep(self, delay):
+    future = self.loop.create_future()
+    timer = self.call_later(delay, self.wake, future)
+    try:
+      await future
+    finally:
+      timer.cancel()
+
+  def wake(self, future):
+    if not future.done():
+      future.set_result(None)
+
+  def wakeups_per_second(self):
+    elapsed = self.loop.time() - self.start_time
+    if elapsed <= 0:
+      return 0.0
+    return self.wakeups / elapsed
+
+  def add(self, timer, deadline):
+    slot = math.ceil(deadline / self.granularity)
+    timer.slot = slot
+    timers = self.slots.get(slot)
+    if timers == None:
+      timers = []
+      self.slots[slot] = timers
+      heapq.heappush(self.heap, slot)
+    timers.append(timer)
+    self.arm()
+
+  def remove(self, timer):
+    timers = self.slots.get(timer.slot)
+    if timers == None:
+      return
+    try:
+      timers.remove(timer)
+    except ValueError:
+      return
+    if len(timers) == 0:
+      # the heap entry is dropped lazily when it reaches the top
+      del self.slots[timer.slot]
+      self.arm()
+
+  def arm(self):
+    while len(self.heap) > 0 and self.heap[0] not in self.slots:
+      heapq.heappop(self.heap)
+    if len(self.heap) == 0:
+      slot = None
+    else:
+      slot = self.heap[0]
+    if slot == self.armed_slot:
+      return
+    if self.handle != None:
+      self.handle.cancel()
+      self.handle = None
+    self.armed_slot = slot
+    if slot != None:
+      self.handle = self.loop.call_at(slot * self.granularity, self.fire)
+
+  def fire(self):
+    self.handle = None
+    self.armed_slot = None
+    self.wakeups += 1
+
+    now = self.loop.time()
+    due = []
+    while len(self.heap) > 0 and self.heap[0] * self.granularity <= now:
+      slot = heapq.heappop(self.heap)
+      timers = self.slots.pop(slot, None)
+      if timers != None:
+        due += timers
+
+    for timer in due:
+      if timer.cancelled:
+        continue
+      if timer.interval != None:
+        # periodic timers keep their phase but never fire twice to catch up
+        deadline = timer.slot * self.granularity + timer.interval
+        if deadline <= now:
+          deadline = now + timer.interval
+        self.add(timer, deadline)
+      else:
+        timer.cancelled = True
+      try:
+        timer.callback(*timer.args)
+      except Exception:
+        traceback.print_exc()
+
+    self.arm()
@@ -1,16 +1,25 @@
-import threading
 import subprocess
-import re
+import asyncio
 import time
-import queue
 import os
-import tempfile
 import pexpect
 import sys
 import datetime
 
 from constants import *
 from wifi_scanner import *
+from wpa_ctrl import *
+from reactor import *
+from events import *
+from daemon_output import *
+from probing import *
+from credentials import *
+from roaming import *
+from station_scoring import *
+from bss_table import *
+from metrics import *
+from supervisor import *
+from adopt import *
 
 METRIC = 9001
 
@@ -19,37 +28,127 @@ class State:
   CONNECTING = 0
   CONNECTED = 1
 
-class WifiConnection(threading.Thread):
+class WifiConnection:
 
   def __init__(self, parent, dev):
-    threading.Thread.__init__(self)
-
     self.parent = parent
     self.dev = dev
     self.exiting = False
     self.suppressed = False
-    self.event_queue = queue.Queue()
+    self.failover_start_time = None
+    self.event_queue = EventQueue(parent.reactor, self.dispatch)
     self.print('entering DISCONNECTED state')
     self.state = State.DISCONNECTED
-    self.temp_files = []
 
+    self.station = None
+    self.requested_ssid = None
+    self.request_handle = None
+    self.pinned_ssid = None
+    self.connecting_start_time = None
+    self.timeline = Timeline(parent.metrics, dev)
     self.wpa_supplicant = None
-    self.wpa_supplicant_prev_data = ''
-
+    self.wpa_ctrl = None
+    self.wpa_monitor = None
     self.dhcpcd = None
-    self.dhcpcd_prev_data = ''
+    self.watchdog_handle = None
+    self.child_backoff = RestartBackoff()
+    self.restart_handle = None
+    self.wpa_spawn_handle = None
+    self.dhcpcd_spawn_handle = None
+    # requests in flight on the control socket
+    self.wpa_tasks = set()
+
+    self.roam_station = None
+    self.roam_start_time = None
+    self.roam_timeout_handle = None
 
     self.disable_power_save()
 
+    self.credentials_path = os.environ['HOME'] + '/.ssh/wificred'
+    self.credentials = CredentialStore(self.credentials_path)
+    self.credentials_watcher = CredentialWatcher(self, self.credentials_path)
+    self.credential_compiler = CredentialCompiler(self.credentials_path)
     self.load_credentials()
 
-    self.scanner_thread = WifiScanThread(self)
-    self.scanner_thread.start()
+    self.scanner = WifiScanner(self)
+    self.scorer = make_scorer()
+    self.bss_table = BssTable()
+    self.roaming = RoamingEngine(self)
+    self.gateway = None
+    self.prober = ProbeEngine(self)
+
+    self.dispatcher = {}
+    self.dispatcher[WifiStations] = self.on_wifi_stations
+    self.dispatcher[Watchdog] = self.watchdog
+    self.dispatcher[WpaSupplicantLine] = self.on_wpa_supplicant
+    self.dispatcher[WpaSupplicantLog] = self.on_wpa_supplicant_log
+    self.dispatcher[WpaEvent] = self.on_wpa_monitor
+    self.dispatcher[DhcpcdLine] = self.on_dhcpcd
+    self.dispatcher[Suppress] = self.suppress
+    self.dispatcher[Unsuppress] = self.unsuppress
+    self.dispatcher[Roam] = self.on_roam
+    self.dispatcher[RoamTimeout] = self.on_roam_timeout
+    self.dispatcher[ScanRequest] = self.on_scan_request
+    self.dispatcher[ConnectRequest] = self.on_connect_request
+    self.dispatcher[PinRequest] = self.on_pin_request
+    self.dispatcher[ReloadCredentials] = self.on_reload_credentials
+    self.dispatcher[CredentialsChanged] = self.on_credentials_changed
+    self.dispatcher[ChildExit] = self.on_child_exit
+    self.dispatcher[ProbeHealth] = self.on_probe_health
+
+    self.dhcpcd_handlers = {}
+    self.dhcpcd_handlers[LeaseAcquired] = self.on_lease_acquired
+    self.dhcpcd_handlers[LeaseRejected] = self.on_lease_rejected
+    self.dhcpcd_handlers[LeaseExpired] = self.on_lease_expired
+    self.dhcpcd_handlers[AddressAdded] = self.on_address_added
+    self.dhcpcd_handlers[RouteAdded] = self.on_route_added
+    self.dhcpcd_handlers[DefaultRouteAdded] = self.on_default_route_added
+
+  def start(self):
+    if WPA_CTRL_MODE and self.wpa_supplicant == None:
+      self.start_wpa_supplicant_daemon()
+
+    self.scanner.start()
+    self.credentials_watcher.start()
+
+    self.watchdog_handle = self.parent.reactor.call_every(5.0, self.queue_watchdog_request)
+
+  def adopt(self, snapshot):
+    if not snapshot.connected() or snapshot.wpa_supplicant == None or snapshot.link == None:
+      return
+    if not WPA_CTRL_MODE:
+      # its output goes to whoever started it, a lost association would
+      # never be noticed and the link would stay CONNECTED
+      self.print('not adopting wpa_supplicant (pid %d) without WPA_CTRL_MODE' % (snapshot.wpa_supplicant))
+      return
+    bssid, ssid, freq = snapshot.link
+    if ssid not in self.recognized_connections:
+      self.print('associated with unrecognized "%s", not adopting it' % (ssid))
+      return
+    ctrl_path = os.path.join(WPA_CTRL_DIR, self.dev)
+    if not os.path.exists(ctrl_path):
+      return
 
-    self.queue_watchdog_request()
+    self.print('adopting existing connection to "%s" (%s) via %s' % (ssid, bssid, snapshot.gateway))
+    self.station = Station(bssid)
+    self.station.ssid = ssid
+    self.station.freq = freq
+    self.print('supervising running wpa_supplicant (pid %d)' % (snapshot.wpa_supplicant))
+    self.wpa_supplicant = AdoptedProcess(snapshot.wpa_supplicant, 'wpa_supplicant')
+    self.parent.supervisor.watch(self.wpa_supplicant, self.event_queue, 'wpa_supplicant')
+    self.child_backoff.started()
+    self.wpa_request(self.open_wpa_ctrl(self.wpa_supplicant, ctrl_path, time.monotonic() + 5.0))
+    if snapshot.dhcpcd != None:
+      self.print('supervising running dhcpcd (pid %d)' % (snapshot.dhcpcd))
+      self.dhcpcd = AdoptedProcess(snapshot.dhcpcd, 'dhcpcd')
+      self.parent.supervisor.watch(self.dhcpcd, self.event_queue, 'dhcpcd')
+    else:
+      # renews the lease in place, the address stays configured meanwhile
+      self.start_dhcpcd(snapshot.addrs[0].split('/')[0])
 
-    self.queue_listen_to_wpa_supplicant_request()
-    self.queue_listen_to_dhcpcd_request()
+    self.gateway = snapshot.gateway
+    self.print('entering CONNECTED state')
+    self.set_state(State.CONNECTED)
 
   def print(self, msg):
     sys.stdout.write(str(datetime.datetime.now()))
@@ -69,36 +168,112 @@ class WifiConnection(threading.Thread):
     self.print('attempting to turn off power save: %s' % (cmd))
     subprocess.call(cmd, shell=True)
 
+  def wpa_supplicant_key(self):
+    return 'wpa_supplicant:%s' % (self.dev)
+
+  def dhcpcd_key(self):
+    return 'dhcpcd:%s' % (self.dev)
+
+  def wpa_request(self, coro):
+    # control socket exchanges run as tasks so the reactor never waits on
+    # wpa_supplicant, the socket's lock keeps them in order
+    task = self.parent.reactor.spawn(coro)
+    self.wpa_tasks.add(task)
+    task.add_done_callback(self.wpa_tasks.discard)
+
   def kill_wpa_supplicant(self):
+    for task in list(self.wpa_tasks):
+      task.cancel()
+    if self.wpa_spawn_handle != None:
+      self.wpa_spawn_handle.cancel()
+      self.wpa_spawn_handle = None
+    if self.wpa_monitor != None:
+      self.parent.output_reader.unregister(self.wpa_monitor.sock)
+      self.wpa_monitor.close()
+      self.wpa_monitor = None
+    if self.wpa_ctrl != None:
+      self.wpa_ctrl.close()
+      self.wpa_ctrl = None
+    if self.wpa_supplicant != None:
+      self.parent.output_reader.unregister(self.wpa_supplicant)
+      self.parent.supervisor.terminate(self.wpa_supplicant, self.wpa_supplicant_key())
+      self.wpa_supplicant = None
+
+  def disconnect_wpa_supplicant(self):
+    # with a persistent supplicant only the network is dropped, the process
+    # and its driver state stay around for the next connection
+    if not WPA_CTRL_MODE:
+      self.kill_wpa_supplicant()
+      return
+    if self.wpa_ctrl == None:
+      # still starting up, it has no network yet
+      return
+    self.wpa_request(self.drop_network(self.wpa_ctrl))
+
+  async def drop_network(self, wpa_ctrl):
     try:
-      if self.wpa_supplicant != None:
-        self.wpa_supplicant.close(force=True)
-        self.wpa_supplicant = None
-    except:
-      pass
+      async with wpa_ctrl.lock:
+        await wpa_ctrl.command('DISCONNECT')
+        await wpa_ctrl.command('REMOVE_NETWORK all')
+    except asyncio.CancelledError:
+      raise
+    except Exception as e:
+      if self.exiting or wpa_ctrl is not self.wpa_ctrl:
+        return
+      self.print('failed to disconnect wpa_supplicant (%s), restarting it' % (e))
+      self.kill_wpa_supplicant()
+      self.start_wpa_supplicant_daemon()
 
   def kill_dhcpcd(self):
-    try:
-      if self.dhcpcd != None:
-        self.dhcpcd.close(force=True)
-        self.dhcpcd = None
-    except:
-      pass
+    if self.dhcpcd_spawn_handle != None:
+      self.dhcpcd_spawn_handle.cancel()
+      self.dhcpcd_spawn_handle = None
+    if self.dhcpcd != None:
+      self.parent.output_reader.unregister(self.dhcpcd)
+      self.parent.supervisor.terminate(self.dhcpcd, self.dhcpcd_key())
+      self.dhcpcd = None
+
+  def children(self):
+    return [child for child in [self.wpa_supplicant, self.dhcpcd] if child != None]
 
   def cleanup(self):
-    self.event_queue.put(['exiting', ''])
-    self.scanner_thread.exiting = True
     self.exiting = True
+    self.scanner.stop()
+    self.credentials_watcher.stop()
+    self.roaming.stop()
+    self.prober.stop()
+    self.cancel_roam()
+    self.cancel_connect_request()
+    if self.watchdog_handle != None:
+      self.watchdog_handle.cancel()
+      self.watchdog_handle = None
+    if self.restart_handle != None:
+      self.restart_handle.cancel()
+      self.restart_handle = None
 
     self.kill_dhcpcd()
     self.kill_wpa_supplicant()
 
-    for file in self.temp_files:
-      os.remove(file)
-    self.temp_files.clear()
+  def set_state(self, state):
+    self.state = state
+    self.update_scanner()
+    if state == State.CONNECTED:
+      self.roaming.start()
+      if PROBE_ENABLED:
+        self.prober.start(self.gateway)
+    else:
+      self.roaming.stop()
+      self.prober.stop()
+      self.cancel_roam()
+
+  def update_scanner(self):
+    suppressed = self.suppressed and not WIFI_STANDBY
+    # a pending connect request keeps scanning on a connected link too
+    wanted = self.state == State.DISCONNECTED or self.requested_ssid != None
+    self.scanner.set_active(wanted and not suppressed)
 
   def queue_watchdog_request(self):
-    self.event_queue.put(['watchdog', ''])
+    self.event_queue.put(Watchdog())
 
   def watchdog(self, args):
     if self.exiting:
@@ -106,116 +281,158 @@ class WifiConnection(threading.Thread):
 
     restart = False
 
-    if self.suppressed:
+    if self.suppressed and not WIFI_STANDBY:
       pass
     elif self.state == State.DISCONNECTED:
       pass
     elif self.state == State.CONNECTING:
-      now = datetime.datetime.now()
-      delta = now - self.connecting_start_time
-      secs = delta.total_seconds()
+      secs = time.monotonic() - self.connecting_start_time
       if secs > 30.0:
         restart = True
-    elif self.state == State.CONNECTED:
-      if self.dhcpcd == None or self.wpa_supplicant == None:
-        restart = True
-      elif not self.dhcpcd.isalive() or not self.wpa_supplicant.isalive():
-        restart = True
+        self.record_failure('timeout')
 
     if restart:
       self.print('watchdog tripped, killing processes and resetting state')
 
       self.kill_dhcpcd()
-      self.kill_wpa_supplicant()
-      self.state = State.DISCONNECTED
-
-    threading.Timer(5.0, self.queue_watchdog_request).start()
+      self.disconnect_wpa_supplicant()
+      self.set_state(State.DISCONNECTED)
 
   def load_credentials(self):
-    f = open(os.environ['HOME'] + '/.ssh/wificred')
-    lines = f.read().split('\n')
-    f.close()
-
-    self.recognized_connections = {}
-    for line in lines:
-      if len(line) == 0:
-        continue
-      if line.startswith("#"):
-        continue
-      index = line.find(',')
-      ssid = line[0:index]
-      cred = line[index+1:]
-      self.recognized_connections[ssid] = cred
+    credentials = self.credentials.read()
+    # compiled before anything is swapped, so a failure leaves the index and
+    # the compiled networks as they were
+    networks = self.credential_compiler.compile(credentials)
+    diff = self.credentials.swap(credentials)
+    # ssid -> Credential
+    self.recognized_connections = self.credentials.by_ssid
+    self.networks = networks
+    return diff
 
   def connect(self, station):
-    # TODO: need better heuristic in case there are two valid WiFi stations and
-    # I am moving between them. So far, the last time this happened, I was in
-    # college. Assume for now there is no reason to switch while you are connected
+    # moving to a better BSS of the same SSID while connected is handled by
+    # the roaming engine
     if self.state >= State.CONNECTING:
       return
+    if WPA_CTRL_MODE and self.wpa_ctrl == None:
+      # persistent wpa_supplicant is still starting up
+      return
 
-    self.print('connecting to wifi station "%s" (%s)' % (station['SSID'], station['bssid']))
+    self.print('connecting to wifi station "%s" (%s)' % (station.ssid, station.bssid))
     self.print('entering CONNECTING state')
-    self.connecting_start_time = datetime.datetime.now()
-    self.state = State.CONNECTING
-
-    cred_path = self.prepare_credentials(station)
-    self.start_wpa_supplicant(cred_path)
-
-  def prepare_credentials(self, station):
-    ssid = station['SSID']
-    assert ssid in self.recognized_connections
-
-    fd, path = tempfile.mkstemp(prefix='interkonnect.', dir='/tmp')
-    self.temp_files.append(path)
-
-    cred = self.recognized_connections[ssid]
-    if len(cred) > 0:
-      os.write(fd, bytes("network={\n", 'utf-8'))
-      os.write(fd, bytes("\tssid=\"%s\"\n" % (ssid), 'utf-8'))
-      os.write(fd, bytes("\tscan_ssid=1\n", 'utf-8'))
-      os.write(fd, bytes("\tpsk=\"", 'utf-8'))
-      os.write(fd, bytes(cred, 'utf-8'))
-      os.write(fd, bytes("\"\n", 'utf-8'))
-      os.write(fd, bytes("}\n", 'utf-8'))
+    self.timeline.reset()
+    self.connecting_start_time = self.timeline.mark('connect')
+    self.set_state(State.CONNECTING)
+    self.station = station
+    self.gateway = None
+
+    if WPA_CTRL_MODE:
+      self.wpa_request(self.select_network(self.wpa_ctrl, station, self.networks[station.ssid].params))
     else:
-      os.write(fd, bytes("network={\n", 'utf-8'))
-      os.write(fd, bytes("\tssid=\"%s\"\n" % (ssid), 'utf-8'))
-      os.write(fd, bytes("\tproto=RSN\n", 'utf-8'))
-      os.write(fd, bytes("\tkey_mgmt=NONE\n", 'utf-8'))
-      os.write(fd, bytes("}\n", 'utf-8'))
-    os.close(fd)
-
-    return path
+      cred_path = self.prepare_credentials(station)
+      self.start_wpa_supplicant(cred_path)
+
+  def supplicant_ready(self):
+    # the spawn may wait for the previous instance to exit, and the network
+    # is only selected once the control socket exchange is done
+    self.timeline.mark('supplicant')
+    self.timeline.observe('interkonnect_supplicant_spawn_seconds', 'connect', 'supplicant')
+
+  def prepare_credentials(self, station, pin_bssid=False):
+    network = self.networks[station.ssid]
+    if pin_bssid:
+      return self.credential_compiler.render_pinned(network, station.bssid, self.dev)
+    return network.config_path
+
+  async def select_network(self, wpa_ctrl, station, params):
+    try:
+      async with wpa_ctrl.lock:
+        await wpa_ctrl.command('REMOVE_NETWORK all')
+        network_id = (await wpa_ctrl.request('ADD_NETWORK')).strip()
+        for key, value in params:
+          await wpa_ctrl.command('SET_NETWORK %s %s %s' % (network_id, key, value))
+        await wpa_ctrl.command('SELECT_NETWORK %s' % (network_id))
+    except asyncio.CancelledError:
+      raise
+    except Exception as e:
+      if self.exiting or station is not self.station or self.state != State.CONNECTING:
+        return
+      self.print('failed to configure wpa_supplicant: %s' % (e))
+      self.print('entering DISCONNECTED state')
+      self.set_state(State.DISCONNECTED)
+      return
+    if station is self.station:
+      self.supplicant_ready()
 
   def start_wpa_supplicant(self, cred_path):
     self.kill_wpa_supplicant()
 
     cmd = '%s -i %s -c %s' % (WPA_SUPPLICANT, self.dev, cred_path)
-    self.wpa_supplicant = pexpect.spawn(cmd, timeout=5)
+    self.wpa_spawn_handle = self.parent.supervisor.when_gone(
+        self.wpa_supplicant_key(), self.spawn_wpa_supplicant, cmd, WpaSupplicantLine)
 
-  def queue_listen_to_wpa_supplicant_request(self):
-    self.event_queue.put(['listen_to_wpa_supplicant', ''])
+  def start_wpa_supplicant_daemon(self):
+    cmd = '%s -i %s -C %s' % (WPA_SUPPLICANT, self.dev, WPA_CTRL_DIR)
+    self.wpa_spawn_handle = self.parent.supervisor.when_gone(
+        self.wpa_supplicant_key(), self.spawn_wpa_supplicant_daemon, cmd)
 
-  def on_listen_to_wpa_supplicant(self, args):
-    if self.wpa_supplicant is not None:
+  def spawn_wpa_supplicant(self, cmd, event_class):
+    self.wpa_spawn_handle = None
+    if self.exiting:
+      return
+    self.wpa_supplicant = pexpect.spawn(cmd, timeout=5)
+    self.parent.output_reader.register(self.wpa_supplicant, self.event_queue, event_class)
+    self.parent.supervisor.watch(self.wpa_supplicant, self.event_queue, 'wpa_supplicant')
+    self.child_backoff.started()
+    # the persistent daemon is not spawned for any one connection
+    if event_class == WpaSupplicantLine:
+      self.supplicant_ready()
+
+  def spawn_wpa_supplicant_daemon(self, cmd):
+    os.makedirs(WPA_CTRL_DIR, mode=0o700, exist_ok=True)
+    ctrl_path = os.path.join(WPA_CTRL_DIR, self.dev)
+
+    self.print('starting persistent wpa_supplicant: %s' % (cmd))
+    # stdout is only logged, events arrive on the monitor socket
+    self.spawn_wpa_supplicant(cmd, WpaSupplicantLog)
+    if self.wpa_supplicant != None:
+      self.wpa_request(self.open_wpa_ctrl(self.wpa_supplicant, ctrl_path, time.monotonic() + 5.0))
+
+  async def open_wpa_ctrl(self, wpa_supplicant, ctrl_path, deadline):
+    # the control socket appears some time after the process starts
+    while not self.exiting and wpa_supplicant is self.wpa_supplicant:
+      wpa_ctrl = None
+      wpa_monitor = None
       try:
-        data = self.wpa_supplicant.read_nonblocking(9001, 0)
-        data = data.decode('utf-8')
-        data = self.wpa_supplicant_prev_data + data
-        tokens = data.split('\n')
-        if not tokens[-1].endswith('\n'):
-          self.wpa_supplicant_prev_data = tokens[-1]
-          tokens.pop()
-        else:
-          self.wpa_supplicant_prev_data = ''
-        for token in tokens:
-          self.event_queue.put(['wpa_supplicant', token.strip()])
-      except:
-        pass
-    threading.Timer(0.25, self.queue_listen_to_wpa_supplicant_request).start()
-
-  def start_dhcpcd(self):
+        wpa_ctrl = WpaCtrl(ctrl_path)
+        wpa_monitor = WpaCtrl(ctrl_path)
+        await wpa_monitor.attach()
+      except OSError as e:
+        if wpa_ctrl != None:
+          wpa_ctrl.close()
+        if wpa_monitor != None:
+          wpa_monitor.close()
+        if time.monotonic() > deadline or not wpa_supplicant.isalive():
+          self.print('failed to open wpa_supplicant control socket: %s' % (e))
+          return
+        await self.parent.reactor.sleep(0.05)
+        continue
+      except asyncio.CancelledError:
+        wpa_ctrl.close()
+        wpa_monitor.close()
+        raise
+
+      self.wpa_ctrl = wpa_ctrl
+      self.wpa_monitor = wpa_monitor
+      self.parent.output_reader.register_socket(self.wpa_monitor.sock, self.event_queue, WpaEvent)
+      self.scanner.request_scan()
+      return
+
+  def lease_keys(self):
+    ssid = self.station.ssid
+    return ['wifi:%s/%s' % (ssid, self.station.bssid), 'wifi:%s' % (ssid)]
+
+  def start_dhcpcd(self, address=None):
     self.kill_dhcpcd()
 
     cmd = '%s '
@@ -231,143 +448,414 @@ class WifiConnection(threading.Thread):
     cmd += '--noarp '
     # speed hack, no ARP check
     cmd += '--ipv4only '
+    # speed hack, ask for the previous address on this network first
+    if address == None:
+      address = self.parent.lease_cache.get(*self.lease_keys())
+    if address != None:
+      cmd += '--request %s ' % (address)
     # debug
     cmd += '-d '
     cmd += '%s'
     cmd = cmd % (DHCPCD, self.dev)
 
-    self.dhcpcd = pexpect.spawn(cmd, timeout=5)
-
-  def queue_listen_to_dhcpcd_request(self):
-    self.event_queue.put(['listen_to_dhcpcd', ''])
+    self.dhcpcd_spawn_handle = self.parent.supervisor.when_gone(self.dhcpcd_key(), self.spawn_dhcpcd, cmd)
 
-  def on_listen_to_dhcpcd(self, args):
-    if self.dhcpcd is not None:
-      try:
-        data = self.dhcpcd.read_nonblocking(9001, 0)
-        data = data.decode('utf-8')
-        data = self.dhcpcd_prev_data + data
-        tokens = data.split('\n')
-        if not tokens[-1].endswith('\n'):
-          self.dhcpcd_prev_data = tokens[-1]
-          tokens.pop()
-        else:
-          self.dhcpcd_prev_data = ''
-        for token in tokens:
-          self.event_queue.put(['dhcpcd', token.strip()])
-      except:
-        pass
-    threading.Timer(0.25, self.queue_listen_to_dhcpcd_request).start()
+  def spawn_dhcpcd(self, cmd):
+    self.dhcpcd_spawn_handle = None
+    if self.exiting:
+      return
+    self.dhcpcd = pexpect.spawn(cmd, timeout=5)
+    self.parent.output_reader.register(self.dhcpcd, self.event_queue, DhcpcdLine)
+    self.parent.supervisor.watch(self.dhcpcd, self.event_queue, 'dhcpcd')
+    self.child_backoff.started()
 
   def on_wifi_stations(self, args):
-    if self.suppressed:
+    if self.suppressed and not WIFI_STANDBY:
       return
 
-    stations = args
+    stations, freqs = args
+    appeared, lost, changed = self.bss_table.merge(stations, freqs)
+    for entry in appeared:
+      if entry.station.ssid in self.recognized_connections:
+        self.print('recognized station "%s" (%s) appeared at %.0f dBm' %
+                   (entry.station.ssid, entry.station.bssid, entry.signal))
+    for entry in lost:
+      if entry.station.ssid in self.recognized_connections:
+        self.print('recognized station "%s" (%s) lost' % (entry.station.ssid, entry.station.bssid))
+
+    if self.requested_ssid != None and self.switch_to(self.requested_ssid):
+      self.cancel_connect_request()
+      return
+    if self.state != State.DISCONNECTED:
+      return
+    self.connect_best()
 
-    # since the list should already be sorted by signal strength, the first
-    # recognized one should be the best
+  def best_station(self, ssids):
+    # rank on the smoothed history rather than this scan alone, so one noisy
+    # sample does not decide where we connect
     best_station = None
-    for station in stations:
-      if 'SSID' not in station:
+    best_score = None
+    for ssid in ssids:
+      credential = self.recognized_connections.get(ssid)
+      if credential == None:
         continue
-      ssid = station['SSID']
-      if ssid in self.recognized_connections:
-        best_station = station
-        break
+      for entry in self.bss_table.candidates(ssid):
+        if credential.bssid != None and entry.station.bssid.lower() != credential.bssid:
+          continue
+        weight = credential.weight
+        weight *= BSS_FAILURE_PENALTY ** entry.failures
+        weight *= self.parent.connection_history.weight(entry.station.bssid)
+        # priority decides first, the score only breaks ties
+        score = (credential.priority, self.scorer.score(entry.station, entry.signal, weight))
+        if best_score == None or score > best_score:
+          best_station = entry.station
+          best_score = score
+    return best_station
+
+  def connect_best(self):
+    if self.suppressed and not WIFI_STANDBY:
+      return
+
+    ssids = self.recognized_connections.keys()
+    if self.pinned_ssid != None:
+      ssids = [self.pinned_ssid]
+    station = self.best_station(ssids)
+    if station != None:
+      self.connect(station)
+
+  def on_scan_request(self, args):
+    self.scanner.request_scan()
+
+  def on_connect_request(self, ssid):
+    # one-shot: the current link is only dropped for a network that can be
+    # heard, otherwise scans get CONNECT_REQUEST_TIMEOUT seconds to find it
+    self.cancel_connect_request()
+    if self.state != State.DISCONNECTED and self.station.ssid == ssid:
+      return
+    if self.switch_to(ssid):
+      return
+    self.print('"%s" not in range yet, scanning for it' % (ssid))
+    self.requested_ssid = ssid
+    self.request_handle = self.parent.reactor.call_later(CONNECT_REQUEST_TIMEOUT, self.expire_connect_request)
+    self.update_scanner()
+    self.scanner.request_scan([ssid])
+
+  def switch_to(self, ssid):
+    if self.suppressed and not WIFI_STANDBY:
+      return False
+    station = self.best_station([ssid])
+    if station == None:
+      return False
+    if self.state != State.DISCONNECTED:
+      self.print('switching to "%s" on request' % (ssid))
+      self.kill_dhcpcd()
+      self.disconnect_wpa_supplicant()
+      self.print('entering DISCONNECTED state')
+      self.set_state(State.DISCONNECTED)
+    self.connect(station)
+    return True
+
+  def expire_connect_request(self):
+    self.request_handle = None
+    if self.requested_ssid != None:
+      self.print('"%s" did not show up within %d seconds, dropping the request' %
+                 (self.requested_ssid, CONNECT_REQUEST_TIMEOUT))
+    self.requested_ssid = None
+    self.update_scanner()
+
+  def cancel_connect_request(self):
+    if self.request_handle != None:
+      self.request_handle.cancel()
+      self.request_handle = None
+    if self.requested_ssid != None:
+      self.requested_ssid = None
+      self.update_scanner()
+
+  def on_pin_request(self, ssid):
+    self.pinned_ssid = ssid
+    if ssid == None:
+      self.print('unpinned')
+      return
+    self.print('pinned to "%s"' % (ssid))
+    self.on_connect_request(ssid)
 
-    if best_station == None:
+  def on_reload_credentials(self, args):
+    self.print('reloading credentials')
+    try:
+      diff = self.load_credentials()
+    except (OSError, ValueError, subprocess.CalledProcessError) as e:
+      self.print('failed to reload credentials, keeping the previous ones: %s' % (e))
       return
-    self.connect(best_station)
+    self.event_queue.put(CredentialsChanged(diff))
+
+  def on_credentials_changed(self, diff):
+    added, removed, changed = diff
+    self.print('credentials: %d added, %d removed, %d changed' % (len(added), len(removed), len(changed)))
+    if self.requested_ssid in removed:
+      self.cancel_connect_request()
+    if self.pinned_ssid in removed:
+      self.pinned_ssid = None
+
+    if self.state != State.DISCONNECTED and (self.station.ssid in removed or self.station.ssid in changed):
+      self.print('credentials of "%s" changed, reconnecting' % (self.station.ssid))
+      self.kill_dhcpcd()
+      self.disconnect_wpa_supplicant()
+      self.print('entering DISCONNECTED state')
+      self.set_state(State.DISCONNECTED)
+
+    if len(added) > 0:
+      self.scanner.request_scan(added)
+    elif self.state == State.DISCONNECTED:
+      self.connect_best()
 
   def on_wpa_supplicant(self, args):
-    print('******** ' + args)
-    m = re.match(self.dev + ': (.+)', args)
-    if m == None:
+    if LOG_DAEMON_OUTPUT:
+      self.print('wpa_supplicant: ' + args)
+    prefix = self.dev + ': '
+    if not args.startswith(prefix):
       return
-    msg = m.group(1)
+    msg = args[len(prefix):]
     self.print(msg)
-    if msg.startswith('CTRL-EVENT-CONNECTED'):
-      self.parent.flush_device_ip_addr(self.dev)
-      self.print('wpa_supplicant reports successful connection, starting dhcpcd')
-      self.start_dhcpcd()
-    elif msg.startswith('CTRL-EVENT-DISCONNECTED'):
-      self.print('wpa_supplicant reports disconnection, killing dhcpcd and wpa_supplicant')
+    self.on_wpa_event(msg)
 
-      self.kill_dhcpcd()
-      self.kill_wpa_supplicant()
+  def on_wpa_supplicant_log(self, args):
+    if LOG_DAEMON_OUTPUT:
+      self.print('wpa_supplicant: ' + args)
 
-      self.print('entering DISCONNECTED state')
-      self.state = State.DISCONNECTED
+  def on_wpa_monitor(self, args):
+    msg = strip_priority(args).strip()
+    self.print(msg)
+    self.on_wpa_event(msg)
+
+  def on_roam(self, station):
+    if self.state != State.CONNECTED or self.roam_station != None:
+      return
+    credential = self.recognized_connections.get(self.station.ssid)
+    if credential != None and credential.bssid != None:
+      return
+
+    self.print('roaming from %s to %s' % (self.station.bssid, station.bssid))
+    self.roam_station = station
+    self.roam_start_time = time.monotonic()
+    self.roam_timeout_handle = self.parent.reactor.call_later(
+        ROAM_TIMEOUT, self.event_queue.put, RoamTimeout(station))
+
+    if WPA_CTRL_MODE:
+      self.wpa_request(self.request_roam(self.wpa_ctrl, station))
+    else:
+      # dhcpcd keeps running, the new supplicant only reassociates
+      cred_path = self.prepare_credentials(station, True)
+      self.start_wpa_supplicant(cred_path)
+
+  async def request_roam(self, wpa_ctrl, station):
+    try:
+      async with wpa_ctrl.lock:
+        await wpa_ctrl.command('ROAM %s' % (station.bssid))
+    except asyncio.CancelledError:
+      raise
+    except Exception as e:
+      if station is not self.roam_station:
+        return
+      self.print('roam request failed: %s' % (e))
+      self.cancel_roam()
+
+  def cancel_roam(self):
+    if self.roam_timeout_handle != None:
+      self.roam_timeout_handle.cancel()
+      self.roam_timeout_handle = None
+    self.roam_station = None
+    self.roam_start_time = None
+
+  def on_roam_timeout(self, station):
+    if station is not self.roam_station:
+      return
+    self.print('roam to %s timed out after %d seconds, resetting' % (station.bssid, ROAM_TIMEOUT))
+    self.kill_dhcpcd()
+    self.disconnect_wpa_supplicant()
+    self.print('entering DISCONNECTED state')
+    self.set_state(State.DISCONNECTED)
+
+  def on_wpa_event(self, msg):
+    message = parse_wpa(msg, self.dev)
+    if type(message) == Associated:
+      self.on_associated(message)
+    elif type(message) == Disassociated:
+      self.on_disassociated(message)
+
+  def on_associated(self, message):
+    if self.roam_station != None:
+      secs = time.monotonic() - self.roam_start_time
+      self.print('roamed to %s in %.3f seconds' % (self.roam_station.bssid, secs))
+      self.station = self.roam_station
+      self.cancel_roam()
+      if self.dhcpcd != None and self.dhcpcd.isalive():
+        return
+
+    self.timeline.mark('associated')
+    self.timeline.observe('interkonnect_association_seconds', 'connect', 'associated')
+    self.parent.flush_device_ip_addr(self.dev)
+    self.print('wpa_supplicant reports successful connection, starting dhcpcd')
+    self.start_dhcpcd()
+
+  def is_current_bss(self, bssid):
+    for station in [self.station, self.roam_station]:
+      if station != None and station.bssid.lower() == bssid.lower():
+        return True
+    return False
+
+  def on_disassociated(self, message):
+    # the DISCONNECT we send when switching networks is reported after the
+    # next attempt started, it must not count against the new station
+    if message.bssid != None and not self.is_current_bss(message.bssid):
+      self.print('ignoring disconnection from previous station %s' % (message.bssid))
+      return
+    self.print('wpa_supplicant reports disconnection, killing dhcpcd and wpa_supplicant')
+    if self.state == State.CONNECTING:
+      self.record_failure('disconnected')
+
+    self.kill_dhcpcd()
+    self.disconnect_wpa_supplicant()
+
+    self.print('entering DISCONNECTED state')
+    self.set_state(State.DISCONNECTED)
 
   def on_dhcpcd(self, args):
-    print('******** ' + args)
-    #m = re.match(r'dhcpcd\[(\d+)\]: (.+): (.+)', args)
-    #if m == None:
-      #return
-    #pid = m.group(1)
-    #dev = m.group(2)
-    #msg = m.group(3)
-    m = re.match(r'(.+?): (.+)', args)
-    if m == None:
-      return
-    dev = m.group(1)
-    msg = m.group(2)
-
-    m = re.match(r'acknowledged ([\d\.]+) from ([\d\.]+)', msg)
-    if m != None:
-      myip = m.group(1)
-      gateway = m.group(2)
-      self.print('gateway: ' + gateway)
-
-    m = re.match(r'adding IP address ([\d\.]+)/(\d+)', msg)
-    if m != None:
-      myip = m.group(1)
-      subnetmask = m.group(2)
-      self.print('my ip address: ' + myip)
-
-    m = re.match(r'adding route to ([\d\.]+)/(\d+)', msg)
-    if m != None:
-      routeip = m.group(1)
-      subnetmask = m.group(2)
-      self.print('adding route to: ' + routeip + '/' + subnetmask)
-      self.state = State.CONNECTED
-      self.print('entering CONNECTED state')
-
-    m = re.match(r'adding default route via ([\d\.]+)', msg)
-    if m != None:
-      gateway = m.group(1)
-      self.print('adding default route via: ' + gateway)
+    if LOG_DAEMON_OUTPUT:
+      self.print('dhcpcd: ' + args)
+    message = parse_dhcpcd(args)
+    if message == None:
+      return
+    handler = self.dhcpcd_handlers.get(type(message))
+    if handler != None:
+      handler(message)
+
+  def on_lease_acquired(self, message):
+    self.print('gateway: ' + message.server)
+    self.timeline.mark('dhcp')
+    self.timeline.observe('interkonnect_dhcp_seconds', 'associated', 'dhcp')
+    self.parent.lease_cache.put(self.lease_keys(), message.address, message.server)
+
+  def on_lease_rejected(self, message):
+    self.print('previous lease rejected, forgetting it')
+    self.parent.lease_cache.forget(self.lease_keys())
+
+  def on_lease_expired(self, message):
+    self.print('lease expired, waiting for dhcpcd to rebind')
+    if self.state == State.CONNECTED:
+      self.timeline.reset()
+      self.connecting_start_time = time.monotonic()
+      self.print('entering CONNECTING state')
+      self.set_state(State.CONNECTING)
+
+  def on_address_added(self, message):
+    self.print('my ip address: ' + message.address)
+
+  def on_route_added(self, message):
+    self.print('adding route to: ' + message.network + '/' + message.prefixlen)
+    if self.state == State.CONNECTING:
+      self.timeline.mark('route')
+      self.timeline.observe('interkonnect_route_seconds', 'dhcp', 'route')
+      self.timeline.observe('interkonnect_time_to_connectivity_seconds', 'connect', 'route')
+      self.record_success()
+    self.set_state(State.CONNECTED)
+    self.print('entering CONNECTED state')
+    self.report_failover()
+
+  def on_default_route_added(self, message):
+    self.print('adding default route via: ' + message.gateway)
+    if message.gateway == self.gateway:
+      return
+    self.gateway = message.gateway
+    if PROBE_ENABLED and self.state == State.CONNECTED:
+      self.prober.stop()
+      self.prober.start(self.gateway)
+
+  def on_probe_health(self, healthy):
+    if healthy or self.state != State.CONNECTED:
+      return
+    # associated with an address but no traffic gets through, e.g. a
+    # captive portal, let the ranking try another network
+    self.print('no connectivity through "%s" (%s), reconnecting' % (self.station.ssid, self.station.bssid))
+    self.record_failure('unreachable')
+    self.kill_dhcpcd()
+    self.disconnect_wpa_supplicant()
+    self.print('entering DISCONNECTED state')
+    self.set_state(State.DISCONNECTED)
+
+  def on_child_exit(self, name):
+    delay = self.child_backoff.next_delay()
+    self.print('%s exited, resetting state' % (name))
+    if self.state == State.CONNECTING:
+      self.record_failure('crash')
+
+    self.kill_dhcpcd()
+    if WPA_CTRL_MODE and name == 'wpa_supplicant':
+      self.kill_wpa_supplicant()
+      self.print('restarting wpa_supplicant daemon in %.1f seconds' % (delay))
+      self.restart_handle = self.parent.reactor.call_later(delay, self.restart_wpa_supplicant_daemon)
+    else:
+      self.disconnect_wpa_supplicant()
+    if self.state != State.DISCONNECTED:
+      self.print('entering DISCONNECTED state')
+      self.set_state(State.DISCONNECTED)
+    # a child that keeps crashing should not be respawned in a tight loop
+    self.scanner.defer(delay)
+
+  def restart_wpa_supplicant_daemon(self):
+    self.restart_handle = None
+    if self.exiting:
+      return
+    self.start_wpa_supplicant_daemon()
+
+  def record_failure(self, outcome):
+    self.bss_table.record_failure(self.station.bssid)
+    self.parent.connection_history.record(self.station.ssid, self.station.bssid, outcome)
+
+  def record_success(self):
+    self.bss_table.record_success(self.station.bssid)
+    assoc_secs = None
+    dhcp_secs = None
+    associated_time = self.timeline.get('associated')
+    route_time = self.timeline.get('route')
+    if associated_time != None and route_time != None:
+      assoc_secs = associated_time - self.connecting_start_time
+      dhcp_secs = route_time - associated_time
+    self.parent.connection_history.record(self.station.ssid, self.station.bssid,
+                                          'connected', assoc_secs, dhcp_secs)
 
   def suppress(self, args):
     self.suppressed = True
+    self.update_scanner()
+    if WIFI_STANDBY:
+      self.print('ethernet is up, keeping WiFi as warm standby')
+      return
     self.kill_dhcpcd()
-    self.kill_wpa_supplicant()
+    self.disconnect_wpa_supplicant()
     self.parent.flush_device_ip_addr(self.dev)
     self.print('entering DISCONNECTED state')
-    self.state = State.DISCONNECTED
+    self.set_state(State.DISCONNECTED)
 
   def unsuppress(self, args):
     self.suppressed = False
+    self.failover_start_time = args
+    # the cable was pulled, look for a network right away
+    self.scanner.request_scan()
+    self.update_scanner()
+    if self.state == State.CONNECTED:
+      self.report_failover()
+
+  def report_failover(self):
+    if self.failover_start_time == None:
+      return
+    secs = time.monotonic() - self.failover_start_time
+    self.failover_start_time = None
+    self.parent.metrics.observe('interkonnect_failover_seconds', self.dev, secs)
+    self.print('failover from ethernet took %.3f seconds' % (secs))
+
+  def dispatch(self, event):
+    if self.exiting:
+      return
 
-  def run(self):
-    dispatcher = {}
-    dispatcher['wifi_stations'] = self.on_wifi_stations
-    dispatcher['watchdog'] = self.watchdog
-    dispatcher['wpa_supplicant'] = self.on_wpa_supplicant
-    dispatcher['listen_to_wpa_supplicant'] = self.on_listen_to_wpa_supplicant
-    dispatcher['dhcpcd'] = self.on_dhcpcd
-    dispatcher['listen_to_dhcpcd'] = self.on_listen_to_dhcpcd
-    dispatcher['suppress'] = self.suppress
-    dispatcher['unsuppress'] = self.unsuppress
-
-    while True:
-      event = self.event_queue.get()
-      event_type = event[0]
-      args = event[1]
-
-      if event_type == 'exiting':
-        break
-
-      if event_type in dispatcher:
-        dispatcher[event_type](args)
+    handler = self.dispatcher.get(type(event))
+    if handler != None:
+      handler(event.args)
@@ -1,62 +1,174 @@
-import threading
+import asyncio
 import subprocess
-import re
+import operator
 import time
-import wifi_connection
+import re
 
 from constants import *
+from scan_planner import *
+from iw_scan import *
+from events import *
 
-class WifiScanThread(threading.Thread):
+class WifiScanner:
   def __init__(self, parent):
-    threading.Thread.__init__(self)
-
     self.parent = parent
     self.dev = parent.dev
+    self.reactor = parent.parent.reactor
     self.event_queue = parent.event_queue
+    self.planner = ScanPlanner()
 
     self.exiting = False
 
-  def scan(self):
-    cmd = '%s dev %s scan' % (IW, self.dev)
-    output = subprocess.check_output(cmd, shell=True).decode('utf-8')
-    if self.exiting:
-      return
-    lines = output.split('\n')
-
-    stations = []
-
-    station = None
-    for line in lines:
-      if len(line) == 0:
-        continue;
-
-      if line[0] != '\t':
-        # new station
-        station = {}
-        stations.append(station)
-        m = re.match(r'BSS (.+)\(on (.+)\)', line)
-        station['bssid'] = m.group(1)
-        station['dev'] = m.group(2)
-      else:
-        m = re.match(r'\t*(.+?):\s(.+)', line)
-        if m == None:
-          continue
-        station[m.group(1)] = m.group(2)
-
-    def getkey(a):
-      return float(a['signal'][:-4])
-    stations.sort(key=getkey)
-    stations.reverse()
-
-    self.event_queue.put(['wifi_stations', stations])
-
-  def run(self):
+    self.wakeup = asyncio.Event()
+    self.active = True
+    self.scan_requested = True
+    self.next_scan_time = 0
+    self.last_scan_time = None
+    self.interval = WIFI_SCAN_INTERVAL
+    self.scan_count = 0
+    self.targeted_ssids = set()
+    self.task = None
+
+  def start(self):
+    self.task = self.reactor.spawn(self.run())
+
+  def stop(self):
+    self.exiting = True
+    if self.task != None:
+      self.task.cancel()
+      self.task = None
+
+  def set_active(self, active):
+    # only scan while disconnected and not suppressed, otherwise sleep until
+    # woken up without any periodic wakeups
+    if active and not self.active:
+      self.scan_requested = True
+    self.active = active
+    self.wakeup.set()
+
+  def request_scan(self, ssids=None):
+    if ssids != None:
+      self.targeted_ssids.update(ssids)
+    self.scan_requested = True
+    self.interval = WIFI_SCAN_INTERVAL
+    self.wakeup.set()
+
+  def defer(self, delay):
+    self.scan_requested = False
+    self.next_scan_time = max(self.next_scan_time, time.monotonic() + delay)
+
+  def backoff(self, found):
+    if found:
+      self.interval = WIFI_SCAN_INTERVAL
+    else:
+      interval = min(self.interval * 2, WIFI_SCAN_MAX_INTERVAL)
+      if interval != self.interval:
+        self.parent.print('no recognized network in scan #%d, next scan in %d seconds' % (self.scan_count, interval))
+      self.interval = interval
+    self.next_scan_time = time.monotonic() + self.interval
+
+  async def wait_for_scan(self):
     while True:
       if self.exiting:
+        return False
+      self.wakeup.clear()
+      if not self.active:
+        await self.wakeup.wait()
+        continue
+      next_scan_time = self.next_scan_time
+      if self.scan_requested:
+        # never scan back to back, even when asked to
+        next_scan_time = 0
+        if self.last_scan_time != None:
+          next_scan_time = self.last_scan_time + WIFI_SCAN_MIN_INTERVAL
+      timeout = next_scan_time - time.monotonic()
+      if timeout <= 0:
         break
-      if self.parent.state == wifi_connection.State.DISCONNECTED and not self.parent.suppressed:
-        try:
-          self.scan()
-        except:
-          pass
-      time.sleep(WIFI_SCAN_INTERVAL)
+      timer = self.reactor.call_later(timeout, self.wakeup.set)
+      try:
+        await self.wakeup.wait()
+      finally:
+        timer.cancel()
+    self.scan_requested = False
+    self.scan_count += 1
+    self.last_scan_time = time.monotonic()
+    # in case the scan fails, try again after the current interval
+    self.next_scan_time = time.monotonic() + self.interval
+    return True
+
+  async def iw_scan(self, args):
+    cmd = [IW, 'dev', self.dev, 'scan'] + args
+    proc = await asyncio.create_subprocess_exec(*cmd, stdout=subprocess.PIPE,
+                                                stderr=subprocess.DEVNULL)
+    parser = ScanParser()
+    try:
+      async for line in proc.stdout:
+        parser.feed(line.decode('utf-8', errors='replace'))
+    except BaseException:
+      try:
+        proc.kill()
+      except ProcessLookupError:
+        pass
+      raise
+    returncode = await proc.wait()
+    if returncode != 0:
+      raise subprocess.CalledProcessError(returncode, cmd)
+
+    stations = parser.stations
+    stations.sort(key=operator.attrgetter('signal'), reverse=True)
+    return stations
+
+  async def scan(self):
+    ssids = list(self.parent.recognized_connections.keys())
+    if len(self.targeted_ssids) > 0:
+      # probe for newly added networks on every channel, the rest of them
+      # in the next scan
+      targeted = sorted(self.targeted_ssids)[:self.planner.named_slots()]
+      args = self.planner.probes(targeted)
+      self.targeted_ssids.difference_update(targeted)
+      if len(self.targeted_ssids) > 0:
+        self.scan_requested = True
+    else:
+      args = self.planner.plan(ssids, self.parent.credentials.hidden)
+    start = time.monotonic()
+    stations = await self.iw_scan(args)
+    self.parent.parent.metrics.observe('interkonnect_scan_seconds', self.dev, time.monotonic() - start)
+    if self.exiting:
+      return
+
+    freqs = covered_freqs(args)
+    found = self.planner.record(stations, ssids, freqs == None)
+    self.backoff(found)
+    self.event_queue.put(WifiStations((stations, freqs)))
+
+  async def read_max_ssids(self):
+    # `iw dev <dev> info` names the phy, `iw phy <phy> info` its limits
+    try:
+      info = await self.iw_output([IW, 'dev', self.dev, 'info'])
+      m = re.search(r'wiphy (\d+)', info)
+      if m == None:
+        return
+      info = await self.iw_output([IW, 'phy', 'phy' + m.group(1), 'info'])
+    except (OSError, subprocess.CalledProcessError):
+      return
+    m = re.search(r'max # scan SSIDs: (\d+)', info)
+    if m != None and int(m.group(1)) > 0:
+      self.planner.max_ssids = int(m.group(1))
+
+  async def iw_output(self, cmd):
+    proc = await asyncio.create_subprocess_exec(*cmd, stdout=subprocess.PIPE,
+                                                stderr=subprocess.DEVNULL)
+    output, _ = await proc.communicate()
+    if proc.returncode != 0:
+      raise subprocess.CalledProcessError(proc.returncode, cmd)
+    return output.decode('utf-8', errors='replace')
+
+  async def run(self):
+    await self.read_max_ssids()
+    while await self.wait_for_scan():
+      try:
+        await self.scan()
+      except asyncio.CancelledError:
+        raise
+      except:
+        pass
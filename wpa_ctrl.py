@@ -0,0 +1,73 @@
+import asyncio
+import socket
+import os
+import itertools
+
+counter = itertools.count()
+
+class WpaCtrl:
+  def __init__(self, ctrl_path):
+    self.local_path = '/tmp/interkonnect.wpa_ctrl.%d.%d' % (os.getpid(), next(counter))
+    if os.path.exists(self.local_path):
+      os.remove(self.local_path)
+
+    self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    self.sock.bind(self.local_path)
+    try:
+      self.sock.connect(ctrl_path)
+    except OSError:
+      self.close()
+      raise
+    self.sock.setblocking(False)
+    # a multi-command exchange holds it so exchanges never interleave
+    self.lock = asyncio.Lock()
+    # replies not read yet, including those of requests that gave up
+    self.owed = 0
+
+  def fileno(self):
+    return self.sock.fileno()
+
+  def close(self):
+    self.sock.close()
+    try:
+      os.remove(self.local_path)
+    except OSError:
+      pass
+
+  async def request(self, cmd, timeout=2.0):
+    loop = asyncio.get_running_loop()
+    await loop.sock_sendall(self.sock, bytes(cmd, 'utf-8'))
+    self.owed += 1
+    try:
+      return await asyncio.wait_for(self.reply(loop), timeout)
+    except asyncio.TimeoutError:
+      raise TimeoutError('wpa_supplicant did not answer "%s"' % (cmd))
+
+  async def reply(self, loop):
+    while True:
+      reply = (await loop.sock_recv(self.sock, 4096)).decode('utf-8', errors='replace')
+      # unsolicited event on an attached socket, not our reply
+      if reply.startswith('<'):
+        continue
+      # replies carry no id, but they come in order: a late one answers a
+      # request that already timed out
+      self.owed -= 1
+      if self.owed > 0:
+        continue
+      return reply
+
+  async def command(self, cmd):
+    reply = await self.request(cmd)
+    if reply.strip() != 'OK':
+      raise OSError('wpa_supplicant rejected "%s": %s' % (cmd, reply.strip()))
+
+  async def attach(self):
+    await self.command('ATTACH')
+
+def strip_priority(msg):
+  # monitor messages are prefixed with their log level, e.g. "<3>CTRL-EVENT-..."
+  if msg.startswith('<'):
+    index = msg.find('>')
+    if index != -1:
+      return msg[index+1:]
+  return msg